@@ -9,6 +9,11 @@ from twisted.internet import reactor
 
 import pkg_resources
 
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
 def ShellCommand_describe(self, done=False):
     """Return a list of short strings to describe this step, for the
     status display. This uses the first few words of the shell command.
@@ -77,6 +82,44 @@ if pkg_resources.get_distribution('buildbot').version == '0.7.9':
     log.msg('Monkey patched buildbot.steps.shell.Test.describe')
     del shell
 
+# How the environment of shell commands is reported by slaves: ``full``
+# sends it for every command, ``diff`` sends it for the first command of a
+# build and only the changed variables afterwards, ``hash`` only sends a
+# checksum and ``off`` sends nothing. Set by the slave buildbot.tac.
+environment_header = 'full'
+
+def _environmentHeader(self):
+    """Return the environment header line(s) of a shell command"""
+    environ = self.environ
+    names = environ.keys()
+    names.sort()
+    if environment_header == 'off':
+        return None
+    if environment_header == 'hash':
+        digest = sha1()
+        for name in names:
+            digest.update("%s=%s\0" % (name, environ[name]))
+        return " environment: %d variables, sha1 %s\n" % (
+            len(names), digest.hexdigest())
+    baseline = getattr(self.builder, '_reported_environ', None)
+    if environment_header == 'diff' and baseline is not None:
+        msg = ""
+        for name in names:
+            if baseline.get(name) != environ[name]:
+                msg += "  %s=%s\n" % (name, environ[name])
+        for name in sorted(baseline.keys()):
+            if name not in environ:
+                msg += "  unset %s\n" % name
+        if not msg:
+            return " environment: unchanged\n"
+        return " environment changes:\n" + msg
+    if environment_header == 'diff':
+        self.builder._reported_environ = environ.copy()
+    msg = " environment:\n"
+    for name in names:
+        msg += "  %s=%s\n" % (name, environ[name])
+    return msg
+
 def _startCommand(self):
     # ensure workdir exists
     if not os.path.isdir(self.workdir):
@@ -120,48 +163,50 @@ def _startCommand(self):
     # bad.
     msg = " ".join(argv)
     log.msg(" " + msg)
-    self.sendStatus({'header': msg+"\n"})
+    # the header lines are sent to the master in a single update
+    headers = [msg+"\n"]
 
     # then comes the secondary information
     msg = " in dir %s" % (self.workdir,)
     if self.timeout:
         msg += " (timeout %d secs)" % (self.timeout,)
     log.msg(" " + msg)
-    self.sendStatus({'header': msg+"\n"})
+    headers.append(msg+"\n")
 
     msg = " watching logfiles %s" % (self.logfiles,)
     log.msg(" " + msg)
-    self.sendStatus({'header': msg+"\n"})
+    headers.append(msg+"\n")
 
     # then the argv array for resolving unambiguity
     msg = " argv: %s" % (argv,)
     log.msg(" " + msg)
-    self.sendStatus({'header': msg+"\n"})
+    headers.append(msg+"\n")
 
     # then the environment, since it sometimes causes problems
-    msg = " environment:\n"
-    env_names = self.environ.keys()
-    env_names.sort()
-    for name in env_names:
-        msg += "  %s=%s\n" % (name, self.environ[name])
-    log.msg(" environment: %s" % (self.environ,))
-    self.sendStatus({'header': msg})
+    msg = _environmentHeader(self)
+    if msg is not None:
+        if environment_header == 'full':
+            log.msg(" environment: %s" % (self.environ,))
+        else:
+            log.msg(msg.rstrip())
+        headers.append(msg)
 
     if self.initialStdin:
         msg = " writing %d bytes to stdin" % len(self.initialStdin)
         log.msg(" " + msg)
-        self.sendStatus({'header': msg+"\n"})
+        headers.append(msg+"\n")
 
     if self.keepStdinOpen:
         msg = " leaving stdin open"
     else:
         msg = " closing stdin"
     log.msg(" " + msg)
-    self.sendStatus({'header': msg+"\n"})
+    headers.append(msg+"\n")
 
     msg = " using PTY: %s" % bool(self.usePTY)
     log.msg(" " + msg)
-    self.sendStatus({'header': msg+"\n"})
+    headers.append(msg+"\n")
+    self.sendStatus({'header': ''.join(headers)})
 
     # this will be buffered until connectionMade is called
     if self.initialStdin:
@@ -203,6 +248,140 @@ def _startCommand(self):
 from buildbot.slave import commands
 commands.ShellCommand._startCommand = _startCommand
 
+_SourceBase_start = commands.SourceBase.start
+
+def SourceBase_start(self):
+    # builds start with a source step, the next shell command reports the
+    # full environment again
+    self.builder._reported_environ = None
+    return _SourceBase_start(self)
+
+commands.SourceBase.start = SourceBase_start
+
+#
+# patching SlaveBuilder so status updates are batched
+#
+
+# updates of a command are held at most update_interval seconds, or until
+# update_size bytes of output are pending, and sent in one message. An
+# interval of 0 sends every update at once, as buildbot does.
+update_interval = 0.1
+update_size = 16 * 1024
+
+# zlib level used to compress the output sent to the master, 0 sends it as
+# is. Smaller chunks are not worth compressing.
+compress_output = 0
+compress_min_size = 1024
+
+import zlib
+from buildbot.slave.bot import SlaveBuilder
+
+def _compressUpdate(data):
+    if not compress_output or len(data) != 1:
+        return data
+    key, value = data.items()[0]
+    if key not in ('stdout', 'stderr', 'header') or \
+       len(value) < compress_min_size:
+        return data
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return {'compressed': (key, zlib.compress(value, compress_output))}
+
+def _updateSize(data):
+    return sum([len(value) for value in data.values()
+                if isinstance(value, basestring)])
+
+def SlaveBuilder_sendUpdate(self, data):
+    if not self.running:
+        return
+    if not self.remoteStep:
+        return
+    if not update_interval:
+        return _SlaveBuilder_sendUpdate(self, _compressUpdate(data))
+    if getattr(self, '_pendingStep', None) is not self.remoteStep:
+        # never mix the updates of two commands
+        self.flushUpdates()
+        self._pendingStep = self.remoteStep
+    pending = self.__dict__.setdefault('_pendingUpdates', [])
+    last = pending and pending[-1][0] or None
+    if last and len(data) == 1 and data.keys() == last.keys() and \
+       data.keys()[0] in ('stdout', 'stderr', 'header'):
+        # consecutive output of the same stream is one update
+        key = data.keys()[0]
+        last[key] = last[key] + data[key]
+    else:
+        pending.append([dict(data), 0])
+    self._pendingSize = getattr(self, '_pendingSize', 0) + _updateSize(data)
+    if self._pendingSize >= update_size:
+        self.flushUpdates()
+    elif getattr(self, '_flushTimer', None) is None:
+        self._flushTimer = reactor.callLater(update_interval,
+                                             self.flushUpdates)
+
+def SlaveBuilder_flushUpdates(self):
+    """Send the pending updates to the master in a single message"""
+    timer = getattr(self, '_flushTimer', None)
+    if timer is not None:
+        if timer.active():
+            timer.cancel()
+        self._flushTimer = None
+    updates = getattr(self, '_pendingUpdates', None)
+    step = getattr(self, '_pendingStep', None)
+    self._pendingUpdates = []
+    self._pendingSize = 0
+    if not updates or step is None or step is not self.remoteStep:
+        return
+    updates = [[_compressUpdate(data), num] for data, num in updates]
+    d = step.callRemote("update", updates)
+    d.addCallback(self.ackUpdate)
+    d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+
+def SlaveBuilder_commandComplete(self, failure):
+    # the master must get the output before the completion
+    self.flushUpdates()
+    return _SlaveBuilder_commandComplete(self, failure)
+
+def SlaveBuilder_lostRemoteStep(self, remotestep):
+    self._pendingUpdates = []
+    self._pendingSize = 0
+    self._pendingStep = None
+    return _SlaveBuilder_lostRemoteStep(self, remotestep)
+
+_SlaveBuilder_sendUpdate = SlaveBuilder.sendUpdate
+_SlaveBuilder_commandComplete = SlaveBuilder.commandComplete
+_SlaveBuilder_lostRemoteStep = SlaveBuilder.lostRemoteStep
+SlaveBuilder.sendUpdate = SlaveBuilder_sendUpdate
+SlaveBuilder.flushUpdates = SlaveBuilder_flushUpdates
+SlaveBuilder.commandComplete = SlaveBuilder_commandComplete
+SlaveBuilder.lostRemoteStep = SlaveBuilder_lostRemoteStep
+
+#
+# patching RemoteCommand so the master reads compressed updates
+#
+from buildbot.process.buildstep import RemoteCommand
+
+def decompressUpdate(update):
+    """Return the update sent by a slave as buildbot knows it::
+
+        >>> decompressUpdate({'compressed': ('stdout', zlib.compress('a'))})
+        {'stdout': 'a'}
+        >>> decompressUpdate({'rc': 0})
+        {'rc': 0}
+    """
+    if 'compressed' not in update:
+        return update
+    update = dict(update)
+    key, data = update.pop('compressed')
+    update[key] = zlib.decompress(data)
+    return update
+
+def RemoteCommand_remote_update(self, updates):
+    updates = [(decompressUpdate(update), num) for update, num in updates]
+    return _RemoteCommand_remote_update(self, updates)
+
+_RemoteCommand_remote_update = RemoteCommand.remote_update
+RemoteCommand.remote_update = RemoteCommand_remote_update
+
 #
 # patching SVN so it can take username/password
 #
@@ -263,9 +442,75 @@ def SVN_doVCFull(self):
 
 commands.SVN.doVCFull = SVN_doVCFull
 
+#
+# patching SourceBase so retries can back off exponentially with jitter
+#
+import random
+from twisted.internet import defer
+from twisted.python import failure
+from buildbot.slave.commands import AbandonChain
+
+def SourceBase_setup(self, args):
+    _SourceBase_setup(self, args)
+    # the master sends the backoff and the jitter apart from retry, which
+    # stays a (delay, repeats) pair for the slaves not knowing them
+    if self.retry and 'retry_backoff' in args:
+        self.retry = tuple(self.retry) + (args['retry_backoff'],
+                                          args.get('retry_jitter', 0))
+
+_SourceBase_setup = commands.SourceBase.setup
+commands.SourceBase.setup = SourceBase_setup
+
+def SourceBase_maybeDoVCRetry(self, res):
+    if isinstance(res, failure.Failure):
+        if self.interrupted:
+            return res # don't re-try interrupted builds
+        res.trap(AbandonChain)
+    else:
+        if type(res) is int and res == 0:
+            return res
+        if self.interrupted:
+            raise AbandonChain(1)
+    # if we get here, we should retry, if possible
+    if self.retry:
+        # (delay, repeats) or (delay, repeats, backoff, jitter)
+        delay, repeats, backoff, jitter = (tuple(self.retry) + (1, 0))[:4]
+        if repeats >= 0:
+            self.retry = (delay * backoff, repeats-1, backoff, jitter)
+            # spread the retries of many builders over time
+            delay = delay * random.uniform(1 - jitter, 1 + jitter)
+            msg = ("update failed, trying %d more times after %d seconds"
+                   % (repeats, delay))
+            self.sendStatus({'header': msg + "\n"})
+            log.msg(msg)
+            d = defer.Deferred()
+            self.maybeClobber(d)
+            d.addCallback(lambda res: self.doVCFull())
+            d.addBoth(self.maybeDoVCRetry)
+            reactor.callLater(delay, d.callback, None)
+            return d
+    return res
+
+commands.SourceBase.maybeDoVCRetry = SourceBase_maybeDoVCRetry
+
 from buildbot import steps
 from buildbot.steps.source import Source
 
+def Source__init__(self, retry=None, **kwargs):
+    """Source steps take (delay, repeats, backoff, jitter) as retry"""
+    backoff = None
+    if retry and len(retry) > 2:
+        delay, repeats, backoff, jitter = (tuple(retry) + (0,))[:4]
+        retry = (delay, repeats)
+    _Source__init__(self, retry=retry, **kwargs)
+    if backoff is not None:
+        self.addFactoryArguments(retry=(delay, repeats, backoff, jitter))
+        self.args['retry_backoff'] = backoff
+        self.args['retry_jitter'] = jitter
+
+_Source__init__ = Source.__init__.im_func
+Source.__init__ = Source__init__
+
 def SVNStep__init__(self, svnurl=None, baseURL=None, defaultBranch=None,
                     directory=None, username=None,
                     password=None, **kwargs):
@@ -364,6 +609,151 @@ def SVNStep_startVC(self, branch, revision, patch):
 
 steps.source.SVN.startVC = SVNStep_startVC
 
+#
+# patching Git so it can build from a bare mirror kept on the slave
+#
+import re
+
+_Git_setup = commands.Git.setup
+_Git_doVCUpdate = commands.Git.doVCUpdate
+_Git_doVCFull = commands.Git.doVCFull
+
+# the mirrors being created or updated, by directory: the builders of a
+# slave run in the same process and must not run git in a mirror at once
+mirror_locks = {}
+
+def Git_setup(self, args):
+    _Git_setup(self, args)
+    self.mirror = args.get('mirror', False)
+    # repourl stays the upstream repository, the mirror is only fetched
+    # from once updated
+    self.fetchurl = self.repourl
+
+commands.Git.setup = Git_setup
+
+def Git_mirrorDir(self):
+    # one mirror per repository, shared by all the builders of the slave
+    name = re.sub(r'[^\w.-]+', '_', self.repourl)
+    return os.path.join(os.path.dirname(self.builder.basedir),
+                        'mirrors', name + '.git')
+
+commands.Git._mirrorDir = Git_mirrorDir
+
+def Git_updateMirror(self):
+    mirror = self._mirrorDir()
+    lock = mirror_locks.setdefault(mirror, defer.DeferredLock())
+    return lock.run(self._doUpdateMirror, mirror)
+
+commands.Git._updateMirror = Git_updateMirror
+
+def Git_doUpdateMirror(self, mirror):
+    if os.path.isdir(mirror):
+        # no --prune: the shared clones may still use the objects of
+        # deleted branches
+        command = [self.vcexe, '--git-dir', mirror, 'fetch']
+        self.sendStatus({'header': "updating mirror %s\n" % mirror})
+    else:
+        command = [self.vcexe, 'clone', '--mirror', self.repourl, mirror]
+        self.sendStatus({'header': "creating mirror %s\n" % mirror})
+    d = self._mirrorCommand(command, mirror)
+
+    def _created(rc):
+        if rc != 0 or 'clone' not in command:
+            return rc
+        # the unreachable objects are kept for the same reason
+        return self._mirrorCommand([self.vcexe, '--git-dir', mirror,
+                                    'config', 'gc.pruneExpire', 'never'],
+                                   mirror)
+    d.addCallback(_created)
+
+    def _updated(rc):
+        if rc == 0:
+            # fetch from the mirror instead of the network
+            self.fetchurl = mirror
+        else:
+            self.fetchurl = self.repourl
+            self.sendStatus({'header': "mirror update failed, using %s\n"
+                                       % self.repourl})
+        return rc
+    d.addCallback(_updated)
+    return d
+
+commands.Git._doUpdateMirror = Git_doUpdateMirror
+
+def Git_mirrorCommand(self, command, mirror):
+    c = ShellCommand(self.builder, command, os.path.dirname(mirror),
+                     sendRC=False, timeout=self.timeout,
+                     maxTime=self.maxTime, usePTY=False)
+    self.command = c
+    return c.start()
+
+commands.Git._mirrorCommand = Git_mirrorCommand
+
+def Git_doFetch(self, dummy):
+    # The plus will make sure the repo is moved to the branch's
+    # head even if it is not a simple "fast-forward"
+    command = ['fetch', '-t', self.fetchurl, '+%s' % self.branch]
+    self.sendStatus({"header": "fetching branch %s from %s\n"
+                                    % (self.branch, self.fetchurl)})
+    return self._dovccmd(command, self._didFetch)
+
+commands.Git._doFetch = Git_doFetch
+
+def Git_doVCUpdate(self):
+    if not self.mirror:
+        return _Git_doVCUpdate(self)
+    d = self._updateMirror()
+    d.addCallback(lambda rc: _Git_doVCUpdate(self))
+    return d
+
+commands.Git.doVCUpdate = Git_doVCUpdate
+
+def Git_doVCFull(self):
+    if not self.mirror:
+        return _Git_doVCFull(self)
+    d = self._updateMirror()
+
+    def _clone(rc):
+        if rc != 0:
+            # fetch from upstream without trying the mirror again
+            os.makedirs(self._fullSrcdir())
+            return self._dovccmd(['init'],
+                                 lambda res: _Git_doVCUpdate(self))
+        # a shared clone borrows the objects of the mirror, so creating
+        # the build tree does not copy the repository
+        command = [self.vcexe, 'clone', '--shared', '--no-checkout',
+                   self.fetchurl, self._fullSrcdir()]
+        c = ShellCommand(self.builder, command, self.builder.basedir,
+                         sendRC=False, timeout=self.timeout,
+                         maxTime=self.maxTime, usePTY=False)
+        self.command = c
+        d = c.start()
+        d.addCallback(self._abandonOnFailure)
+        d.addCallback(lambda rc: _Git_doVCUpdate(self))
+        return d
+    d.addCallback(_clone)
+    return d
+
+commands.Git.doVCFull = Git_doVCFull
+
+def GitStep__init__(self, repourl, branch="master", submodules=False,
+                    ignore_ignores=None, mirror=False, **kwargs):
+    Source.__init__(self, **kwargs)
+    self.addFactoryArguments(repourl=repourl,
+                             branch=branch,
+                             submodules=submodules,
+                             ignore_ignores=ignore_ignores,
+                             mirror=mirror,
+                             )
+    self.args.update({'repourl': repourl,
+                      'branch': branch,
+                      'submodules': submodules,
+                      'ignore_ignores': ignore_ignores,
+                      'mirror': mirror,
+                      })
+
+steps.source.Git.__init__ = GitStep__init__
+
 #
 # patching twisted
 #
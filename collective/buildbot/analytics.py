@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Durations and queue waits of the builds, kept in an append-only file"""
+import os
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from twisted.python import log
+from buildbot.status.base import StatusReceiverMultiService
+from buildbot.status.builder import Results
+from collective.buildbot.jsonstatus import project_name
+
+
+# the file of the build records when build-stats is only turned on
+DEFAULT_FILE = 'build-stats.log'
+
+
+def stats_file(value):
+    """Return the file of a ``build-stats`` option, or None when the builds
+    are not recorded, the default::
+
+        >>> stats_file('true'), stats_file('stats/builds.log')
+        ('build-stats.log', 'stats/builds.log')
+        >>> print stats_file('off'), stats_file(''), stats_file(None)
+        None None None
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.lower() in ('', 'false', 'off', 'no', 'none'):
+        return None
+    if value.lower() in ('true', 'on', 'yes'):
+        return DEFAULT_FILE
+    return value
+
+
+def build_record(build):
+    """Return the record of a finished build: when it was submitted,
+    started and finished, on which slave, and its steps as
+    [name, start, end, result] lists"""
+    started, finished = build.getTimes()
+    submitted = [r.getSubmitTime() for r in build.getRequests()
+                 if r.getSubmitTime() is not None]
+    steps = []
+    for step in build.getSteps():
+        start, end = step.getTimes()
+        if start is None or end is None:
+            # skipped
+            continue
+        steps.append([step.getName(), round(start, 3), round(end, 3),
+                      Results[step.getResults()[0]]])
+    builder = build.getBuilder().getName()
+    return {'builder': builder,
+            'project': project_name(builder),
+            'number': build.getNumber(),
+            'slave': build.getSlavename(),
+            'result': Results[build.getResults()],
+            'submitted': submitted and round(min(submitted), 3) or None,
+            'started': round(started, 3),
+            'finished': round(finished, 3),
+            'steps': steps}
+
+
+def read_records(filename, since=None):
+    """Read the records of a file written by BuildRecorder. Broken lines,
+    like a line cut by a crash, are skipped"""
+    if not os.path.exists(filename):
+        return
+    for line in open(filename):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if since is not None and record['finished'] < since:
+            continue
+        yield record
+
+
+def aggregate(records, by='project'):
+    """Sum the builds, or the steps when ``by`` is ``step``, by project,
+    builder, slave or step::
+
+        >>> records = [
+        ...  {'project': 'a', 'slave': 's1', 'submitted': 0, 'started': 10,
+        ...   'finished': 70, 'result': 'success',
+        ...   'steps': [['svn', 10, 20, 'success'],
+        ...             ['test', 20, 70, 'success']]},
+        ...  {'project': 'a', 'slave': 's2', 'submitted': 0, 'started': 30,
+        ...   'finished': 60, 'result': 'failure',
+        ...   'steps': [['svn', 30, 40, 'success'],
+        ...             ['test', 40, 60, 'failure']]},
+        ...  {'project': 'b', 'slave': 's1', 'submitted': None, 'started': 0,
+        ...   'finished': 10, 'result': 'success', 'steps': []}]
+        >>> for key, stats in aggregate(records):
+        ...     print key, sorted(stats.items())
+        a [('count', 2), ('duration', 90), ('failures', 1), ('max_wait', 30), ('wait', 40), ('waited', 2)]
+        b [('count', 1), ('duration', 10), ('failures', 0), ('max_wait', 0), ('wait', 0), ('waited', 0)]
+        >>> [(key, stats['duration']) for key, stats in aggregate(records, 'slave')]
+        [('s1', 70), ('s2', 30)]
+        >>> [(key, stats['duration']) for key, stats in aggregate(records, 'step')]
+        [('test', 70), ('svn', 20)]
+
+    The busiest come first.
+    """
+    stats = {}
+    def add(key, duration, failed, wait=None):
+        s = stats.setdefault(key, {'count': 0, 'duration': 0, 'failures': 0,
+                                   'wait': 0, 'waited': 0, 'max_wait': 0})
+        s['count'] += 1
+        s['duration'] += duration
+        if failed:
+            s['failures'] += 1
+        if wait is not None:
+            s['wait'] += wait
+            s['waited'] += 1
+            s['max_wait'] = max(s['max_wait'], wait)
+    for record in records:
+        if by == 'step':
+            for name, start, end, result in record['steps']:
+                add(name, end - start, result != 'success')
+            continue
+        wait = None
+        if record['submitted'] is not None:
+            wait = max(0, record['started'] - record['submitted'])
+        add(record[by], record['finished'] - record['started'],
+            record['result'] != 'success', wait)
+    return sorted(stats.items(), key=lambda item: -item[1]['duration'])
+
+
+def format_duration(seconds):
+    """Format a duration for the report::
+
+        >>> format_duration(42)
+        '42s'
+        >>> format_duration(3725)
+        '1h02m'
+    """
+    seconds = int(seconds)
+    if seconds < 60:
+        return '%ds' % seconds
+    if seconds < 3600:
+        return '%dm%02ds' % (seconds / 60, seconds % 60)
+    return '%dh%02dm' % (seconds / 3600, seconds % 3600 / 60)
+
+
+def format_report(stats, by='project'):
+    lines = ['%-40s %6s %6s %9s %9s %9s %9s' % (
+                by, 'count', 'failed', 'total', 'average', 'avg wait',
+                'max wait')]
+    for key, s in stats:
+        if s['waited']:
+            wait = format_duration(s['wait'] / s['waited'])
+        else:
+            wait = '-'
+        lines.append('%-40s %6d %6d %9s %9s %9s %9s' % (
+            key, s['count'], s['failures'], format_duration(s['duration']),
+            format_duration(s['duration'] / s['count']), wait,
+            s['waited'] and format_duration(s['max_wait']) or '-'))
+    return '\n'.join(lines)
+
+
+class BuildRecorder(StatusReceiverMultiService):
+    """Append the record of every finished build to filename, one JSON
+    object per line. A relative filename is in the master directory."""
+
+    compare_attrs = ['filename']
+
+    def __init__(self, filename=DEFAULT_FILE):
+        StatusReceiverMultiService.__init__(self)
+        self.filename = filename
+
+    def setServiceParent(self, parent):
+        StatusReceiverMultiService.setServiceParent(self, parent)
+        self.path = os.path.join(self.parent.basedir, self.filename)
+        self.master_status = self.parent.getStatus()
+        self.master_status.subscribe(self)
+
+    def disownServiceParent(self):
+        self.master_status.unsubscribe(self)
+        return StatusReceiverMultiService.disownServiceParent(self)
+
+    # status events
+    def builderAdded(self, name, builder):
+        return self # subscribe to the builds of this builder
+
+    def buildFinished(self, name, build, results):
+        try:
+            line = json.dumps(build_record(build), sort_keys=True,
+                              separators=(',', ':'))
+            f = open(self.path, 'a')
+            try:
+                f.write(line + '\n')
+            finally:
+                f.close()
+        except Exception:
+            log.msg('Can not record build %s of %s' % (build.getNumber(),
+                                                      name))
+            log.err()
+
+
+def report(filename, by='project', days=None):
+    since = None
+    if days is not None:
+        since = time.time() - days * 24 * 60 * 60
+    return format_report(aggregate(read_records(filename, since), by), by)
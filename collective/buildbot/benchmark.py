@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of collective.buildbot
+
+Run them with ``python -m collective.buildbot.benchmark <name>``.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+from ConfigParser import ConfigParser
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import collective.buildbot
+from twisted.internet import defer, reactor
+from buildbot.changes.changes import Change
+from buildbot.slave.bot import SlaveBuilder
+from buildbot.process.buildstep import LoggedRemoteCommand
+from buildbot.status.builder import LogFile
+from collective.buildbot.poller import SVNPoller
+
+SVN_ROOT = 'http://svn.example.com/repos'
+
+
+class _Builder(object):
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+
+class _Step(object):
+
+    def __init__(self, basedir):
+        self.build = self
+        self.builder = _Builder(basedir)
+
+
+class _BuildSlave(object):
+
+    def messageReceivedFromSlave(self):
+        pass
+
+
+class _MasterStep(object):
+    """The master side of a remote step, timing the processing of updates"""
+
+    def __init__(self, command):
+        self.command = command
+        self.cpu = 0.
+        self.bytes = 0
+
+    def callRemote(self, name, *args):
+        if name == 'update':
+            updates = args[0]
+            for update, num in updates:
+                for value in update.values():
+                    if isinstance(value, tuple):
+                        value = value[-1]
+                    if isinstance(value, str):
+                        self.bytes += len(value)
+            start = time.clock()
+            self.command.remote_update(updates)
+            self.cpu += time.clock() - start
+        return defer.succeed(0)
+
+    def dontNotifyOnDisconnect(self, callback):
+        pass
+
+
+def _output(size):
+    """Return size bytes looking like the output of a test runner"""
+    lines = []
+    length = 0
+    i = 0
+    while length < size:
+        line = ('test_%05d (collective.buildbot.tests.test_module.'
+                'TestCase%d) ... ok\n' % (i, i % 17))
+        lines.append(line)
+        length += len(line)
+        i += 1
+    return ''.join(lines)[:size]
+
+
+def log_throughput(megabytes=10, level=0, chunk=1024):
+    """Send megabytes of output in chunks through a slave builder to a
+    master log file. Return the master CPU seconds used per megabyte and the
+    number of bytes sent over the network"""
+    basedir = tempfile.mkdtemp()
+    old = collective.buildbot.compress_output
+    collective.buildbot.compress_output = level
+    try:
+        logfile = LogFile(_Step(basedir), 'stdio', 'stdio')
+        command = LoggedRemoteCommand('shell', {})
+        command.logs = {'stdio': logfile}
+        command.active = True
+        command.buildslave = _BuildSlave()
+
+        builder = SlaveBuilder('benchmark', False)
+        builder.running = True
+        builder.remoteStep = step = _MasterStep(command)
+
+        output = _output(1024 * 1024)
+        for i in range(megabytes):
+            for j in range(0, len(output), chunk):
+                builder.sendUpdate({'stdout': output[j:j+chunk]})
+        builder.flushUpdates()
+        logfile.finish()
+    finally:
+        collective.buildbot.compress_output = old
+        shutil.rmtree(basedir)
+    return dict(level=level, megabytes=megabytes,
+                master_cpu_per_mb=step.cpu / megabytes,
+                sent_bytes=step.bytes)
+
+
+def logs(args):
+    """Master cost of the output sent by slaves, for each compression
+    level given as argument (0, 1, 6 and 9 by default)"""
+    levels = [int(a) for a in args] or [0, 1, 6, 9]
+    # output is sent in windows of update-size bytes
+    collective.buildbot.update_interval = 0.1
+    print '%5s %12s %14s' % ('level', 'cpu/MB (ms)', 'sent (KB/MB)')
+    for level in levels:
+        result = log_throughput(level=level)
+        print '%5d %12.2f %14d' % (
+            level, result['master_cpu_per_mb'] * 1000,
+            result['sent_bytes'] / 1024 / result['megabytes'])
+
+
+def write_config(path, sections):
+    """Write sections, a list of (section, options), to path"""
+    config = ConfigParser()
+    for section, options in sections:
+        config.add_section(section)
+        for key, value in options:
+            config.set(section, key, value)
+    f = open(path, 'w')
+    try:
+        config.write(f)
+    finally:
+        f.close()
+
+
+def generate_config(root, projects, slaves=10, pollers=None):
+    """Write in root the buildbot.cfg of a master with projects and
+    pollers looking like a real fleet: every 5th project watches a library
+    with ``dependencies``, every 10th builds nightly and every 20th depends
+    on the previous one. Return the path of buildbot.cfg"""
+    if pollers is None:
+        pollers = max(1, projects / 10)
+    for name in ('projects', 'pollers'):
+        os.mkdir(os.path.join(root, name))
+    write_config(os.path.join(root, 'buildbot.cfg'), [
+        ('buildbot', [('projects-directory', os.path.join(root, 'projects')),
+                      ('pollers-directory', os.path.join(root, 'pollers')),
+                      ('project-name', 'benchmark'),
+                      ('project-url', 'http://localhost:9000/'),
+                      ('url', 'http://localhost:9000/'),
+                      ('build-stats', 'false'),
+                      ('metrics-log-interval', '0'),
+                      ('reactor-lag-threshold', '0')]),
+        ('slaves', [('slave%d' % i, 'secret') for i in range(slaves)])])
+    for i in range(projects):
+        name = 'project%d' % i
+        options = [('name', name),
+                   ('repository', '%s/%s/trunk' % (SVN_ROOT, name)),
+                   ('slave-names', 'slave%d slave%d' % (
+                       i % slaves, (i + 1) % slaves)),
+                   ('build-sequence', 'bin/buildout'),
+                   ('test-sequence', 'bin/test')]
+        if i % 5 == 4:
+            options.append(('dependencies', 'lib%d/trunk' % (i % 7)))
+        if i % 10 == 9:
+            options.append(('cron-scheduler', '0 2 * * *'))
+        if i % 20 == 19:
+            options.append(('dependent-scheduler', 'project%d' % (i - 1)))
+        write_config(os.path.join(root, 'projects', name + '.cfg'),
+                     [('project', options)])
+    for i in range(pollers):
+        write_config(os.path.join(root, 'pollers', 'poller%d.cfg' % i),
+                     [('poller', [('name', 'poller%d' % i), ('vcs', 'svn'),
+                                  ('repository', SVN_ROOT),
+                                  ('poll-interval', '600')])])
+    return os.path.join(root, 'buildbot.cfg')
+
+
+def synthetic_changes(projects, count, seed=0):
+    """Return count changes of random projects. One in ten is a change of a
+    library, without branch like the changes sent by hooks"""
+    rand = random.Random(seed)
+    changes = []
+    for i in range(count):
+        files = ['src/module%d.py' % rand.randrange(50)
+                 for j in range(rand.randrange(1, 6))]
+        if i % 10 == 9:
+            library = 'lib%d/trunk' % rand.randrange(7)
+            changes.append(Change('dev', ['%s/%s' % (library, f)
+                                          for f in files],
+                                  'library change', revision=str(i),
+                                  branch=None))
+        else:
+            branch = 'project%d/trunk' % rand.randrange(projects)
+            changes.append(Change('dev', files, 'change', revision=str(i),
+                                  branch=branch))
+    return changes
+
+
+def maxrss():
+    """Return the peak memory used by the process, in KB"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+MASTER_CONFIG = os.path.join(os.path.dirname(collective.buildbot.__file__),
+                             'master.py')
+
+
+def set_config(path):
+    """Point master.py to the buildbot.cfg in path, return the old one"""
+    old = os.environ.get('BUILDBOT_CONFIG')
+    os.environ['BUILDBOT_CONFIG'] = path
+    return old
+
+
+def restore_config(old):
+    if old is None:
+        os.environ.pop('BUILDBOT_CONFIG', None)
+    else:
+        os.environ['BUILDBOT_CONFIG'] = old
+
+
+def load_master(basedir):
+    """Return a BuildMaster loaded with master.py, not started"""
+    from buildbot.master import BuildMaster
+    master = BuildMaster(basedir, MASTER_CONFIG)
+    failures = []
+    d = master.loadConfig(open(MASTER_CONFIG))
+    d.addErrback(failures.append)
+    if failures:
+        failures[0].raiseException()
+    return master
+
+
+def cancel_timers():
+    """Forget the timers set by the schedulers"""
+    for call in reactor.getDelayedCalls():
+        call.cancel()
+
+
+def measure_config(projects, changes=500, slaves=10):
+    """Load the configuration of a master with projects and dispatch
+    changes to its schedulers. Return the measures as a dict"""
+    root = tempfile.mkdtemp()
+    old_config = set_config(generate_config(root, projects, slaves))
+    try:
+        basedir = os.path.join(root, 'master')
+        os.mkdir(basedir)
+        memory = maxrss()
+
+        start = time.time()
+        execfile(MASTER_CONFIG, {'basedir': basedir})
+        parse_seconds = time.time() - start
+
+        start = time.time()
+        master = load_master(basedir)
+        load_seconds = time.time() - start
+        if memory is not None:
+            memory = maxrss() - memory
+
+        schedulers = master.allSchedulers()
+        dispatched = synthetic_changes(projects, changes)
+        start = time.time()
+        for change in dispatched:
+            master.addChange(change)
+        dispatch_seconds = time.time() - start
+        cancel_timers()
+    finally:
+        restore_config(old_config)
+        shutil.rmtree(root)
+    return dict(projects=projects, slaves=slaves,
+                pollers=len(list(master.change_svc)) - 1,
+                parse_seconds=parse_seconds, load_seconds=load_seconds,
+                memory_kb=memory, schedulers=len(schedulers),
+                builders=len(master.botmaster.builderNames),
+                changes=changes, dispatch_seconds=dispatch_seconds,
+                changes_per_second=changes / max(dispatch_seconds, 1e-9))
+
+
+def config(args):
+    """Load time, memory, schedulers and change dispatch of masters with
+    10, 100, 1000 and 5000 projects or the numbers of projects given as
+    arguments. Each size is measured in a new process. Options:
+    --changes N, --output FILE for the JSON results"""
+    parser = OptionParser(usage='%prog config [options] [projects...]')
+    parser.add_option('--changes', type='int', default=500)
+    parser.add_option('--slaves', type='int', default=10)
+    parser.add_option('--output', help='write the JSON results in OUTPUT')
+    parser.add_option('--in-process', action='store_true')
+    options, args = parser.parse_args(args)
+    sizes = [int(a) for a in args] or [10, 100, 1000, 5000]
+    if options.in_process:
+        results = [measure_config(size, options.changes, options.slaves)
+                   for size in sizes]
+        print json.dumps(results)
+        return
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    results = []
+    print '%8s %10s %10s %10s %10s %12s' % (
+        'projects', 'load (s)', 'memory(MB)', 'schedulers', 'builders',
+        'changes/s')
+    for size in sizes:
+        child = subprocess.Popen(
+            [sys.executable, '-c',
+             'from collective.buildbot.benchmark import main; main()',
+             'config', '--in-process', '--changes', str(options.changes),
+             '--slaves', str(options.slaves), str(size)],
+            stdout=subprocess.PIPE, env=env)
+        output = child.communicate()[0]
+        if child.returncode:
+            print 'The benchmark of %d projects failed' % size
+            return child.returncode
+        # the master logs nothing but the last line could be preceded by
+        # warnings
+        result = json.loads(output.strip().splitlines()[-1])[0]
+        results.append(result)
+        print '%8d %10.2f %10s %10d %10d %12.0f' % (
+            size, result['load_seconds'],
+            result['memory_kb'] is not None and
+            '%.1f' % (result['memory_kb'] / 1024.) or '-',
+            result['schedulers'], result['builders'],
+            result['changes_per_second'])
+    write_results(results, options.output, 'config')
+
+
+def svn_log(first, commits, projects, files, rand):
+    """Return the ``svn log --xml --verbose`` output of commits from the
+    revision first, newest first like svn gives them. Most commits change
+    files in the trunk of a project, the others in a library, a branch or
+    a tag"""
+    entries = []
+    for revision in range(first, first + commits):
+        kind = rand.random()
+        if kind < 0.1:
+            base = 'lib%d/trunk' % rand.randrange(7)
+        elif kind < 0.15:
+            base = 'project%d/tags/1.0' % rand.randrange(projects)
+        elif kind < 0.25:
+            base = 'project%d/branches/feature' % rand.randrange(projects)
+        else:
+            base = 'project%d/trunk' % rand.randrange(projects)
+        paths = ['<path action="M">/%s/src/module%d.py</path>' % (
+                     base, rand.randrange(50)) for i in range(files)]
+        entries.append('<logentry revision="%d"><author>dev</author>'
+                       '<date>2010-01-01T00:00:00.000000Z</date>'
+                       '<paths>%s</paths><msg>change %d</msg></logentry>' % (
+                       revision, ''.join(paths), revision))
+    entries.reverse()
+    return '<?xml version="1.0"?>\n<log>\n%s\n</log>\n' % '\n'.join(entries)
+
+
+def percentiles(values, wanted=(50, 90, 99)):
+    """Return the wanted percentiles of values::
+
+        >>> percentiles(range(1, 101))
+        [50, 90, 99]
+        >>> percentiles([3, 1, 2], (50, 100))
+        [2, 3]
+        >>> percentiles([])
+        [None, None, None]
+    """
+    if not values:
+        return [None] * len(wanted)
+    values = sorted(values)
+    return [values[max(0, int(round(len(values) * p / 100.)) - 1)]
+            for p in wanted]
+
+
+def measure_dispatch(projects, commits=1000, files=5, slaves=10, batch=100):
+    """Replay commits, in polls of batch commits, through the SVN poller
+    and the schedulers of a master with projects: the svn log is parsed,
+    split_file turns its paths in changes and the changes are given to
+    all the schedulers. Return the measures as a dict"""
+    root = tempfile.mkdtemp()
+    old_config = set_config(generate_config(root, projects, slaves))
+    try:
+        basedir = os.path.join(root, 'master')
+        os.mkdir(basedir)
+        master = load_master(basedir)
+        poller = [p for p in master.change_svc
+                  if isinstance(p, SVNPoller)][0]
+        # as found by checksvn for a poller of the root of the repository
+        poller._prefix = ''
+        poller.last_change = 0
+        rand = random.Random(0)
+        latencies = []
+        parse_seconds = 0
+        for first in range(1, commits + 1, batch):
+            output = svn_log(first, min(batch, commits + 1 - first),
+                             projects, files, rand)
+            start = time.time()
+            logentries = poller.get_new_logentries(poller.parse_logs(output))
+            changes = poller.create_changes(logentries)
+            parse_seconds += time.time() - start
+            for change in changes:
+                start = time.time()
+                master.addChange(change)
+                latencies.append(time.time() - start)
+        cancel_timers()
+    finally:
+        restore_config(old_config)
+        shutil.rmtree(root)
+    dispatch_seconds = sum(latencies)
+    p50, p90, p99 = percentiles(latencies)
+    return dict(projects=projects, commits=commits, files=files,
+                schedulers=len(master.allSchedulers()),
+                changes=len(latencies), parse_seconds=parse_seconds,
+                dispatch_seconds=dispatch_seconds,
+                changes_per_second=len(latencies) /
+                    max(parse_seconds + dispatch_seconds, 1e-9),
+                latency_p50=p50, latency_p90=p90, latency_p99=p99,
+                latency_max=latencies and max(latencies) or None)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def dispatch(args):
+    """Changes per second and latency of the changes found by the SVN
+    poller in synthetic svn logs, through split_file to the schedulers.
+    Options: --projects, --commits and --files take comma separated
+    numbers, every combination is measured; --output FILE for the JSON
+    results"""
+    parser = OptionParser(usage='%prog dispatch [options]')
+    parser.add_option('--projects', default='10,100,1000')
+    parser.add_option('--commits', default='1000')
+    parser.add_option('--files', default='1,10')
+    parser.add_option('--batch', type='int', default=100,
+                      help='commits found by each poll')
+    parser.add_option('--output', help='write the JSON results in OUTPUT')
+    options, args = parser.parse_args(args)
+    results = []
+    print '%8s %8s %6s %8s %10s %9s %9s %9s' % (
+        'projects', 'commits', 'files', 'changes', 'changes/s', 'p50 (ms)',
+        'p90 (ms)', 'p99 (ms)')
+    for projects in int_list(options.projects):
+        for commits in int_list(options.commits):
+            for files in int_list(options.files):
+                result = measure_dispatch(projects, commits, files,
+                                          batch=options.batch)
+                results.append(result)
+                print '%8d %8d %6d %8d %10.0f %9.3f %9.3f %9.3f' % (
+                    projects, commits, files, result['changes'],
+                    result['changes_per_second'],
+                    (result['latency_p50'] or 0) * 1000,
+                    (result['latency_p90'] or 0) * 1000,
+                    (result['latency_p99'] or 0) * 1000)
+    write_results(results, options.output, 'dispatch')
+
+
+def write_results(results, output, name):
+    """Write the results of a benchmark as JSON, with what is needed to
+    compare them with results of other runs"""
+    if output is None:
+        return
+    f = open(output, 'w')
+    try:
+        json.dump({'benchmark': name, 'time': time.time(),
+                   'python': sys.version.split()[0],
+                   'platform': sys.platform, 'results': results},
+                  f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+    print 'Results written in %s' % output
+
+
+benchmarks = {'config': config, 'dispatch': dispatch, 'logs': logs}
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if not args or args[0] not in benchmarks:
+        print 'Usage: %s %s [args]' % (
+            os.path.basename(sys.argv[0]), '|'.join(sorted(benchmarks)))
+        for name, func in sorted(benchmarks.items()):
+            print '  %s: %s' % (name, ' '.join(func.__doc__.split()))
+        return 1
+    benchmarks[args[0]](args[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Builds of sources and configurations which were already built"""
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+from buildbot.process.base import Build
+from buildbot.status.builder import SUCCESS, EXCEPTION
+from buildbot.steps.source import Source
+from twisted.python import log
+from collective.buildbot import metrics
+from collective.buildbot.coalesce import CoalescingBuild
+
+# how many of the last builds of a builder are searched for a success
+MAX_SEARCH = 50
+
+
+def fingerprint(sequence):
+    """Return a digest of the steps of a build factory, i.e. the build
+    configuration::
+
+        >>> from buildbot.steps.shell import ShellCommand
+        >>> from buildbot.process.factory import s
+        >>> build = [s(ShellCommand, command=['bin/buildout'])]
+        >>> test = [s(ShellCommand, command=['bin/test'], timeout=60)]
+        >>> fingerprint(build + test) == fingerprint(build + test)
+        True
+        >>> fingerprint(build + test) == fingerprint(build)
+        False
+        >>> len(fingerprint(build))
+        32
+    """
+    digest = md5()
+    for klass, kwargs in sequence:
+        digest.update(repr(('%s.%s' % (klass.__module__, klass.__name__),
+                            sorted(kwargs.items()))))
+    return digest.hexdigest()
+
+
+def matches(build, branch, revision, digest):
+    """Whether a finished build built revision of branch with the
+    configuration digest, successfully::
+
+        >>> from buildbot.process.properties import Properties
+        >>> from buildbot.sourcestamp import SourceStamp
+        >>> class BuildStatus(object):
+        ...     def __init__(self, results, **properties):
+        ...         self.results = results
+        ...         self.properties = Properties(**properties)
+        ...     def getResults(self):
+        ...         return self.results
+        ...     def getProperties(self):
+        ...         return self.properties
+        ...     def getSourceStamp(self):
+        ...         return SourceStamp(branch='trunk')
+        >>> last = BuildStatus(SUCCESS, got_revision='42',
+        ...                    build_fingerprint='abc')
+        >>> matches(last, 'trunk', '42', 'abc')
+        True
+        >>> matches(last, 'trunk', '43', 'abc')
+        False
+        >>> matches(last, 'trunk', '42', 'def')
+        False
+        >>> matches(last, 'branches/1.0', '42', 'abc')
+        False
+        >>> matches(BuildStatus(SUCCESS, got_revision='42'), 'trunk', '42',
+        ...         'abc')
+        False
+    """
+    if build.getResults() != SUCCESS:
+        return False
+    if build.getSourceStamp().branch != branch:
+        return False
+    properties = build.getProperties()
+    return (properties.getProperty('got_revision') == revision and
+            properties.getProperty('build_fingerprint') == digest)
+
+
+def last_success(builder_status, branch, max_search=MAX_SEARCH):
+    """Return the last successful build of branch on a builder"""
+    for build in builder_status.generateFinishedBuilds(branches=[branch],
+                                                       max_search=max_search):
+        if build.getResults() == SUCCESS:
+            return build
+    return None
+
+
+def last_revision(builder_status, branch=None, max_search=MAX_SEARCH):
+    """Return the revision checked out by the last build of branch on a
+    builder, whatever its result. Builds interrupted by an exception are
+    not counted"""
+    branches = branch is not None and [branch] or []
+    for build in builder_status.generateFinishedBuilds(branches=branches,
+                                                       max_search=max_search):
+        if build.getResults() == EXCEPTION:
+            continue
+        revision = build.getProperties().getProperty('got_revision')
+        if revision is not None:
+            return revision
+    return None
+
+
+class SkipUnchanged:
+    """Skip the steps following the checkout when the revision checked out
+    and the configuration of the build are the ones of the last successful
+    build of the builder. The build succeeds as the cached one did.
+
+    Only the builds started by periodic schedulers, which set the
+    ``periodic`` property, are skipped: builds for changes, of dependent
+    projects, forced builds and builds of patches always run. The
+    fingerprint of the configuration is the ``fingerprint`` of the build
+    factory.
+    """
+
+    # the build class this one extends
+    base = Build
+
+    def setupProperties(self):
+        self.base.setupProperties(self)
+        digest = getattr(self.builder.buildFactory, 'fingerprint', None)
+        if digest is not None:
+            self.setProperty('build_fingerprint', digest, 'SkipUnchanged')
+
+    def stepDone(self, result, step):
+        terminate = self.base.stepDone(self, result, step)
+        if not terminate and isinstance(step, Source) and \
+           result == SUCCESS and self.isUnchanged():
+            for remaining in self.steps:
+                if not remaining.alwaysRun:
+                    remaining.doStepIf = False
+        return terminate
+
+    def isUnchanged(self):
+        properties = self.getProperties()
+        if self.source.patch or not properties.getProperty('periodic'):
+            return False
+        digest = properties.getProperty('build_fingerprint')
+        revision = properties.getProperty('got_revision')
+        if digest is None or revision is None:
+            return False
+        builder_status = self.builder.builder_status
+        last = last_success(builder_status, self.source.branch)
+        if last is None or not matches(last, self.source.branch, revision,
+                                       digest):
+            return False
+        log.msg('Revision %s of %s was built by build %s, skipping the build'
+                % (revision, builder_status.getName(), last.getNumber()))
+        metrics.counter('builds_skipped_total').inc()
+        self.setProperty('cached_build', last.getNumber(), 'SkipUnchanged')
+        self.text.extend(['unchanged', 'since', '#%d' % last.getNumber()])
+        return True
+
+
+class CachedBuild(SkipUnchanged, Build):
+    """A build skipped when already built"""
+
+
+class CachedCoalescingBuild(SkipUnchanged, CoalescingBuild):
+    """A coalescing build skipped when already built"""
+
+    base = CoalescingBuild
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of queued build requests and superseding of running builds"""
+from buildbot import interfaces
+from buildbot.process.base import Build
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status.base import StatusReceiverMultiService
+from twisted.python import log
+
+
+def coalesced_source(requests):
+    """Return the source stamp building the newest of requests.
+
+    Requests are given oldest first, as the builder queues them. The changes
+    of all the requests are kept so the blamelist stays complete::
+
+        >>> class Change(object):
+        ...     def __init__(self, revision):
+        ...         self.branch, self.revision = 'trunk', revision
+        >>> class Request(object):
+        ...     def __init__(self, source):
+        ...         self.source = source
+        >>> old = Request(SourceStamp(changes=[Change(10), Change(11)]))
+        >>> new = Request(SourceStamp(changes=[Change(12)]))
+        >>> source = coalesced_source([old, new])
+        >>> source.revision, len(source.changes)
+        (12, 3)
+
+    A request without changes, like a periodic one, builds its own
+    revision::
+
+        >>> head = Request(SourceStamp(branch='trunk'))
+        >>> print coalesced_source([old, head]).revision
+        None
+    """
+    newest = requests[-1].source
+    if not newest.changes:
+        return newest
+    changes = []
+    for request in requests:
+        changes.extend(request.source.changes)
+    return SourceStamp(branch=newest.branch, changes=changes)
+
+
+class CoalescingBuild(Build):
+    """A build which merges every queued request of its builder, whatever
+    their source, and builds the newest one."""
+
+    def __init__(self, requests):
+        Build.__init__(self, requests[-1:])
+        self.requests = requests
+        for req in requests[:-1]:
+            req.startCount += 1
+        self.source = coalesced_source(requests)
+        self.reason = requests[0].mergeReasons(requests[1:])
+
+
+def mergeRequests(builder, req1, req2):
+    """Used as ``c['mergeRequests']``. Builders using a ``CoalescingBuild``
+    merge all requests on the same branch, others keep the stock behaviour.
+    """
+    if issubclass(builder.buildFactory.buildClass, CoalescingBuild):
+        return (req1.source.branch == req2.source.branch and
+                not req1.source.patch and not req2.source.patch)
+    return req1.canBeMergedWith(req2)
+
+
+class BuildSuperseder(StatusReceiverMultiService):
+    """Stop the running builds of a builder as soon as a build request
+    with newer changes is queued for it."""
+
+    compare_attrs = ['builders']
+
+    def __init__(self, builders):
+        StatusReceiverMultiService.__init__(self)
+        self.builders = builders
+
+    def setServiceParent(self, parent):
+        StatusReceiverMultiService.setServiceParent(self, parent)
+        self.master_status = self.parent.getStatus()
+        self.master_status.subscribe(self)
+
+    def disownServiceParent(self):
+        self.master_status.unsubscribe(self)
+        return StatusReceiverMultiService.disownServiceParent(self)
+
+    def builderAdded(self, name, builder):
+        if name in self.builders:
+            return self # subscribe to this builder
+
+    def requestSubmitted(self, request):
+        if not request.getSourceStamp().changes:
+            # only newer changes supersede a build, not forced builds
+            return
+        name = request.getBuilderName()
+        builder = self.master_status.getBuilder(name)
+        control = interfaces.IControl(self.parent).getBuilder(name)
+        for build_status in builder.getCurrentBuilds():
+            build = control.getBuild(build_status.getNumber())
+            if build is not None and build.currentStep is not None:
+                log.msg('Superseding build %s of %s' % (
+                    build_status.getNumber(), name))
+                build.stopBuild('superseded by newer changes')
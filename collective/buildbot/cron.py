@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Cron expressions and the times they fire at"""
+import time
+from datetime import datetime, timedelta
+
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep',
+          'oct', 'nov', 'dec')
+DAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+
+# the fields of an expression: name, lowest and highest values, and names
+# of the values starting at the lowest one
+FIELDS = (('minute', 0, 59, ()),
+          ('hour', 0, 23, ()),
+          ('day of month', 1, 31, ()),
+          ('month', 1, 12, MONTHS),
+          ('day of week', 0, 7, DAYS))
+
+ALIASES = {'@yearly': '0 0 1 1 *',
+           '@annually': '0 0 1 1 *',
+           '@monthly': '0 0 1 * *',
+           '@weekly': '0 0 * * 0',
+           '@daily': '0 0 * * *',
+           '@midnight': '0 0 * * *',
+           '@hourly': '0 * * * *'}
+
+# a schedule not firing in that many years never fires, like on February 30
+MAX_YEARS = 8
+
+
+def parse_value(value, low, names):
+    value = value.lower()
+    if value in names:
+        return low + list(names).index(value)
+    return int(value)
+
+
+def parse_field(value, low, high, names=()):
+    """Return the sorted values of a field of a cron expression. A field is
+    a comma separated list of values, ``*``, ranges and steps::
+
+        >>> parse_field('*/15', 0, 59)
+        [0, 15, 30, 45]
+        >>> parse_field('0-30/10', 0, 59)
+        [0, 10, 20, 30]
+        >>> parse_field('5/20', 0, 59)
+        [5, 25, 45]
+        >>> parse_field('1,3,8-10', 1, 31)
+        [1, 3, 8, 9, 10]
+
+    Months and days of the week can be given by name::
+
+        >>> parse_field('Mon-Fri', 0, 7, DAYS)
+        [1, 2, 3, 4, 5]
+        >>> parse_field('jan,jul', 1, 12, MONTHS)
+        [1, 7]
+
+    Values out of the range of the field are errors::
+
+        >>> parse_field('1-70', 0, 59)
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid cron value '1-70'
+    """
+    values = set()
+    try:
+        for part in value.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/', 1)
+                step = int(step)
+                if step < 1:
+                    raise ValueError
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = part.split('-', 1)
+                start = parse_value(start, low, names)
+                end = parse_value(end, low, names)
+            else:
+                start = end = parse_value(part, low, names)
+                if step != 1:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError
+            values.update(range(start, end + 1, step))
+    except ValueError:
+        raise ValueError("Invalid cron value '%s'" % value)
+    return sorted(values)
+
+
+class CronTab(object):
+    """The times at which a cron expression fires, in local time::
+
+        >>> cron = CronTab('15 */2 * * mon-fri')
+        >>> cron.hours
+        [0, 2, 4, 6, 8, 10, 12, 14, 16, 18, 20, 22]
+        >>> cron.weekdays
+        [1, 2, 3, 4, 5]
+
+    ``next`` computes the next time directly, field by field::
+
+        >>> def next(cron, when):
+        ...     now = time.mktime(time.strptime(when, '%Y-%m-%d %H:%M'))
+        ...     return time.strftime('%a %Y-%m-%d %H:%M',
+        ...                          time.localtime(cron.next(now)))
+        >>> next(cron, '2010-01-01 13:20')
+        'Fri 2010-01-01 14:15'
+        >>> next(cron, '2010-01-01 22:15')
+        'Mon 2010-01-04 00:15'
+        >>> next(CronTab('0 0 29 feb *'), '2010-03-01 00:00')
+        'Wed 2012-02-29 00:00'
+
+    Like with cron, when both the days of the month and of the week are
+    restricted, either of them matches::
+
+        >>> next(CronTab('0 3 13 * fri'), '2010-01-01 05:00')
+        'Fri 2010-01-08 03:00'
+        >>> next(CronTab('@monthly'), '2010-01-01 05:00')
+        'Mon 2010-02-01 00:00'
+
+    Days starting with ``*``, like ``*/2``, do not restrict the days, so
+    both must match then::
+
+        >>> next(CronTab('0 3 */2 * fri'), '2010-01-01 05:00')
+        'Fri 2010-01-15 03:00'
+
+    Expressions never firing are errors::
+
+        >>> CronTab('0 0 30 2 *')
+        Traceback (most recent call last):
+        ...
+        ValueError: Cron definition '0 0 30 2 *' never fires
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError("Invalid cron settings %s (5 values expected)"
+                             % expression)
+        values = [parse_field(value, low, high, names)
+                  for value, (name, low, high, names) in zip(fields, FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        # Sunday is 0 or 7
+        self.weekdays = sorted(set([day % 7 for day in weekdays]))
+        # like with Vixie cron, days starting with * are not restricted
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+        try:
+            self.next(time.time())
+        except ValueError:
+            raise ValueError("Cron definition '%s' never fires" % expression)
+
+    def __repr__(self):
+        return '<CronTab %s>' % self.expression
+
+    def matchesDay(self, date):
+        day = date.day in self.days
+        weekday = (date.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, timetuple):
+        """Whether the expression fires at the minute of timetuple"""
+        date = datetime(*timetuple[:5])
+        return (date.minute in self.minutes and date.hour in self.hours and
+                date.month in self.months and self.matchesDay(date))
+
+    def next(self, now):
+        """Return the first time after now the expression fires at"""
+        date = datetime.fromtimestamp(now).replace(second=0, microsecond=0)
+        date += timedelta(minutes=1)
+        limit = date.year + MAX_YEARS
+        while date.year < limit:
+            if date.month not in self.months:
+                following = [m for m in self.months if m > date.month]
+                if following:
+                    date = date.replace(month=following[0], day=1, hour=0,
+                                        minute=0)
+                else:
+                    date = date.replace(year=date.year + 1,
+                                        month=self.months[0], day=1, hour=0,
+                                        minute=0)
+                continue
+            if not self.matchesDay(date):
+                date = (date + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if date.hour not in self.hours:
+                following = [h for h in self.hours if h > date.hour]
+                if following:
+                    date = date.replace(hour=following[0], minute=0)
+                else:
+                    date = (date + timedelta(days=1)).replace(hour=0,
+                                                              minute=0)
+                continue
+            following = [m for m in self.minutes if m >= date.minute]
+            if following:
+                date = date.replace(minute=following[0])
+                when = time.mktime(date.timetuple())
+                if when <= now:
+                    # the hour repeated when daylight saving time ends:
+                    # the second time it is in standard time
+                    when = time.mktime(date.timetuple()[:8] + (0,))
+                if when > now:
+                    return when
+                date += timedelta(minutes=1)
+                continue
+            date = (date + timedelta(hours=1)).replace(minute=0)
+        raise ValueError("Cron definition '%s' never fires" % self.expression)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""A JSON view of the status of the projects"""
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from twisted.internet import task
+from twisted.web import server
+from twisted.web.resource import Resource
+from buildbot.status.base import StatusReceiver
+from buildbot.status.builder import Results
+
+
+def project_name(builder_name):
+    """Return the project of a builder, named by ``Project.builder``::
+
+        >>> project_name('collective.buildbot slave1')
+        'collective.buildbot'
+        >>> project_name('standalone')
+        'standalone'
+    """
+    return builder_name.rsplit(' ', 1)[0]
+
+
+def summary(builders):
+    """Sum up the builders of a project: its latest result, whether one of
+    its builders is building and the length of its queues::
+
+        >>> summary([{'state': 'idle', 'queue': 0, 'last_result': 'failure',
+        ...           'last_finished': 10},
+        ...          {'state': 'building', 'queue': 2,
+        ...           'last_result': 'success', 'last_finished': 20}])
+        {'queue': 2, 'state': 'building', 'last_result': 'success'}
+    """
+    states = [b['state'] for b in builders]
+    for state in ('building', 'idle', 'offline'):
+        if state in states:
+            break
+    finished = [(b['last_finished'], b['last_result']) for b in builders
+                if b['last_finished'] is not None]
+    return {'state': state,
+            'queue': sum([b['queue'] for b in builders]),
+            'last_result': finished and max(finished)[1] or None}
+
+
+class StatusTracker(StatusReceiver):
+    """Keep the last result and the time of the last change of builders"""
+
+    def __init__(self):
+        self.changed = {}
+        self.last_builds = {}
+
+    def touch(self, name):
+        self.changed[name] = time.time()
+
+    def getLastBuild(self, builder):
+        """Return (number, result, finished) of the last finished build"""
+        name = builder.getName()
+        if name not in self.last_builds:
+            # only read once, then kept up to date by buildFinished
+            build = builder.getLastFinishedBuild()
+            if build is not None and build.isFinished():
+                self.last_builds[name] = (build.getNumber(),
+                                          Results[build.getResults()],
+                                          build.getTimes()[1])
+            else:
+                self.last_builds[name] = (None, None, None)
+        return self.last_builds[name]
+
+    # status events
+    def builderAdded(self, name, builder):
+        self.touch(name)
+        return self # subscribe to this builder
+
+    def builderRemoved(self, name):
+        self.touch(name)
+        self.last_builds.pop(name, None)
+
+    def builderChangedState(self, name, state):
+        self.touch(name)
+
+    def requestSubmitted(self, request):
+        self.touch(request.getBuilderName())
+
+    def requestCancelled(self, builder, request):
+        self.touch(builder.getName())
+
+    def buildStarted(self, name, build):
+        self.touch(name)
+
+    def buildFinished(self, name, build, results):
+        self.last_builds[name] = (build.getNumber(), Results[results],
+                                  build.getTimes()[1])
+        self.touch(name)
+
+
+class JsonStatusResource(Resource):
+    """``/json`` gives the state of all the builders by project.
+
+    ``project=`` arguments only return the given projects. ``since=`` only
+    returns the projects changed since the ``time`` of a previous answer.
+    """
+
+    isLeaf = True
+
+    def __init__(self, tracker):
+        Resource.__init__(self)
+        self.tracker = tracker
+
+    def getStatus(self, request):
+        return request.site.buildbot_service.getStatus()
+
+    def getBuilderInfo(self, builder):
+        state = builder.getState()[0]
+        number, result, finished = self.tracker.getLastBuild(builder)
+        return {'state': state,
+                'current_builds': [b.getNumber()
+                                   for b in builder.getCurrentBuilds()],
+                'queue': len(builder.getPendingBuilds()),
+                'last_build': number,
+                'last_result': result,
+                'last_finished': finished}
+
+    def getProjects(self, status, projects=(), since=None):
+        names = {}
+        for name in status.getBuilderNames():
+            names.setdefault(project_name(name), []).append(name)
+        result = {}
+        for project, builders in names.items():
+            if projects and project not in projects:
+                continue
+            if since is not None and \
+               max([self.tracker.changed.get(name, since + 1)
+                    for name in builders]) <= since:
+                continue
+            infos = dict([(name, self.getBuilderInfo(status.getBuilder(name)))
+                          for name in builders])
+            result[project] = summary(infos.values())
+            result[project]['builders'] = infos
+        return result
+
+    def render_GET(self, request):
+        now = time.time()
+        try:
+            since = float(request.args.get('since', [None])[0])
+        except (TypeError, ValueError):
+            since = None
+        projects = self.getProjects(self.getStatus(request),
+                                    request.args.get('project', []), since)
+        request.setHeader('content-type', 'application/json')
+        request.setHeader('cache-control', 'no-cache')
+        data = json.dumps({'time': now, 'projects': projects}, sort_keys=True)
+        return data
+
+
+class EventStream(StatusReceiver):
+    """Push the build events to the clients of the ``/events`` page"""
+
+    heartbeat = 30
+
+    def __init__(self):
+        self.clients = []
+        self.last_id = 0
+        self.loop = None
+
+    def addClient(self, client):
+        self.clients.append(client)
+        if self.loop is None:
+            # comments keep the idle connections open through proxies
+            self.loop = task.LoopingCall(self.broadcast, ': heartbeat\n\n')
+            self.loop.start(self.heartbeat, now=False)
+
+    def removeClient(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        if not self.clients and self.loop is not None:
+            self.loop.stop()
+            self.loop = None
+
+    def broadcast(self, data):
+        for client in self.clients[:]:
+            client.write(data)
+
+    def event(self, kind, builder_name, **data):
+        if not self.clients:
+            return
+        self.last_id += 1
+        data.update(type=kind, builder=builder_name, time=time.time(),
+                    project=project_name(builder_name))
+        for client in self.clients[:]:
+            client.send(self.last_id, data)
+
+    # status events
+    def builderAdded(self, name, builder):
+        return self # subscribe to this builder
+
+    def builderChangedState(self, name, state):
+        self.event('builderChangedState', name, state=state)
+
+    def buildStarted(self, name, build):
+        self.event('buildStarted', name, number=build.getNumber())
+        return self # subscribe to the steps of this build
+
+    def stepStarted(self, build, step):
+        self.event('stepStarted', build.getBuilder().getName(),
+                   number=build.getNumber(), step=step.getName())
+
+    def stepFinished(self, build, step, results):
+        self.event('stepFinished', build.getBuilder().getName(),
+                   number=build.getNumber(), step=step.getName(),
+                   result=Results[results[0]])
+
+    def buildFinished(self, name, build, results):
+        self.event('buildFinished', name, number=build.getNumber(),
+                   result=Results[results])
+
+
+class EventClient(object):
+    """A connection to the ``/events`` page"""
+
+    def __init__(self, request, projects=(), lines=False):
+        self.request = request
+        self.projects = projects
+        self.lines = lines
+
+    def write(self, data):
+        if not self.lines:
+            self.request.write(data)
+
+    def send(self, event_id, data):
+        if self.projects and data['project'] not in self.projects:
+            return
+        if self.lines:
+            self.request.write(json.dumps(data, sort_keys=True) + '\n')
+        else:
+            self.request.write('id: %d\nevent: %s\ndata: %s\n\n' % (
+                event_id, data['type'], json.dumps(data, sort_keys=True)))
+
+
+class EventStreamResource(Resource):
+    """``/events`` streams the build events as server-sent events, or as
+    one JSON object per line with ``format=lines``. ``project=``
+    arguments only stream the events of the given projects."""
+
+    isLeaf = True
+
+    def __init__(self, stream):
+        Resource.__init__(self)
+        self.stream = stream
+
+    def render_GET(self, request):
+        if hasattr(request, "channel"):
+            # closed when the web status is reconfigured
+            request.site.buildbot_service.registerChannel(request.channel)
+        lines = request.args.get('format', [''])[0] == 'lines'
+        client = EventClient(request, request.args.get('project', []), lines)
+        request.setHeader('cache-control', 'no-cache')
+        if lines:
+            request.setHeader('content-type', 'application/json')
+        else:
+            request.setHeader('content-type', 'text/event-stream')
+            request.write('retry: 10000\n\n')
+        self.stream.addClient(client)
+        d = request.notifyFinish()
+        d.addBoth(lambda result: self.stream.removeClient(client))
+        return server.NOT_DONE_YET
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Locks used to keep builds from oversubscribing slaves"""
+from buildbot import locks
+from twisted.internet import reactor
+
+# Name of the slave lock every weighted project claims. Its per-slave count
+# is the capacity given in the ``slaves`` option of the master recipe.
+SLAVE_CAPACITY = 'slave capacity'
+
+
+class WeightedLockAccess(locks.LockAccess):
+    """A counting access that takes ``weight`` units of the lock"""
+
+    compare_attrs = ['lockid', 'mode', 'weight']
+
+    def __init__(self, lockid, weight=1):
+        locks.LockAccess.__init__(self, lockid, 'counting')
+        self.weight = weight
+
+
+class WeightedLock(locks.BaseLock):
+    """A lock whose counting owners each use up their access weight.
+
+    A ``maxCount`` of None means no limit. An owner heavier than the
+    whole lock is allowed to run alone so it can not wait forever. An
+    exclusive owner holds the lock alone, as with the buildbot locks.
+    """
+
+    def _getWeight(self):
+        return sum([getattr(access, 'weight', 1)
+                    for owner, access in self.owners])
+
+    def _isExclusive(self):
+        return bool([owner for owner, access in self.owners
+                     if access.mode == 'exclusive'])
+
+    def isAvailable(self, access):
+        if access.mode == 'exclusive':
+            return not self.owners
+        if self._isExclusive():
+            return False
+        if self.maxCount is None:
+            return True
+        used = self._getWeight()
+        return not used or \
+               used + getattr(access, 'weight', 1) <= self.maxCount
+
+    def claim(self, owner, access):
+        assert owner is not None
+        assert self.isAvailable(access), "ask for isAvailable() first"
+        self.owners.append((owner, access))
+
+    def release(self, owner, access):
+        entry = (owner, access)
+        assert entry in self.owners
+        self.owners.remove(entry)
+        # wake up waiters in order while they fit in the freed weight
+        used = self._getWeight()
+        exclusive = self._isExclusive()
+        while self.waiting:
+            access, d = self.waiting[0]
+            weight = getattr(access, 'weight', 1)
+            if exclusive:
+                break
+            if access.mode == 'exclusive':
+                if used:
+                    break
+                exclusive = True
+            elif used and self.maxCount is not None and \
+                 used + weight > self.maxCount:
+                break
+            used += weight
+            del self.waiting[0]
+            reactor.callLater(0, d.callback, self)
+
+
+class RealWeightedSlaveLock(locks.RealSlaveLock):
+
+    def getLock(self, slavebuilder):
+        slavename = slavebuilder.slave.slavename
+        if slavename not in self.locks:
+            maxCount = self.maxCountForSlave.get(slavename, self.maxCount)
+            lock = WeightedLock(self.name, maxCount)
+            lock.description = "<WeightedSlaveLock(%s, %s)[%s] %d>" % (
+                self.name, maxCount, slavename, id(lock))
+            self.locks[slavename] = lock
+        return self.locks[slavename]
+
+
+class WeightedSlaveLock(locks.SlaveLock):
+    """A slave lock claimed by weight instead of by build count"""
+
+    lockClass = RealWeightedSlaveLock
+
+    def access(self, mode='counting', weight=1):
+        if mode == 'exclusive':
+            return locks.SlaveLock.access(self, mode)
+        return WeightedLockAccess(self, weight)
+
+
+# lock ids shared by all projects of a configuration. Buildbot refuses
+# two different lock objects with the same name so projects must get the
+# same instance when they refer to the same lock.
+_lock_ids = {}
+
+def get_lock(klass, name, **kwargs):
+    """Return the lock id called name, reusing the known one when equal"""
+    lockid = klass(name, **kwargs)
+    if _lock_ids.get(name) != lockid:
+        _lock_ids[name] = lockid
+    return _lock_ids[name]
+
+
+def parse_locks(value):
+    """Parse a whitespace separated list of ``name`` or ``name:count``::
+
+        >>> parse_locks('svn plone-tests:2')
+        [('svn', 1), ('plone-tests', 2)]
+        >>> parse_locks('')
+        []
+        >>> parse_locks('svn:none')
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid lock definition 'svn:none'
+    """
+    result = []
+    for item in value.split():
+        name, sep, count = item.partition(':')
+        try:
+            count = count and int(count) or 1
+            if not name or count < 1:
+                raise ValueError
+        except ValueError:
+            raise ValueError("Invalid lock definition '%s'" % item)
+        result.append((name, count))
+    return result
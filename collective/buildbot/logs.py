@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Compressed step logs and their web pages"""
+import os
+from twisted.web import server
+from buildbot.status import builder
+from buildbot.status.builder import LogFile, LogFileProducer, LogFileScanner
+from buildbot.status.web import logs
+
+# number of bytes of output kept uncompressed next to a compressed log so
+# the end of the log can be shown without decompressing it
+tail_size = 64 * 1024
+
+
+def LogFileScanner__init__(self, chunk_cb, channels=[]):
+    _LogFileScanner__init__(self, chunk_cb, channels)
+    # the netstring parser of Twisted 10 is initialized with the connection
+    self.makeConnection(None)
+
+_LogFileScanner__init__ = LogFileScanner.__init__
+LogFileScanner.__init__ = LogFileScanner__init__
+
+
+class TailBuffer(object):
+    """Keep the last chunks of a log, up to size bytes of text::
+
+        >>> tail = TailBuffer(4)
+        >>> for chunk in [(0, 'abc'), (1, 'def'), (0, 'gh')]:
+        ...     tail.append(chunk)
+        >>> tail.chunks
+        [(1, 'ef'), (0, 'gh')]
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.length = 0
+        self.chunks = []
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.length += len(chunk[1])
+        while self.length > self.size:
+            channel, text = self.chunks[0]
+            extra = self.length - self.size
+            if extra >= len(text):
+                del self.chunks[0]
+                self.length -= len(text)
+            else:
+                self.chunks[0] = (channel, text[extra:])
+                self.length -= extra
+
+
+def encode_chunks(chunks):
+    """Encode chunks like buildbot does in its log files::
+
+        >>> encode_chunks([(0, 'abc'), (2, 'd')])
+        '4:0abc,2:2d,'
+    """
+    return ''.join(['%d:%d%s,' % (len(text) + 1, channel, text)
+                    for channel, text in chunks])
+
+
+def getTailFilename(logfile):
+    return logfile.getFilename() + '.tail'
+
+
+def LogFile__compressLog(self, compressed):
+    # compress the log and save its tail in the same pass over the file
+    infile = self.getFile()
+    if self.compressMethod == "bz2":
+        cf = builder.BZ2File(compressed, 'w')
+    elif self.compressMethod == "gz":
+        cf = builder.GzipFile(compressed, 'w')
+    tail = TailBuffer(tail_size)
+    scanner = LogFileScanner(tail.append)
+    bufsize = 1024*1024
+    while True:
+        buf = infile.read(bufsize)
+        cf.write(buf)
+        scanner.dataReceived(buf)
+        if len(buf) < bufsize:
+            break
+    cf.close()
+    if tail_size:
+        open(getTailFilename(self), 'wb').write(encode_chunks(tail.chunks))
+
+LogFile._compressLog = LogFile__compressLog
+
+
+def getTail(logfile, size=None):
+    """Return the (channel, text) chunks of the last size bytes of logfile.
+
+    The tail saved with a compressed log is used when it is big enough,
+    otherwise the log is read through.
+    """
+    if size is None:
+        size = tail_size
+    tail = TailBuffer(size)
+    filename = getTailFilename(logfile)
+    if logfile.isFinished() and size <= tail_size and \
+       os.path.exists(filename) and \
+       not os.path.exists(logfile.getFilename()):
+        scanner = LogFileScanner(tail.append)
+        scanner.dataReceived(open(filename, 'rb').read())
+    else:
+        for chunk in logfile.getChunks():
+            tail.append(chunk)
+    return tail.chunks
+
+
+class StreamingLogFileProducer(LogFileProducer):
+    """Read logs in large blocks. Decompressing small reads of a bz2 file
+    costs a lot of CPU."""
+
+    BUFFERSIZE = 64 * 1024
+
+
+class TextLog(logs.TextLog):
+    """The log page, streaming the log and giving its tail at ``tail``
+    (or ``tail/text``). The ``size`` query argument is the number of bytes
+    of the tail."""
+
+    def getChild(self, path, req):
+        if path == "tail":
+            return TailLog(self.original)
+        return logs.TextLog.getChild(self, path, req)
+
+    def render_GET(self, req):
+        self.req = req
+
+        if self.asText:
+            req.setHeader("content-type", "text/plain")
+        else:
+            req.setHeader("content-type", "text/html")
+
+        if not self.asText:
+            req.write(self.htmlHeader(req))
+
+        # the consumer pauses us when the client does not read fast enough
+        p = StreamingLogFileProducer(self.original,
+                                     logs.ChunkConsumer(req, self))
+        p.resumeProducing()
+        return server.NOT_DONE_YET
+
+
+class TailLog(logs.TextLog):
+
+    def htmlHeader(self, request):
+        data = logs.TextLog.htmlHeader(self, request)
+        return data.replace('<pre>\n', '<p>(end of the log)</p>\n<pre>\n')
+
+    def render_GET(self, req):
+        try:
+            size = int(req.args.get('size', [tail_size])[0])
+        except ValueError:
+            size = tail_size
+        if self.asText:
+            req.setHeader("content-type", "text/plain")
+            data = ''
+        else:
+            req.setHeader("content-type", "text/html")
+            data = self.htmlHeader(req)
+        data += self.content(getTail(self.original, size))
+        if not self.asText:
+            data += self.htmlFooter()
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        return data
+
+
+def LogsResource_getChild(self, path, req):
+    child = _LogsResource_getChild(self, path, req)
+    if isinstance(child, logs.TextLog):
+        return TextLog(child.original)
+    return child
+
+_LogsResource_getChild = logs.LogsResource.getChild
+logs.LogsResource.getChild = LogsResource_getChild
@@ -1,12 +1,22 @@
 # -*- coding: utf-8 -*-
 import os.path
+from collective.buildbot import metrics
+stop_config_timer = metrics.timer('config_load_seconds').start()
+
 from buildbot.process import factory
 from buildbot.changes.pb import PBChangeSource
 from buildbot.buildslave import BuildSlave
 from buildbot.status import words, client
 
 from collective.buildbot.overrides import WebStatus
-from collective.buildbot.project import Project
+from collective.buildbot import logs
+from collective.buildbot.coalesce import mergeRequests
+from collective.buildbot.retention import Pruner
+from collective.buildbot import analytics
+from collective.buildbot import profiling
+from collective.buildbot.profiling import Profiler, ReactorWatchdog
+from collective.buildbot.project import Project, expand_groups
+from collective.buildbot.paths import index_paths
 from collective.buildbot.poller import Poller
 from collective.buildbot.utils import Registry
 from ConfigParser import ConfigParser
@@ -35,6 +45,8 @@ c['change_source'] = [PBChangeSource()]
 c['schedulers'] = []
 c['builders'] = []
 c['status'] = []
+# projects with coalesce-builds merge all their queued requests
+c['mergeRequests'] = mergeRequests
 
 # slave configurations
 if config.has_option('buildbot', 'max-builds'):
@@ -55,8 +67,38 @@ c['slaves'] = [BuildSlave(name, password, max_builds=max_builds,
                           missing_timeout=3600) 
                for name, password in config.items('slaves')]
 
+# per slave capacity, shared by the weighted builds of all projects
+capacity = {}
+if config.has_section('slave-capacity'):
+    capacity = dict([(name, int(value))
+                     for name, value in config.items('slave-capacity')])
+for slave in c['slaves']:
+    slave.capacity = capacity.get(slave.slavename)
+
+# master wide defaults for the options of all projects
+project_defaults = {}
+for key in ('vcs-retry', 'skip-unchanged-builds'):
+    if config.has_option('buildbot', key):
+        project_defaults[key.replace('-', '_')] = config.get('buildbot', key)
+
+defaults = {'project': project_defaults, 'poller': {}}
+
+# in debug mode the configuration code is timed and the calls longer than
+# debug-slow-calls seconds are logged
+profiling.slow_call_threshold = None
+if config.has_option('buildbot', 'debug-slow-calls'):
+    profiling.slow_call_threshold = float(config.get('buildbot',
+                                                     'debug-slow-calls'))
+
+@profiling.watched
+def read_config(filename):
+    pconf = ConfigParser()
+    pconf.read(filename)
+    return pconf
+
 for name, klass in (('project', Project), ('poller', Poller)):
     registry = Registry()
+    instances = []
     dirname = config.get('buildbot', '%ss-directory' % name)
     if os.path.isdir(dirname):
         files = []
@@ -65,15 +107,29 @@ for name, klass in (('project', Project), ('poller', Poller)):
                 files.append(os.path.join(dirname, filename))
         files.sort()
         for filename in files:
-            pconf = ConfigParser()
-            pconf.read(filename)
+            pconf = read_config(filename)
 
-            kwargs = dict([(key.replace('-', '_'), value)
+            kwargs = dict(defaults[name])
+            kwargs.update([(key.replace('-', '_'), value)
                            for key, value
                            in pconf.items(name)])
-            instance = klass(**kwargs)
-            registry.add(instance.name, instance)
+            instances.append(klass(**kwargs))
+    if name == 'project':
+        expand_groups(instances)
+        index_paths(instances)
+    for instance in instances:
+        registry.add(instance.name, instance,
+                     getattr(instance, 'upstream', ()))
+    stop = metrics.timer('registry_everyone_seconds', kind=name).start()
     registry.everyone(c, registry)
+    stop()
+    if name == 'project':
+        # the graph of the dependent schedulers, for graphviz
+        f = open(os.path.join(basedir, 'projects.dot'), 'w')
+        try:
+            f.write(registry.dot('projects') + '\n')
+        finally:
+            f.close()
 
 projects_dir = config.get('buildbot', 'projects-directory')
 files = []
@@ -82,13 +138,77 @@ for filename in os.listdir(projects_dir):
         files.append(os.path.join(projects_dir, filename))
 
 
+# finished step logs bigger than log-compression-limit bytes are stored
+# compressed, with their tail kept aside for the web pages
+if config.has_option('buildbot', 'log-compression-limit'):
+    limit = config.get('buildbot', 'log-compression-limit')
+    if limit.lower() in ('false', 'off', 'none'):
+        c['logCompressionLimit'] = False
+    else:
+        c['logCompressionLimit'] = int(limit)
+if config.has_option('buildbot', 'log-compression-method'):
+    c['logCompressionMethod'] = config.get('buildbot',
+                                           'log-compression-method')
+if config.has_option('buildbot', 'log-tail-size'):
+    logs.tail_size = int(config.get('buildbot', 'log-tail-size'))
+
+# retention of the build history, pruned incrementally in the background
+retention = {}
+for key, kind in (('keep-builds', int), ('keep-days', float),
+                  ('keep-logs-days', float), ('keep-failed-logs-days', float),
+                  ('prune-interval', int)):
+    if config.has_option('buildbot', key):
+        retention[key.replace('-', '_')] = kind(config.get('buildbot', key))
+if 'prune_interval' in retention:
+    retention['interval'] = retention.pop('prune_interval')
+if [key for key in retention if key.startswith('keep_')]:
+    c['status'].append(Pruner(**retention))
+
+# the metrics are shown at /metrics and logged every metrics-log-interval
+# seconds
+metrics_log_interval = 3600
+if config.has_option('buildbot', 'metrics-log-interval'):
+    metrics_log_interval = int(config.get('buildbot',
+                                          'metrics-log-interval'))
+if metrics_log_interval:
+    c['status'].append(metrics.MetricsLogger(metrics_log_interval))
+
+# the durations and queue waits of the builds are appended to build-stats,
+# summed by bin/<master>-report
+build_stats = None
+if config.has_option('buildbot', 'build-stats'):
+    build_stats = analytics.stats_file(config.get('buildbot', 'build-stats'))
+if build_stats:
+    c['status'].append(analytics.BuildRecorder(build_stats))
+
+# bin/<master> profile asks for a profile of the running master, and the
+# stack of the reactor is logged when it is blocked for
+# reactor-lag-threshold seconds
+c['status'].append(Profiler())
+reactor_lag_threshold = 5
+if config.has_option('buildbot', 'reactor-lag-threshold'):
+    reactor_lag_threshold = float(config.get('buildbot',
+                                             'reactor-lag-threshold'))
+if reactor_lag_threshold:
+    c['status'].append(ReactorWatchdog(reactor_lag_threshold))
+
 ######################################################
 # Status
 allowForce = False
 if config.has_option('buildbot', 'allow-force'):
     allowForce = config.get('buildbot', 'allow-force') == 'true'
 
-c['status'].append(WebStatus(http_port=wport, allowForce=allowForce))
+# rendered pages are cached for web-cache-ttl seconds or until a build
+# event, and views of many builders can be paginated
+web_options = {}
+if config.has_option('buildbot', 'web-cache-ttl'):
+    web_options['cache_ttl'] = int(config.get('buildbot', 'web-cache-ttl'))
+if config.has_option('buildbot', 'builders-per-page'):
+    web_options['builders_per_page'] = int(config.get('buildbot',
+                                                      'builders-per-page'))
+
+c['status'].append(WebStatus(http_port=wport, allowForce=allowForce,
+                             **web_options))
 
 #IRC bot if one need it
 irc_host = irc_channels = irc_nickname = irc_password = '' 
@@ -130,3 +250,5 @@ c['slavePortnum'] = port
 c['projectName'] = config.get('buildbot', 'project-name')
 c['projectURL'] = config.get('buildbot', 'project-url')
 c['buildbotURL'] = config.get('buildbot','url')
+
+stop_config_timer()
@@ -67,10 +67,14 @@ class Recipe(BaseRecipe):
 
 
         # generates the buildbot.cfg file
-        slaves = options.pop('slaves')
-        slaves = dict([slave.split()[:2]
-                       for slave in slaves.splitlines()
-                       if slave.strip() != ''])
+        slaves = [slave.split()
+                  for slave in options.pop('slaves').splitlines()
+                  if slave.strip() != '']
+        # an optional third value is the capacity of the slave, in the
+        # same units as the ``weight`` option of projects
+        capacity = dict([(slave[0], slave[2])
+                         for slave in slaves if len(slave) > 2])
+        slaves = dict([slave[:2] for slave in slaves])
 
         parts_directory = join(self.buildout['buildout']['parts-directory'])
         for k in ( 'projects', 'pollers'):
@@ -93,12 +97,16 @@ class Recipe(BaseRecipe):
 
         globs = dict(buildbot=options,
                      slaves=slaves)
+        if capacity:
+            globs['slave-capacity'] = capacity
 
         files.append(self.write_config('buildbot', **globs))
 
         # generate script
         options = {'eggs':'collective.buildbot',
-                   'entry-points': '%s=collective.buildbot.scripts:main' % self.name,
+                   'entry-points': ('%s=collective.buildbot.scripts:master '
+                                    '%s-report=collective.buildbot.scripts:report'
+                                    % (self.name, self.name)),
                    'arguments': 'location=%r, config_file=%r' % (
                        self.location, join(self.location, 'buildbot.cfg'))
                   }
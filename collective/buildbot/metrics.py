@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Counters and timers of the master, shown at ``/metrics``"""
+import time
+from twisted.internet import defer, task
+from twisted.python import log
+from twisted.web.resource import Resource
+from buildbot.status.base import StatusReceiverMultiService
+
+# upper bounds, in seconds, of the buckets of the timers
+TIMER_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 60)
+
+
+def format_labels(labels):
+    """Format labels the Prometheus way::
+
+        >>> format_labels((('kind', 'project'), ('name', 'a"b')))
+        '{kind="project",name="a\\\\"b"}'
+        >>> format_labels(())
+        ''
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (k, str(v).replace('"', '\\"'))
+                              for k, v in labels])
+
+
+class Counter(object):
+    """A value which only goes up"""
+
+    kind = 'counter'
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def summary(self):
+        return '%s' % self.value
+
+
+class Histogram(object):
+    """Count the observed values in buckets::
+
+        >>> h = Histogram('size', buckets=(10, 100))
+        >>> for value in (5, 50, 500):
+        ...     h.observe(value)
+        >>> for sample in h.samples():
+        ...     print sample
+        ('size_bucket', (('le', '10'),), 1)
+        ('size_bucket', (('le', '100'),), 2)
+        ('size_bucket', (('le', '+Inf'),), 3)
+        ('size_sum', (), 555)
+        ('size_count', (), 3)
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, labels=(), buckets=TIMER_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = None
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def samples(self):
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            labels = self.labels + (('le', '%g' % bound),)
+            result.append((self.name + '_bucket', labels, count))
+        result.append((self.name + '_bucket',
+                       self.labels + (('le', '+Inf'),), self.count))
+        result.append((self.name + '_sum', self.labels, self.sum))
+        result.append((self.name + '_count', self.labels, self.count))
+        return result
+
+    def summary(self):
+        if not self.count:
+            return '0'
+        return '%d avg=%g max=%g' % (self.count, self.sum / self.count,
+                                     self.max)
+
+
+class Timer(Histogram):
+    """A histogram of durations in seconds"""
+
+    def start(self):
+        """Return a function which records the time elapsed since start"""
+        started = time.time()
+        def stop(result=None):
+            self.observe(time.time() - started)
+            return result
+        return stop
+
+    def timeDeferred(self, d):
+        """Record the time until the deferred d fires"""
+        stop = self.start()
+        d.addBoth(stop)
+        return d
+
+
+class Metrics(object):
+    """The metrics of a process, by name and labels"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def get(self, klass, name, labels):
+        labels = tuple(sorted(labels.items()))
+        key = (name, labels)
+        if key not in self.metrics:
+            self.metrics[key] = klass(name, labels)
+        return self.metrics[key]
+
+    def counter(self, name, **labels):
+        return self.get(Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        return self.get(Histogram, name, labels)
+
+    def timer(self, name, **labels):
+        return self.get(Timer, name, labels)
+
+    def render(self):
+        """Return the metrics in the Prometheus text format"""
+        lines = []
+        typed = set()
+        for key in sorted(self.metrics):
+            metric = self.metrics[key]
+            if metric.name not in typed:
+                typed.add(metric.name)
+                lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, format_labels(labels),
+                                          value))
+        return '\n'.join(lines) + '\n'
+
+    def log(self):
+        for key in sorted(self.metrics):
+            metric = self.metrics[key]
+            log.msg('metrics: %s%s %s' % (metric.name,
+                                          format_labels(metric.labels),
+                                          metric.summary()))
+
+
+# the metrics of the master
+metrics = Metrics()
+counter = metrics.counter
+histogram = metrics.histogram
+timer = metrics.timer
+
+
+def timed(name, **labels):
+    """Decorate a function so its calls are timed. The time until the
+    deferred it returns fires is recorded for asynchronous functions."""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            t = timer(name, **labels)
+            stop = t.start()
+            try:
+                result = func(*args, **kwargs)
+            except:
+                counter(name + '_errors', **labels).inc()
+                stop()
+                raise
+            if isinstance(result, defer.Deferred):
+                return t.timeDeferred(result)
+            stop()
+            return result
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+class MetricsResource(Resource):
+    """``/metrics`` gives the metrics of the master as plain text"""
+
+    isLeaf = True
+
+    def __init__(self, metrics=metrics):
+        Resource.__init__(self)
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'text/plain; version=0.0.4')
+        return self.metrics.render()
+
+
+class MetricsLogger(StatusReceiverMultiService):
+    """Write the metrics in twistd.log every interval seconds"""
+
+    compare_attrs = ['interval']
+
+    def __init__(self, interval=3600):
+        StatusReceiverMultiService.__init__(self)
+        self.interval = interval
+        self.loop = None
+
+    def startService(self):
+        StatusReceiverMultiService.startService(self)
+        self.loop = task.LoopingCall(metrics.log)
+        self.loop.start(self.interval, now=False)
+
+    def stopService(self):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        return StatusReceiverMultiService.stopService(self)
@@ -1,5 +1,20 @@
 # -*- coding: utf-8 -*-
+import time
+import urllib
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+from twisted.web import http, server
+from twisted.web.resource import Resource
+from buildbot import util
+from buildbot.status.base import StatusReceiver
 from buildbot.status.web import baseweb, about
+from buildbot.status.web.waterfall import WaterfallStatusResource
+from buildbot.status.web.builder import BuildersResource
+from collective.buildbot.jsonstatus import StatusTracker, JsonStatusResource
+from collective.buildbot.jsonstatus import EventStream, EventStreamResource
+from collective.buildbot.metrics import MetricsResource
 
 class AboutCollectiveBuildBot(about.AboutBuildbot):
 
@@ -15,9 +30,184 @@ class AboutCollectiveBuildBot(about.AboutBuildbot):
         """
         return data
 
+def paginate(names, page, per_page):
+    """Return the names shown on page, the number of pages and the page::
+
+        >>> names = ['a', 'b', 'c', 'd', 'e']
+        >>> paginate(names, 1, 2)
+        (['c', 'd'], 3, 1)
+        >>> paginate(names, 10, 2)
+        (['e'], 3, 2)
+        >>> paginate(names, 0, None)
+        (['a', 'b', 'c', 'd', 'e'], 1, 0)
+    """
+    if not per_page:
+        return names, 1, 0
+    pages = max(1, (len(names) + per_page - 1) / per_page)
+    page = min(max(page, 0), pages - 1)
+    return names[page*per_page:(page+1)*per_page], pages, page
+
+def getPage(request):
+    try:
+        return int(request.args.get('page', [0])[0])
+    except ValueError:
+        return 0
+
+def pageLinks(request, page, pages):
+    """Links to the previous and next pages of a paginated view"""
+    if pages < 2:
+        return ''
+    args = [(k, v) for k, values in request.args.items() if k != 'page'
+            for v in values]
+    links = []
+    for label, number in (('previous', page - 1), ('next', page + 1)):
+        if 0 <= number < pages:
+            query = urllib.urlencode(args + [('page', number)])
+            links.append('<a href="?%s">%s</a>' % (query, label))
+    return '<p class="pages">page %d of %d %s</p>\n' % (
+        page + 1, pages, ' '.join(links))
+
+class PaginatedWaterfall(WaterfallStatusResource):
+    """A waterfall showing builders_per_page builders unless builders are
+    selected with builder= arguments"""
+
+    def __init__(self, builders_per_page=None, **kwargs):
+        WaterfallStatusResource.__init__(self, **kwargs)
+        self.builders_per_page = builders_per_page
+
+    def body(self, request):
+        if not self.builders_per_page or \
+           request.args.get('builder') or request.args.get('show'):
+            return WaterfallStatusResource.body(self, request)
+        status = self.getStatus(request)
+        names = status.getBuilderNames(categories=self.categories)
+        names, pages, page = paginate(names, getPage(request),
+                                      self.builders_per_page)
+        request.args['builder'] = names
+        try:
+            data = WaterfallStatusResource.body(self, request)
+        finally:
+            del request.args['builder']
+        return pageLinks(request, page, pages) + data
+
+class PaginatedBuildersResource(BuildersResource):
+
+    def __init__(self, builders_per_page=None):
+        BuildersResource.__init__(self)
+        self.builders_per_page = builders_per_page
+
+    def body(self, req):
+        s = self.getStatus(req)
+        names, pages, page = paginate(s.getBuilderNames(), getPage(req),
+                                      self.builders_per_page)
+        data = ""
+        data += "<h1>Builders</h1>\n"
+        data += pageLinks(req, page, pages)
+        data += '<ol start="%d">\n' % (page * (self.builders_per_page or 0) + 1)
+        for bname in names:
+            data += (' <li><a href="%s">%s</a></li>\n' %
+                     (req.childLink(urllib.quote(bname, safe='')),
+                      bname))
+        data += "</ol>\n"
+        data += self.footer(s, req)
+        return data
+
+class PageCache(StatusReceiver):
+    """Rendered pages, forgotten after ttl seconds or on build events"""
+
+    def __init__(self, ttl=60, size=100):
+        self.ttl = ttl
+        self.size = size
+        self.pages = {}
+
+    def get(self, key):
+        page = self.pages.get(key)
+        if page is not None and time.time() - page[0] < self.ttl:
+            return page
+        return None
+
+    def set(self, key, content_type, data):
+        if len(self.pages) >= self.size:
+            oldest = min([(page[0], k) for k, page in self.pages.items()])
+            del self.pages[oldest[1]]
+        page = (time.time(), content_type, data,
+                '"%s"' % md5(data).hexdigest())
+        self.pages[key] = page
+        return page
+
+    def invalidate(self, *args):
+        self.pages.clear()
+
+    # status events
+    def builderAdded(self, name, builder):
+        self.invalidate()
+        return self # subscribe to the builds of this builder
+
+    def buildStarted(self, name, build):
+        self.invalidate()
+        return self # subscribe to the steps of this build
+
+    builderRemoved = builderChangedState = buildFinished = invalidate
+    stepStarted = stepFinished = invalidate
+
+class CachedResource(Resource):
+    """Serve the pages of resource from the cache, with ETag and
+    Last-Modified headers"""
+
+    def __init__(self, resource, cache):
+        Resource.__init__(self)
+        self.resource = resource
+        self.cache = cache
+
+    def getChildWithDefault(self, path, request):
+        child = self.resource.getChildWithDefault(path, request)
+        if child is self.resource:
+            return self
+        return child
+
+    def render(self, request):
+        if not self.cache.ttl or request.method != 'GET':
+            return self.resource.render(request)
+        if hasattr(request, "channel"):
+            # like HtmlResource.render does for reconfigurations
+            request.site.buildbot_service.registerChannel(request.channel)
+        key = request.uri
+        page = self.cache.get(key)
+        if page is None:
+            data = self.resource.render(request)
+            if data is server.NOT_DONE_YET:
+                return data
+            page = self.cache.set(key, request.headers.get('content-type'),
+                                  data)
+        rendered, content_type, data, etag = page
+        if content_type:
+            request.setHeader('content-type', content_type)
+        if request.setETag(etag) is http.CACHED or \
+           request.setLastModified(rendered) is http.CACHED:
+            return ''
+        return data
+
 _marker = object()
 
-class WebStatus(baseweb.WebStatus):
+# pages which are rendered from the cache
+cached_pages = ('waterfall', 'grid', 'tgrid', 'console', 'builders',
+                'one_line_per_build', 'one_box_per_builder')
+
+class WebStatus(util.ComparableMixin, baseweb.WebStatus):
+
+    # an equal web status is kept on reconfigurations, a different one
+    # replaces it
+    compare_attrs = ['http_port', 'distrib_port', 'allowForce',
+                     'public_html', 'num_events', 'orderConsoleByTime',
+                     'cache_ttl', 'builders_per_page']
+
+    def __init__(self, cache_ttl=60, builders_per_page=None, **kwargs):
+        self.cache_ttl = cache_ttl
+        self.page_cache = PageCache(ttl=cache_ttl)
+        self.tracker = StatusTracker()
+        self.event_stream = EventStream()
+        self.builders_per_page = builders_per_page
+        baseweb.WebStatus.__init__(self, **kwargs)
 
     def setupUsualPages(self, numbuilds=_marker,
                               num_events=200,
@@ -29,4 +219,29 @@ class WebStatus(baseweb.WebStatus):
                                                     num_events=num_events,
                                                     num_events_max=num_events_max)
         self.putChild('about', AboutCollectiveBuildBot())
+        self.putChild('json', JsonStatusResource(self.tracker))
+        self.putChild('events', EventStreamResource(self.event_stream))
+        self.putChild('metrics', MetricsResource())
+        if self.builders_per_page:
+            self.putChild('waterfall', PaginatedWaterfall(
+                builders_per_page=self.builders_per_page,
+                num_events=num_events, num_events_max=num_events_max))
+            self.putChild('builders', PaginatedBuildersResource(
+                builders_per_page=self.builders_per_page))
+        for name in cached_pages:
+            # older buildbots do not have all the pages
+            if name in self.childrenToBeAdded:
+                self.putChild(name, CachedResource(
+                    self.childrenToBeAdded[name], self.page_cache))
+
+    def setServiceParent(self, parent):
+        baseweb.WebStatus.setServiceParent(self, parent)
+        self.getStatus().subscribe(self.page_cache)
+        self.getStatus().subscribe(self.tracker)
+        self.getStatus().subscribe(self.event_stream)
 
+    def disownServiceParent(self):
+        self.getStatus().unsubscribe(self.page_cache)
+        self.getStatus().unsubscribe(self.tracker)
+        self.getStatus().unsubscribe(self.event_stream)
+        return baseweb.WebStatus.disownServiceParent(self)
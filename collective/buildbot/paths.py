@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Projects affected by the files of a change, for monorepos"""
+import re
+from fnmatch import fnmatchcase
+
+glob_re = re.compile(r'[*?[]')
+
+
+def literal_prefix(pattern):
+    """Return the directory a glob pattern is in and whether the pattern is
+    a glob, or the pattern itself when it has no glob characters::
+
+        >>> literal_prefix('src/app/*.py')
+        ('src/app', True)
+        >>> literal_prefix('*.cfg')
+        ('', True)
+        >>> literal_prefix('src/lib/')
+        ('src/lib', False)
+    """
+    mo = glob_re.search(pattern)
+    if mo is None:
+        return pattern.strip('/'), False
+    head = pattern[:mo.start()]
+    if '/' not in head:
+        return '', True
+    return head.rsplit('/', 1)[0], True
+
+
+def prefixes(path):
+    """Return the directories a path is in, and the path itself::
+
+        >>> prefixes('src/app/views.py')
+        ['', 'src', 'src/app', 'src/app/views.py']
+    """
+    parts = path.strip('/').split('/')
+    return [''] + ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+class PathIndex(object):
+    """The projects of the ``paths`` option of projects, indexed by the
+    directories of the patterns::
+
+        >>> index = PathIndex()
+        >>> index.add('app', ['src/app', 'setup.py'])
+        >>> index.add('lib', ['src/lib/*.py', '*.cfg'])
+        >>> sorted(index.projects(['src/app/views.py']))
+        ['app']
+        >>> sorted(index.projects(['src/lib/utils.py', 'buildout.cfg']))
+        ['lib']
+        >>> sorted(index.projects(['setup.py', 'src/lib/README.txt']))
+        ['app']
+        >>> sorted(index.projects(['docs/index.txt']))
+        []
+
+    A pattern without glob characters matches the file or the directory
+    of that name. ``*`` matches ``/`` too: ``src/*.py`` matches all the
+    modules in ``src``. The projects are found in time proportional to the
+    number and depth of the files, whatever the number of projects.
+    """
+
+    def __init__(self):
+        # directory -> [project]: every file in it is of the projects
+        self.directories = {}
+        # directory -> [(pattern, project)]: the files of the directory,
+        # or of its subdirectories, matching the patterns
+        self.globs = {}
+        self.patterns = {}
+        self.last = (None, None)
+
+    def add(self, project, patterns):
+        self.patterns[project] = tuple(patterns)
+        for pattern in patterns:
+            pattern = pattern.lstrip('/')
+            prefix, is_glob = literal_prefix(pattern)
+            if is_glob:
+                self.globs.setdefault(prefix, []).append((pattern, project))
+            else:
+                self.directories.setdefault(prefix, []).append(project)
+        self.last = (None, None)
+
+    def projects(self, files):
+        """Return the set of the projects affected by files"""
+        affected = set()
+        for path in files:
+            path = path.strip('/')
+            for prefix in prefixes(path):
+                affected.update(self.directories.get(prefix, ()))
+                for pattern, project in self.globs.get(prefix, ()):
+                    if project not in affected and fnmatchcase(path, pattern):
+                        affected.add(project)
+        return affected
+
+    def affected(self, change):
+        """Return the projects affected by a change. The last change is
+        remembered, as it is given to the schedulers of all the projects
+        one after the other"""
+        last, projects = self.last
+        if last is not change:
+            projects = self.projects(change.files)
+            self.last = (change, projects)
+        return projects
+
+
+class PathChecker(object):
+    """fileIsImportant of the schedulers of a project with ``paths``"""
+
+    def __init__(self, project, index):
+        self.project = project
+        self.index = index
+
+    def __call__(self, change):
+        return self.project in self.index.affected(change)
+
+    # schedulers are kept on reconfigurations when they compare equal
+    def __eq__(self, other):
+        return isinstance(other, PathChecker) and \
+               self.project == other.project and \
+               self.index.patterns.get(self.project) == \
+               other.index.patterns.get(other.project)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def index_paths(projects):
+    """Index the paths of all the projects in one PathIndex given to each
+    project with paths"""
+    index = PathIndex()
+    for project in projects:
+        if project.paths:
+            index.add(project.name, project.paths)
+            project.path_index = index
+    return index
@@ -1,5 +1,7 @@
 from buildbot.changes import svnpoller
 from twisted.python import log
+from collective.buildbot.metrics import counter, timed
+from collective.buildbot.profiling import watched
 import re
 
 _default_splitter = '(?P<project>\S+\/trunk|\S+\/branches\/[^\/]+)/(?P<relative>.*)'
@@ -46,6 +48,21 @@ def split_file(path, splitter=_default_splitter):
 
     return None
 
+class SVNPoller(svnpoller.SVNPoller):
+    """A SVNPoller timing its runs"""
+
+    checksvn = timed('poller_run_seconds', vcs='svn')(
+        svnpoller.SVNPoller.checksvn)
+
+    def finished_failure(self, f):
+        counter('poller_failures_total', vcs='svn').inc()
+        return svnpoller.SVNPoller.finished_failure(self, f)
+
+    def create_changes(self, new_logentries):
+        changes = svnpoller.SVNPoller.create_changes(self, new_logentries)
+        counter('poller_changes_total', vcs='svn').inc(len(changes))
+        return changes
+
 class Poller(object):
     """A poller
     """
@@ -55,6 +72,7 @@ class Poller(object):
         self.vcs = options.pop('vcs')
         self.options = options
 
+    @watched
     def __call__(self, c, registry):
         if self.vcs == 'svn':
             self.setSVNPoller(c)
@@ -76,5 +94,5 @@ class Poller(object):
             svnbin=self.options.get('svn_binary', 'svn'),
             split_file=lambda path: split_file(path, splitter))
 
-        c['change_source'].append(svnpoller.SVNPoller(svnurl, **options))
+        c['change_source'].append(SVNPoller(svnurl, **options))
 
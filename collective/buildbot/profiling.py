@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""Profiling of a running master and detection of a blocked reactor"""
+import os
+import sys
+import time
+import signal
+import thread
+import threading
+import traceback
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+import pstats
+from twisted.internet import defer, reactor, task
+from twisted.python import failure, log
+from buildbot.status.base import StatusReceiverMultiService
+from collective.buildbot import metrics
+
+# the file in which ``bin/<master> profile`` asks for a profile
+REQUEST_FILE = 'profile.request'
+PROFILE_SIGNAL = getattr(signal, 'SIGUSR2', None)
+
+
+def format_stack(frame):
+    """Return a stack as a flame graph line, the outermost call first::
+
+        >>> def inner():
+        ...     return format_stack(sys._getframe())
+        >>> def outer():
+        ...     return inner()
+        >>> [call.split()[0] for call in outer().split(';')[-2:]]
+        ['outer', 'inner']
+    """
+    calls = []
+    while frame is not None:
+        code = frame.f_code
+        calls.append('%s (%s:%d)' % (code.co_name,
+                                     os.path.basename(code.co_filename),
+                                     frame.f_lineno))
+        frame = frame.f_back
+    calls.reverse()
+    return ';'.join(calls)
+
+
+# in debug mode, the calls of watched functions longer than this number of
+# seconds are logged. None disables the debug mode.
+slow_call_threshold = None
+
+
+def call_label(func, args):
+    """Return the name of a watched function and the project, or the file,
+    it was called for::
+
+        >>> class Project(object):
+        ...     name = 'my.project'
+        ...     def setBuilder(self, c):
+        ...         pass
+        >>> call_label(Project.setBuilder.im_func, (Project(), {}))
+        ('Project.setBuilder', 'my.project')
+        >>> call_label(format_stack, ('projects/my.project.cfg',))
+        ('format_stack', 'projects/my.project.cfg')
+    """
+    name = func.__name__
+    klass = args and getattr(args[0], '__class__', None)
+    if klass is not None and getattr(klass, name, None) is not None:
+        return ('%s.%s' % (klass.__name__, name),
+                getattr(args[0], 'name', None))
+    if args and isinstance(args[0], basestring):
+        return name, args[0]
+    return name, None
+
+
+def watched(func):
+    """Decorate a function run on the reactor thread. In debug mode its
+    calls are timed and the ones longer than slow_call_threshold are
+    logged"""
+    def wrapper(*args, **kwargs):
+        if slow_call_threshold is None:
+            return func(*args, **kwargs)
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            label, target = call_label(func, args)
+            metrics.timer('call_seconds', function=label).observe(elapsed)
+            if elapsed > slow_call_threshold:
+                metrics.counter('slow_calls_total', function=label).inc()
+                if target is None:
+                    target = ''
+                else:
+                    target = ' for %s' % target
+                log.msg('slow call: %s%s took %.3f seconds' % (
+                        label, target, elapsed))
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def request_profile(basedir, seconds=30, kind='cprofile'):
+    """Ask the master running in basedir for a profile of seconds. Return
+    the pid of the master"""
+    if PROFILE_SIGNAL is None:
+        raise RuntimeError('Profiling needs the SIGUSR2 signal')
+    pid = int(open(os.path.join(basedir, 'twistd.pid')).read().strip())
+    f = open(os.path.join(basedir, REQUEST_FILE), 'w')
+    try:
+        f.write('%s %s\n' % (seconds, kind))
+    finally:
+        f.close()
+    os.kill(pid, PROFILE_SIGNAL)
+    return pid
+
+
+class Profiler(StatusReceiverMultiService):
+    """Profile the master when it receives SIGUSR2.
+
+    ``bin/<master> profile`` writes the duration and the kind of profile in
+    ``profile.request``. A ``cprofile`` profile is dumped in
+    ``profile-<time>.prof`` with its summary in ``profile-<time>.txt``. A
+    ``sample`` profile looks at the stack of the reactor every ``rate``
+    seconds and counts the stacks in ``profile-<time>.stacks``, a format
+    read by flame graph tools. Sampling slows the master down much less.
+    """
+
+    compare_attrs = ['rate']
+
+    def __init__(self, rate=0.005):
+        StatusReceiverMultiService.__init__(self)
+        self.rate = rate
+        self.profiling = None
+        self.previous_handler = None
+
+    def setServiceParent(self, parent):
+        StatusReceiverMultiService.setServiceParent(self, parent)
+        self.basedir = self.parent.basedir
+
+    def startService(self):
+        StatusReceiverMultiService.startService(self)
+        self.reactor_thread = thread.get_ident()
+        if PROFILE_SIGNAL is not None:
+            self.previous_handler = signal.signal(PROFILE_SIGNAL,
+                                                  self._handleSIGUSR2)
+
+    def stopService(self):
+        if PROFILE_SIGNAL is not None and self.previous_handler is not None:
+            signal.signal(PROFILE_SIGNAL, self.previous_handler)
+            self.previous_handler = None
+        return StatusReceiverMultiService.stopService(self)
+
+    def _handleSIGUSR2(self, *args):
+        # callFromThread wakes the reactor up, unlike callLater
+        reactor.callFromThread(self.profileRequested)
+
+    def profileRequested(self):
+        filename = os.path.join(self.basedir, REQUEST_FILE)
+        seconds, kind = 30, 'cprofile'
+        try:
+            values = open(filename).read().split()
+            os.unlink(filename)
+            seconds, kind = float(values[0]), values[1]
+        except (IOError, OSError, IndexError, ValueError):
+            log.msg('No valid %s, profiling with %s for %s seconds' % (
+                    REQUEST_FILE, kind, seconds))
+        return self.profile(seconds, kind)
+
+    def profile(self, seconds, kind='cprofile'):
+        """Profile the master for seconds. Return a deferred firing with the
+        name of the file written"""
+        if self.profiling is not None:
+            log.msg('The master is already being profiled')
+            return self.profiling
+        if kind not in ('cprofile', 'sample'):
+            log.msg('Unknown kind of profile %r, using cprofile' % kind)
+            kind = 'cprofile'
+        path = os.path.join(self.basedir,
+                            time.strftime('profile-%Y%m%d-%H%M%S'))
+        log.msg('Profiling the master with %s for %s seconds' % (kind,
+                                                                  seconds))
+        if kind == 'sample':
+            d = self.sample(seconds, path + '.stacks')
+        else:
+            d = self.cprofile(seconds, path)
+        def done(filename):
+            self.profiling = None
+            log.msg('Profile of the master written in %s' % filename)
+            return filename
+        def failed(f):
+            self.profiling = None
+            log.err(f)
+        d.addCallbacks(done, failed)
+        self.profiling = d
+        return d
+
+    def cprofile(self, seconds, path):
+        d = defer.Deferred()
+        profiler = profile.Profile()
+        def stop():
+            profiler.disable()
+            profiler.dump_stats(path + '.prof')
+            f = open(path + '.txt', 'w')
+            try:
+                stats = pstats.Stats(path + '.prof', stream=f)
+                stats.sort_stats('cumulative').print_stats(50)
+            finally:
+                f.close()
+            return path + '.prof'
+        # only the reactor thread is profiled
+        profiler.enable()
+        reactor.callLater(seconds, lambda: d.callback(None))
+        d.addCallback(lambda result: stop())
+        return d
+
+    def sample(self, seconds, filename):
+        d = defer.Deferred()
+        def run():
+            stacks = {}
+            end = time.time() + seconds
+            try:
+                while time.time() < end:
+                    frame = sys._current_frames().get(self.reactor_thread)
+                    if frame is not None:
+                        stack = format_stack(frame)
+                        stacks[stack] = stacks.get(stack, 0) + 1
+                    del frame
+                    time.sleep(self.rate)
+                f = open(filename, 'w')
+                try:
+                    for stack, count in sorted(stacks.items(),
+                                               key=lambda item: -item[1]):
+                        f.write('%s %d\n' % (stack, count))
+                finally:
+                    f.close()
+            except:
+                reactor.callFromThread(d.errback, failure.Failure())
+            else:
+                reactor.callFromThread(d.callback, filename)
+        sampler = threading.Thread(target=run, name='profile sampler')
+        sampler.setDaemon(True)
+        sampler.start()
+        return d
+
+
+class ReactorWatchdog(StatusReceiverMultiService):
+    """Log the stack of the reactor when it has not run for threshold
+    seconds, like when a slow synchronous call blocks it.
+
+    The reactor ticks every ``threshold / 4`` seconds and a thread checks
+    the ticks. The delays of the ticks are kept in the
+    ``reactor_lag_seconds`` metric.
+    """
+
+    compare_attrs = ['threshold']
+
+    def __init__(self, threshold=5):
+        StatusReceiverMultiService.__init__(self)
+        self.threshold = threshold
+        self.interval = threshold / 4.0
+        self.loop = None
+        self.stopped = None
+
+    def startService(self):
+        StatusReceiverMultiService.startService(self)
+        self.reactor_thread = thread.get_ident()
+        self.last_tick = time.time()
+        self.blocked = False
+        self.loop = task.LoopingCall(self.tick)
+        self.loop.start(self.interval, now=False)
+        self.stopped = threading.Event()
+        watcher = threading.Thread(target=self.watch, args=(self.stopped,),
+                                   name='reactor watchdog')
+        watcher.setDaemon(True)
+        watcher.start()
+
+    def stopService(self):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        if self.stopped is not None:
+            self.stopped.set()
+        return StatusReceiverMultiService.stopService(self)
+
+    def tick(self):
+        now = time.time()
+        lag = max(0, now - self.last_tick - self.interval)
+        metrics.timer('reactor_lag_seconds').observe(lag)
+        if self.blocked:
+            log.msg('The reactor was blocked for %.1f seconds' % lag)
+            self.blocked = False
+        self.last_tick = now
+
+    def watch(self, stopped):
+        while not stopped.isSet():
+            stopped.wait(self.interval)
+            if self.blocked:
+                continue
+            blocked = time.time() - self.last_tick - self.interval
+            if blocked > self.threshold:
+                self.blocked = True
+                frame = sys._current_frames().get(self.reactor_thread)
+                if frame is not None:
+                    stack = ''.join(traceback.format_stack(frame))
+                    del frame
+                    log.msg('The reactor is blocked for %.1f seconds in:\n%s'
+                            % (blocked, stack))
@@ -2,7 +2,13 @@ import os
 from os.path import join
 
 from collective.buildbot.scheduler import SVNScheduler, FixedScheduler
-from buildbot.scheduler import Nightly, Periodic, Dependent, Scheduler
+from collective.buildbot.scheduler import AdaptiveScheduler, parse_timer
+from collective.buildbot.scheduler import ChangedPeriodic, CronScheduler
+from collective.buildbot.coalesce import CoalescingBuild, BuildSuperseder
+from collective.buildbot.cache import CachedBuild, CachedCoalescingBuild
+from collective.buildbot.cache import fingerprint
+from buildbot.scheduler import Dependent
+from buildbot.locks import MasterLock, SlaveLock
 from buildbot.process import factory
 from buildbot import steps
 from buildbot.steps.python import PyFlakes
@@ -11,42 +17,97 @@ from buildbot.status.builder import Results
 from twisted.python import log
 
 from collective.buildbot.utils import split_option
-
-CRON_MAX_RANGE = {0: (60, 0), 1:(24, 0), 2:(31, 1), 3:(12, 1), 4:(7, 0)}.get
-
-def cron_value_to_setting(value, max_range=24, min_range=0):
-    """Convert a value in a cron setting to a value which can be
-    understood by the Nightly scheduler.
+from collective.buildbot.locks import WeightedSlaveLock, SLAVE_CAPACITY
+from collective.buildbot.locks import get_lock, parse_locks
+from collective.buildbot.metrics import timed
+from collective.buildbot.profiling import watched
+from collective.buildbot.paths import PathChecker, PathIndex
+
+def parse_retry(value):
+    """Convert a ``vcs-retry`` option to the retry argument of the source
+    steps. The delay and the number of retries are mandatory::
+
+        >>> parse_retry('10 3')
+        (10, 3)
+
+    A backoff factor applied to the delay after each retry and a jitter
+    ratio spreading the delays are optional::
+
+        >>> parse_retry('10 3 2 0.5')
+        (10, 3, 2.0, 0.5)
+        >>> parse_retry('10 3 2')
+        (10, 3, 2.0, 0.0)
+        >>> parse_retry('10 3 2 1.5')
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid vcs retry settings '10 3 2 1.5'
+
+    No retries, or an empty value, turn the retries off::
+
+        >>> parse_retry('10 0'), parse_retry('')
+        (None, None)
     """
+    values = value.split()
+    if not values:
+        return None
     try:
-        if ',' in value:
-            return map(int, value.split(','))
-        elif value == '*':
-            return value
-        elif value.startswith('*/'):
-            return range(min_range, max_range, int(value[2:]))
-        return int(value)
+        if len(values) not in (2, 3, 4):
+            raise ValueError
+        delay, repeats = int(values[0]), int(values[1])
+        if delay < 0 or repeats < 0:
+            raise ValueError
+        if repeats == 0:
+            return None
+        if len(values) == 2:
+            return delay, repeats
+        backoff = float(values[2])
+        jitter = len(values) == 4 and float(values[3]) or 0.0
+        if backoff < 1 or not 0 <= jitter < 1:
+            raise ValueError
     except ValueError:
-        raise ValueError("Invalid cron value '%s'" % value)
+        raise ValueError("Invalid vcs retry settings '%s'" % value)
+    return delay, repeats, backoff, jitter
 
 
-def convert_cron_to_setting(cron):
-    """Convert a cron-like will to valid settings for the Nightly scheduler.
-    """
-    cron_values = cron.split()
-    if len(cron_values) != 5:
-        raise ValueError("Invalid cron settings %s (too much values)" % cron)
-    return [cron_value_to_setting(v, *CRON_MAX_RANGE(i))
-            for i, v in enumerate(cron_values)]
+s = factory.s
 
+class MailNotifier(mail.MailNotifier):
+    """A MailNotifier timing the mails it sends"""
 
-s = factory.s
+    sendMessage = timed('mail_send_seconds')(mail.MailNotifier.sendMessage)
+
+def expand_groups(projects):
+    """Replace the sections of the Projects recipe, made of several
+    repositories, by their projects in the upstream projects of projects::
+
+        >>> class P(object):
+        ...     def __init__(self, name, upstream=(), group=None):
+        ...         self.name, self.upstream, self.group = name, upstream, group
+        >>> projects = [P('eggs.a', group='eggs'), P('eggs.b', group='eggs'),
+        ...             P('app', ['eggs', 'lib']), P('lib')]
+        >>> expand_groups(projects)
+        >>> projects[2].upstream
+        ['eggs.a', 'eggs.b', 'lib']
+    """
+    names = set([p.name for p in projects])
+    groups = {}
+    for project in projects:
+        if project.group is not None and project.group not in names:
+            groups.setdefault(project.group, []).append(project.name)
+    for project in projects:
+        upstream = []
+        for name in project.upstream:
+            for member in groups.get(name, [name]):
+                if member != project.name and member not in upstream:
+                    upstream.append(member)
+        project.upstream = upstream
 
 class FileChecker:
 
     def __init__(self, frags):
         self.frags = frags
 
+    @watched
     def __call__(self, change):
         for f in change.files:
             for frag in self.frags:
@@ -88,10 +149,20 @@ class Project(object):
         >>> print project.email_notification_recipients
         ['gael@ingeniweb.com', 'buildout@ingeniweb.com']
 
+    Builds can be weighted against the capacity of the slaves and claim
+    named slave or master locks, with an optional count::
+
+        >>> config_opts['weight'] = '3'
+        >>> config_opts['master_locks'] = 'svn:2'
+        >>> project = Project(**config_opts)
+        >>> print project.weight, project.master_locks, project.slave_locks
+        3 [('svn', 2)] []
+
     Please note that .cfg files likely contain dashes (e.g. `-`) that are transformed into
     underscored (e.g. `_`).
     """
 
+    @watched
     def __init__(self, **options):
         self.name = options.get('name')
 
@@ -108,10 +179,24 @@ class Project(object):
         self.slave_names =  options.get('slave_names', '').split()
         self.vcs = options.get('vcs', 'svn')
         self.vcs_mode = options.get('vcs_mode', 'update')
-        self.vcs_retry = (10, 3)
+        if self.vcs_mode == 'mirror' and self.vcs != 'git':
+            raise ValueError('vcs-mode mirror is only supported for git')
+        self.vcs_retry = parse_retry(options.get('vcs_retry', '10 3'))
         self.always_use_latest = (
             options.get('always_use_latest', '').strip().lower() in
             ('yes', 'true', 'y') or False)
+        self.coalesce_builds = (
+            options.get('coalesce_builds', '').strip().lower() in
+            ('yes', 'true', 'y') or False)
+        self.supersede_builds = (
+            options.get('supersede_builds', '').strip().lower() in
+            ('yes', 'true', 'y') or False)
+        self.only_if_changed = (
+            options.get('only_if_changed', '').strip().lower() in
+            ('yes', 'true', 'y') or False)
+        self.skip_unchanged_builds = (
+            options.get('skip_unchanged_builds', '').strip().lower() in
+            ('yes', 'true', 'y') or False)
 
         d_timeout = options.get('timeout', '3600').strip()
         self.timeout = int(d_timeout)
@@ -125,12 +210,28 @@ class Project(object):
             self.test_sequence = [join('bin', 'test')]
 
         self.dependencies = split_option(options, 'dependencies')
+        # the projects whose schedulers trigger the builds of this one
+        self.upstream = options.get('dependent_scheduler', '').split()
+        # the Projects section this project was made from
+        self.group = options.get('project_group', None)
+        # only the changes of files matching paths build the project,
+        # looked up in the index of all the projects given by the master
+        self.paths = options.get('paths', '').split()
+        self.path_index = None
+        self.tree_stable_timer = parse_timer(
+            options.get('tree_stable_timer'), 120)
+        self.dependencies_tree_stable_timer = parse_timer(
+            options.get('dependencies_tree_stable_timer'), 60)
+        self.weight = int(options.get('weight', '1').strip())
+        self.slave_locks = parse_locks(options.get('slave_locks', ''))
+        self.master_locks = parse_locks(options.get('master_locks', ''))
         self.repository = options.get('repository', '')
         self.branch = options.get('branch', '')
         self.options = options
         self.schedulers = []
         self.username, self.password = self._get_login(self.repository)
 
+    @watched
     def _get_login(self, repository):
         """gets an option in .httpauth"""
         httpauth = join(os.path.expanduser('~'), '.buildout', '.httpauth')
@@ -154,7 +255,11 @@ class Project(object):
                 return
         raise RuntimeError('No valid bot name in %r' % self.slave_names)
 
+    @watched
     def setStatus(self, c):
+        if self.supersede_builds:
+            c['status'].append(BuildSuperseder(self.builders()))
+
         if not self.email_notification_sender or \
            not self.email_notification_recipients:
             log.msg('Skipping MailNotifier for project %s: from: %s, to: %s' % (
@@ -162,7 +267,7 @@ class Project(object):
                       self.email_notification_recipients))
         else:
             try:
-                c['status'].append(mail.MailNotifier(
+                c['status'].append(MailNotifier(
                         builders=self.builders(),
                         fromaddr=self.email_notification_sender,
                         extraRecipients=self.email_notification_recipients,
@@ -178,6 +283,7 @@ class Project(object):
                         self.name, self.email_notification_sender,
                         self.email_notification_recipients))
 
+    @watched
     def __call__(self, c, registry):
         log.msg('Trying to add %s project' % self.name)
         try:
@@ -191,19 +297,62 @@ class Project(object):
 
         log.msg('Project %s added' % self.name)
 
+    def getLocks(self, c):
+        """Return the lock accesses claimed by every build of the project"""
+        accesses = []
+        capacity = dict([(b.slavename, b.capacity) for b in c['slaves']
+                         if getattr(b, 'capacity', None)])
+        if capacity:
+            lock = get_lock(WeightedSlaveLock, SLAVE_CAPACITY,
+                            maxCount=None, maxCountForSlave=capacity)
+            accesses.append(lock.access(weight=self.weight))
+        for name, count in self.slave_locks:
+            lock = get_lock(SlaveLock, name, maxCount=count)
+            accesses.append(lock.access('counting'))
+        for name, count in self.master_locks:
+            lock = get_lock(MasterLock, name, maxCount=count)
+            accesses.append(lock.access('counting'))
+        return accesses
+
     def builder(self, name):
         return '%s %s' % (self.name, name)
 
     def builders(self):
         return [self.builder(s) for s in self.slave_names]
 
+    def fileIsImportant(self):
+        """Return the fileIsImportant of the schedulers of changes"""
+        if not self.paths:
+            return None
+        if self.path_index is None:
+            self.path_index = PathIndex()
+            self.path_index.add(self.name, self.paths)
+        return PathChecker(self.name, self.path_index)
+
+    def changedOptions(self):
+        """The arguments of the periodic schedulers building only changed
+        projects"""
+        if not self.only_if_changed:
+            return {}
+        options = {'onlyIfChanged': True,
+                   'fileIsImportant': self.fileIsImportant()}
+        if self.vcs == 'svn':
+            options['repository'] = self.repository
+        elif self.branch:
+            options['branch'] = self.branch
+        return options
+
+    @watched
     def setScheduler(self, c, registry):
 
         # Always set a scheduler used by pollers
         if self.vcs == 'svn':
+            timer, burst = self.tree_stable_timer
             self.schedulers.append(
                     SVNScheduler('Scheduler for %s' % self.name, self.builders(),
-                                 repository=self.repository))
+                                 repository=self.repository,
+                                 treeStableTimer=timer, burstTimer=burst,
+                                 fileIsImportant=self.fileIsImportant()))
 
         # Set up the default scheduler, which can be helpful with VCSs not
         # supported by the pollers (yet), e.g. Git
@@ -217,7 +366,8 @@ class Project(object):
                 self.schedulers.append(
                     FixedScheduler(name=name, branch=self.branch,
                               builderNames=self.builders(),
-                              treeStableTimer=timer))
+                              treeStableTimer=timer,
+                              fileIsImportant=self.fileIsImportant()))
             except (ValueError, TypeError):
                 log.msg('Invalid definition for the default '
                         'scheduler: %s' % default)
@@ -233,7 +383,8 @@ class Project(object):
 
                 name = 'Periodic scheduler for %s' % self.name
                 self.schedulers.append(
-                    Periodic(name, self.builders(), period * 60))
+                    ChangedPeriodic(name, self.builders(), period * 60,
+                                    **self.changedOptions()))
             except (TypeError, ValueError):
                 log.msg('Invalid period for periodic scheduler: %s' % period)
                 raise
@@ -242,18 +393,20 @@ class Project(object):
         cron = self.options.get('cron_scheduler', None)
         if cron is not None:
             try:
-                when = convert_cron_to_setting(cron)
                 name = 'Cron scheduler for %s at %s' % (self.name, cron)
-                self.schedulers.append(Nightly(name, self.builders(), *when))
+                self.schedulers.append(
+                    CronScheduler(name, self.builders(), cron,
+                                  **self.changedOptions()))
 
             except (IndexError, ValueError, TypeError):
                 log.msg('Invalid cron definition for the cron '
                         'scheduler: %s' % cron)
                 raise
 
-        # Set up a dependent scheduler
-        dependent = self.options.get('dependent_scheduler', None)
-        if dependent is not None:
+        # Set up the dependent schedulers. An upstream project which is
+        # also upstream of another upstream project triggers this one
+        # through it, after it
+        for dependent in registry.immediate(self.name):
             try:
                 for parent in registry.runned(dependent, c, registry).schedulers:
                     name = ('Dependent scheduler between scheduler <%s> '
@@ -272,17 +425,20 @@ class Project(object):
         if dependencies:
             name = 'Dependency scheduler watching %s for %s' % (
                 ', '.join(map(repr, dependencies)), self.name)
+            timer, burst = self.dependencies_tree_stable_timer
             self.schedulers.append(
-                Scheduler(name=name, branch=None,
-                          builderNames=self.builders(),
-                          treeStableTimer=60,
-                          fileIsImportant=FileChecker(tuple(dependencies)),
-                          ))
+                AdaptiveScheduler(name=name, branch=None,
+                                  builderNames=self.builders(),
+                                  treeStableTimer=timer,
+                                  burstTimer=burst,
+                                  fileIsImportant=FileChecker(tuple(dependencies)),
+                                  ))
 
         log.msg('Adding schedulers for %s: %s' % (self.name, self.schedulers))
 
         c['schedulers'].extend(self.schedulers)
 
+    @watched
     def setBuilder(self, c):
         executable = self.executable()
 
@@ -317,7 +473,12 @@ class Project(object):
                                  alwaysUseLatest=self.always_use_latest,
                                  **extra)]
         elif self.vcs == 'git':
-            update_sequence = [s(steps.source.Git, mode=self.vcs_mode,
+            # in mirror mode the build tree is recreated at each build
+            # from a mirror of the repository kept on the slave
+            mirror = self.vcs_mode == 'mirror'
+            update_sequence = [s(steps.source.Git,
+                                 mode=mirror and 'clobber' or self.vcs_mode,
+                                 mirror=mirror,
                                  retry=self.vcs_retry,
                                  repourl=self.repository,
                                  branch=self.branch,
@@ -365,13 +526,26 @@ class Project(object):
         sequence = (update_sequence + build_sequence +
                     test_sequence + pyflakes_sequence)
 
+        locks = self.getLocks(c)
+
+        build_factory = factory.BuildFactory(sequence)
+        if self.skip_unchanged_builds:
+            build_factory.fingerprint = fingerprint(sequence)
+            if self.coalesce_builds:
+                build_factory.buildClass = CachedCoalescingBuild
+            else:
+                build_factory.buildClass = CachedBuild
+        elif self.coalesce_builds:
+            build_factory.buildClass = CoalescingBuild
+
         for slave_name in self.slave_names:
             log.msg('Adding slave %s to %s project' % (slave_name, self.name))
             name = '%s_%s' % (self.name, slave_name)
             builder = {'name': self.builder(slave_name),
                        'slavename': slave_name,
                        'builddir': name,
-                       'factory': factory.BuildFactory(sequence)
+                       'factory': build_factory,
+                       'locks': locks,
                       }
 
             c['builders'].append(builder)
@@ -3,6 +3,7 @@ import random
 import os
 from os.path import join
 from collective.buildbot.recipe import BaseRecipe
+from collective.buildbot.cron import ALIASES
 
 import logging
 
@@ -151,6 +152,7 @@ class Projects(BaseRecipe):
 
         cron = options.pop('cron-scheduler', None)
         if cron is not None:
+            cron = ALIASES.get(cron.strip().lower(), cron)
             try:
                 minute, hour, dom, month, dow = [v for v in cron.split()[:5]]
             except (IndexError, ValueError, TypeError):
@@ -181,10 +183,9 @@ class Projects(BaseRecipe):
                     name = '%s_%s' % (self.extract_name(repository), idx)
                     idx += 1
                 project_names.add(name)
-                if 'dependent-scheduler'in options:
-                    # TODO
-                    log.info('dependent-scheduler is selected with projects'
-                             ' including more than one repository.')
+                # the projects depending on this section depend on all
+                # the projects of its repositories
+                options['project-group'] = self.name
             else:
                 name = self.name
 
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Pruning of the build history kept by the master"""
+import os
+import re
+import time
+import cPickle
+from buildbot.status.builder import FAILURE, EXCEPTION
+from buildbot.status.base import StatusReceiverMultiService
+from twisted.internet import defer, reactor, task
+from twisted.python import log
+
+DAY = 24 * 60 * 60
+
+build_re = re.compile(r"^([0-9]+)$")
+build_log_re = re.compile(r"^([0-9]+)-.*$")
+
+
+def build_files(filenames):
+    """Group the files of a builder directory by build number::
+
+        >>> files = build_files(['12', '12-log-test-stdio.bz2', '13',
+        ...                      'builder', '13-log-test-stdio'])
+        >>> sorted(files.items())
+        [(12, ['12', '12-log-test-stdio.bz2']), (13, ['13', '13-log-test-stdio'])]
+    """
+    builds = {}
+    for filename in sorted(filenames):
+        mo = build_re.match(filename) or build_log_re.match(filename)
+        if mo:
+            builds.setdefault(int(mo.group(1)), []).append(filename)
+    return builds
+
+
+class Pruner(StatusReceiverMultiService):
+    """Remove old builds and logs from the master.
+
+    A build is removed when it is not one of the last ``keep_builds``
+    builds of its builder or when it is older than ``keep_days``. The logs
+    of a build are removed after ``keep_logs_days``, or after
+    ``keep_failed_logs_days`` when the build failed. None means no limit.
+
+    Every ``interval`` seconds the builder directories are walked, at most
+    ``batch`` builds at a time before giving control back to the reactor.
+    """
+
+    compare_attrs = ['keep_builds', 'keep_days', 'keep_logs_days',
+                     'keep_failed_logs_days', 'interval', 'batch']
+
+    def __init__(self, keep_builds=None, keep_days=None, keep_logs_days=None,
+                 keep_failed_logs_days=None, interval=3600, batch=20):
+        StatusReceiverMultiService.__init__(self)
+        self.keep_builds = keep_builds
+        self.keep_days = keep_days
+        self.keep_logs_days = keep_logs_days
+        self.keep_failed_logs_days = keep_failed_logs_days
+        self.interval = interval
+        self.batch = batch
+        # results of finished builds never change
+        self.results = {}
+        self.pruning = None
+        self.loop = None
+
+    def setServiceParent(self, parent):
+        StatusReceiverMultiService.setServiceParent(self, parent)
+        self.master_status = self.parent.getStatus()
+
+    def startService(self):
+        StatusReceiverMultiService.startService(self)
+        self.loop = task.LoopingCall(self.prune)
+        # the first pass waits for the master to be up
+        self.loop.start(self.interval, now=False)
+
+    def stopService(self):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        return StatusReceiverMultiService.stopService(self)
+
+    def prune(self):
+        """Start a pass over all the builders, unless one is running"""
+        if self.pruning is not None:
+            return self.pruning
+        d = defer.Deferred()
+        self.pruning = d
+        work = self.pruneAll()
+        def step():
+            try:
+                for i in range(self.batch):
+                    work.next()
+            except StopIteration:
+                self.pruning = None
+                d.callback(None)
+            except:
+                self.pruning = None
+                log.err()
+                d.callback(None)
+            else:
+                reactor.callLater(0, step)
+        step()
+        return d
+
+    def pruneAll(self):
+        for name in self.master_status.getBuilderNames():
+            builder = self.master_status.getBuilder(name)
+            for unit in self.pruneBuilder(builder):
+                yield unit
+
+    def pruneBuilder(self, builder, now=None):
+        """Yield once per build checked"""
+        if now is None:
+            now = time.time()
+        if not os.path.isdir(builder.basedir):
+            return
+        builds = build_files(os.listdir(builder.basedir))
+        running = [b.getNumber() for b in builder.getCurrentBuilds()]
+        for number in sorted(builds):
+            filenames = builds[number]
+            if number in running or str(number) not in filenames:
+                # running or not saved yet
+                continue
+            age = self.age(builder, number, now)
+            if age is None:
+                continue
+            if (self.keep_builds and
+                number < builder.nextBuildNumber - self.keep_builds) or \
+               (self.keep_days is not None and age > self.keep_days * DAY):
+                self.remove(builder, filenames)
+                self.results.pop((builder.name, number), None)
+            else:
+                logs = [f for f in filenames if f != str(number)]
+                if logs and self.expired_logs(builder, number, age):
+                    self.remove(builder, logs)
+            yield number
+
+    def age(self, builder, number, now):
+        filename = os.path.join(builder.basedir, str(number))
+        try:
+            return now - os.path.getmtime(filename)
+        except OSError:
+            return None
+
+    def expired_logs(self, builder, number, age):
+        if self.keep_logs_days is None or age <= self.keep_logs_days * DAY:
+            return False
+        if self.keep_failed_logs_days is None:
+            return not self.failed(builder, number)
+        if age > self.keep_failed_logs_days * DAY:
+            return True
+        return not self.failed(builder, number)
+
+    def failed(self, builder, number):
+        key = (builder.name, number)
+        if key not in self.results:
+            filename = os.path.join(builder.basedir, str(number))
+            try:
+                # the build cache of the builder is left alone
+                build = cPickle.load(open(filename, 'rb'))
+                self.results[key] = build.getResults()
+            except Exception:
+                log.msg('Can not read build %s of %s' % (number,
+                                                        builder.name))
+                return True
+        return self.results[key] in (FAILURE, EXCEPTION)
+
+    def remove(self, builder, filenames):
+        for filename in filenames:
+            pathname = os.path.join(builder.basedir, filename)
+            log.msg("pruning '%s'" % pathname)
+            try:
+                os.unlink(pathname)
+            except OSError:
+                pass
@@ -1,31 +1,95 @@
 # -*- coding: utf-8 -*-
-from buildbot.scheduler import Scheduler
+import time
+from buildbot import buildset
+from buildbot.scheduler import Scheduler, Periodic, Nightly
+from buildbot.sourcestamp import SourceStamp
 from twisted.python import log
+from collective.buildbot.cache import last_revision
+from collective.buildbot.cron import CronTab
+from collective.buildbot.metrics import counter, timed
 
 
-class SVNScheduler(Scheduler):
+def parse_timer(value, default):
+    """Parse a tree stable timer option. A single value is a fixed timer, a
+    second value is the timer used when a burst of changes is detected::
+
+        >>> parse_timer('30', 120)
+        (30, None)
+        >>> parse_timer('5 300', 120)
+        (5, 300)
+        >>> parse_timer(None, 120)
+        (120, None)
+        >>> parse_timer('soon', 120)
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid tree stable timer 'soon'
+    """
+    if value is None or not value.strip():
+        return default, None
+    try:
+        values = [int(v) for v in value.split()]
+        if len(values) > 2 or [v for v in values if v < 0]:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Invalid tree stable timer '%s'" % value)
+    if len(values) == 1:
+        return values[0], None
+    return tuple(values)
+
+
+class AdaptiveScheduler(Scheduler):
+    """Scheduler waiting for ``treeStableTimer`` after a single change, and
+    for ``burstTimer`` once more changes arrive before the build started."""
+
+    compare_attrs = Scheduler.compare_attrs + ('burstTimer',)
+
+    def __init__(self, *args, **kwargs):
+        self.burstTimer = kwargs.pop('burstTimer', None)
+        Scheduler.__init__(self, *args, **kwargs)
+
+    def addImportantChange(self, change):
+        if self.burstTimer is None or not self.importantChanges:
+            Scheduler.addImportantChange(self, change)
+            return
+        log.msg("%s: burst of changes, adding %s" % (self, change))
+        self.importantChanges.append(change)
+        self.allChanges.append(change)
+        self.nextBuildTime = max(self.nextBuildTime,
+                                 change.when + self.burstTimer)
+        self.setTimer(self.nextBuildTime)
+
+
+class SVNScheduler(AdaptiveScheduler):
     """Extend Scheduler to allow multiple projects"""
 
-    def __init__(self, name, builderNames, repository):
+    def __init__(self, name, builderNames, repository,
+                 treeStableTimer=120, burstTimer=None, fileIsImportant=None):
         """Override Scheduler.__init__
         Add a new parameter : repository
         """
-        Scheduler.__init__(self, name, None, 120,
-                           builderNames, fileIsImportant=None)
+        AdaptiveScheduler.__init__(self, name, None, treeStableTimer,
+                                   builderNames,
+                                   fileIsImportant=fileIsImportant,
+                                   burstTimer=burstTimer)
         self.repository = repository
 
+    @timed('scheduler_add_change_seconds')
     def addChange(self, change):
         """Call Scheduler.addChange only if the branch name (eg. project name
         in your case) is in the repository url"""
         if isinstance(change.branch, basestring):
             if self.repository.endswith(change.branch):
                 self.branch = change.branch
+                counter('scheduler_changes_total', accepted='true').inc()
                 Scheduler.addChange(self, change)
+                return
+        counter('scheduler_changes_total', accepted='false').inc()
 
 
-class FixedScheduler(Scheduler):
+class FixedScheduler(AdaptiveScheduler):
     """ fix Scheduler to (somewhat) respect `branch=None` """
 
+    @timed('scheduler_add_change_seconds')
     def addChange(self, change):
         """ for some vcs, e.g. git, the default branch cannot be determined
             leading to "ignored off-branch changes" in the log.  this can be
@@ -35,3 +99,197 @@ class FixedScheduler(Scheduler):
             log.msg('%s ignoring change due to unknown default branch. '
                     'please set one using `branch = ...`' % self)
         Scheduler.addChange(self, change)
+
+
+def on_branch(repository, branch):
+    """Whether branch is the end of the path of repository, compared
+    segment by segment::
+
+        >>> on_branch('http://svn/foo/trunk', 'foo/trunk')
+        True
+        >>> on_branch('http://svn/foo/trunk/', '/trunk')
+        True
+        >>> on_branch('http://svn/foo/trunk', 'o/trunk')
+        False
+        >>> on_branch('http://svn/foo/trunk', '')
+        False
+    """
+    branch = branch.strip('/')
+    return bool(branch) and \
+           ('/' + repository.rstrip('/')).endswith('/' + branch)
+
+
+def newer(revision, built):
+    """Whether revision is newer than the revision built. Subversion
+    revisions are numbers, other revisions are only compared for
+    equality::
+
+        >>> newer('105', '100'), newer(100, '105'), newer('100', 100)
+        (True, False, False)
+        >>> newer('5f3c1a2', 'e4d2b9a'), newer('5f3c1a2', '5f3c1a2')
+        (True, False)
+        >>> newer('5f3c1a2', None)
+        True
+    """
+    if built is None:
+        return True
+    revision, built = str(revision), str(built)
+    if revision.isdigit() and built.isdigit():
+        return int(revision) > int(built)
+    return revision != built
+
+
+class RevisionTracker:
+    """Periodic schedulers which, with ``onlyIfChanged``, only build when
+    the latest known revision of their branch is newer than the revisions
+    last built by their builders.
+
+    Their builds have a ``periodic`` property, so the builds of already
+    built revisions can be skipped.
+
+    The latest revision is the one of the last change of the branch. Until
+    a change arrives it is the last revision seen by the poller of the
+    ``repository``, or unknown and the builds happen as usual. Only the
+    Subversion pollers give their last revision, so the projects of other
+    repositories build until their first change.
+    """
+
+    onlyIfChanged = False
+    repository = None
+    fileIsImportant = None
+    latestRevision = None
+
+    def isOnBranch(self, change):
+        if self.repository:
+            return isinstance(change.branch, basestring) and \
+                   on_branch(self.repository, change.branch)
+        return change.branch == self.branch
+
+    def addChange(self, change):
+        if not self.onlyIfChanged or not self.isOnBranch(change):
+            return
+        if self.fileIsImportant is not None and \
+           not self.fileIsImportant(change):
+            return
+        if change.revision is not None and \
+           newer(change.revision, self.latestRevision):
+            self.latestRevision = change.revision
+
+    def pollerRevision(self):
+        if not self.repository or self.parent is None:
+            return None
+        for source in self.parent.change_svc:
+            svnurl = getattr(source, 'svnurl', None)
+            if svnurl and self.repository.startswith(svnurl):
+                return getattr(source, 'last_change', None)
+        return None
+
+    def hasChanged(self):
+        """Whether a builder did not build the latest revision yet"""
+        if self.latestRevision is None:
+            # the revisions built are compared to the head of the
+            # repository from now on
+            self.latestRevision = self.pollerRevision()
+            if self.latestRevision is None:
+                return True
+        status = self.parent.getStatus()
+        for name in self.listBuilderNames():
+            try:
+                builder_status = status.getBuilder(name)
+            except KeyError:
+                return True
+            if newer(self.latestRevision,
+                     last_revision(builder_status, self.branch)):
+                return True
+        return False
+
+    def skipBuild(self):
+        log.msg('%s: revision %s is already built, skipping the build' % (
+                self, self.latestRevision))
+        counter('scheduler_skipped_builds_total').inc()
+
+
+class ChangedPeriodic(RevisionTracker, Periodic):
+    """Periodic scheduler which can only build changed branches"""
+
+    compare_attrs = Periodic.compare_attrs + ('onlyIfChanged', 'repository',
+                                              'fileIsImportant')
+
+    def __init__(self, name, builderNames, periodicBuildTimer, branch=None,
+                 properties={}, onlyIfChanged=False, repository=None,
+                 fileIsImportant=None):
+        Periodic.__init__(self, name, builderNames, periodicBuildTimer,
+                          branch=branch, properties=properties)
+        self.onlyIfChanged = onlyIfChanged
+        self.repository = repository
+        self.fileIsImportant = fileIsImportant
+        self.properties.setProperty('periodic', True, 'Scheduler')
+
+    def doPeriodicBuild(self):
+        if self.onlyIfChanged and not self.hasChanged():
+            self.skipBuild()
+            return
+        Periodic.doPeriodicBuild(self)
+
+
+class ChangedNightly(RevisionTracker, Nightly):
+    """Nightly scheduler which can only build changed branches. Unlike the
+    ``onlyIfChanged`` of Nightly, the revisions built are compared, so a
+    change already built by another scheduler does not build again"""
+
+    compare_attrs = Nightly.compare_attrs + ('repository',)
+
+    def __init__(self, name, builderNames, minute=0, hour='*',
+                 dayOfMonth='*', month='*', dayOfWeek='*', branch=None,
+                 fileIsImportant=None, onlyIfChanged=False, properties={},
+                 repository=None):
+        Nightly.__init__(self, name, builderNames, minute=minute, hour=hour,
+                         dayOfMonth=dayOfMonth, month=month,
+                         dayOfWeek=dayOfWeek, branch=branch,
+                         fileIsImportant=fileIsImportant,
+                         properties=properties)
+        self.onlyIfChanged = onlyIfChanged
+        self.repository = repository
+        self.properties.setProperty('periodic', True, 'Scheduler')
+
+    def doPeriodicBuild(self):
+        self.setTimer()
+        if self.onlyIfChanged and not self.hasChanged():
+            self.skipBuild()
+            return
+        bs = buildset.BuildSet(self.builderNames,
+                               SourceStamp(branch=self.branch),
+                               self.reason,
+                               properties=self.properties)
+        self.submitBuildSet(bs)
+
+
+class CronScheduler(ChangedNightly):
+    """Scheduler building at the times of a cron expression. The next
+    time is computed from the expression at once, not by trying every
+    minute to come like Nightly"""
+
+    compare_attrs = ChangedNightly.compare_attrs + ('cron',)
+
+    def __init__(self, name, builderNames, cron, branch=None,
+                 fileIsImportant=None, onlyIfChanged=False, properties={},
+                 repository=None):
+        self.crontab = CronTab(cron)
+        ChangedNightly.__init__(self, name, builderNames, branch=branch,
+                                fileIsImportant=fileIsImportant,
+                                onlyIfChanged=onlyIfChanged,
+                                properties=properties, repository=repository)
+        self.cron = cron
+
+    def isRunTime(self, timetuple):
+        return self.crontab.matches(timetuple)
+
+    def calculateNextRunTime(self):
+        now = time.time()
+        if self.nextRunTime is not None:
+            # a timer firing a bit early does not build twice
+            now = max(now, self.nextRunTime)
+        return self.calculateNextRunTimeFrom(now)
+
+    def calculateNextRunTimeFrom(self, now):
+        return self.crontab.next(now)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+from optparse import OptionParser
+from ConfigParser import ConfigParser
 import buildbot.scripts.runner
 
 def main(location, config_file):
@@ -12,3 +14,50 @@ def main(location, config_file):
         sys.argv = [sys.argv[0], cmd, location]
         buildbot.scripts.runner.run()
 
+def master(location, config_file):
+    """bin/<master>, which can also profile the master"""
+    if len(sys.argv) > 1 and sys.argv[1] == 'profile':
+        profile(location)
+    else:
+        main(location, config_file)
+
+def profile(location):
+    """Ask the running master for a profile of some seconds"""
+    from collective.buildbot import profiling
+    parser = OptionParser(usage='%prog profile [options] [seconds]')
+    parser.add_option('-s', '--sample', action='store_const',
+                      dest='kind', const='sample', default='cprofile',
+                      help='sample the stack of the master instead of '
+                           'tracing all the calls')
+    options, args = parser.parse_args(sys.argv[2:])
+    seconds = 30
+    if args:
+        seconds = float(args[0])
+    try:
+        pid = profiling.request_profile(location, seconds, options.kind)
+    except (IOError, OSError, RuntimeError), e:
+        print 'Can not profile the master: %s' % e
+        sys.exit(1)
+    print ('Profiling the master (pid %d) for %s seconds, the profile is '
+           'written in %s' % (pid, seconds, location))
+
+def report(location, config_file):
+    """Sum the durations and queue waits recorded by the master"""
+    from collective.buildbot import analytics
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-b', '--by', default='project',
+                      choices=['project', 'builder', 'slave', 'step'],
+                      help='project, builder, slave or step')
+    parser.add_option('-d', '--days', type='float',
+                      help='only the builds of the last DAYS days')
+    options, args = parser.parse_args()
+    filename = None
+    config = ConfigParser()
+    config.read([config_file])
+    if config.has_option('buildbot', 'build-stats'):
+        filename = analytics.stats_file(config.get('buildbot', 'build-stats'))
+    if filename is None:
+        print 'The builds are not recorded, see the build-stats option'
+        sys.exit(1)
+    print analytics.report(os.path.join(location, filename), options.by,
+                           options.days)
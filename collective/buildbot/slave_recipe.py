@@ -25,6 +25,21 @@ class Recipe(BaseRecipe):
         data['base_dir'] = location
         data['slave_name'] = self.name
         data['umask'] = self.options.get('umask', 'None')
+        data.setdefault('environment_header', 'full')
+        if data['environment_header'] not in ('full', 'diff', 'hash', 'off'):
+            raise zc.buildout.UserError(
+                'Invalid environment-header %r' % data['environment_header'])
+        data.setdefault('update_interval', '0.1')
+        data.setdefault('update_size', '16384')
+        data.setdefault('compress_output', '0')
+        try:
+            float(data['update_interval']), int(data['update_size'])
+        except ValueError:
+            raise zc.buildout.UserError(
+                'Invalid update-interval or update-size')
+        if data['compress_output'] not in [str(i) for i in range(10)]:
+            raise zc.buildout.UserError(
+                'Invalid compress-output %r' % data['compress_output'])
 
         template = open(join(self.recipe_dir, 'slave.tac_tmpl')).read()
         template = template % data
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+from buildbot.status.builder import SUCCESS, FAILURE
+from collective.buildbot.analytics import BuildRecorder, read_records
+
+
+class Fake(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeStep(object):
+
+    def __init__(self, name, times, results):
+        self.name = name
+        self.times = times
+        self.results = results
+
+    def getName(self):
+        return self.name
+
+    def getTimes(self):
+        return self.times
+
+    def getResults(self):
+        return (self.results, [])
+
+
+class FakeBuild(object):
+
+    def getBuilder(self):
+        return Fake(getName=lambda: 'my.project slave1')
+
+    def getRequests(self):
+        return [Fake(getSubmitTime=lambda: 90.0),
+                Fake(getSubmitTime=lambda: 95.0)]
+
+    def getSteps(self):
+        return [FakeStep('svn', (100.0, 110.0), SUCCESS),
+                FakeStep('test', (110.0, 160.0), FAILURE),
+                FakeStep('skipped', (None, None), None)]
+
+    def getTimes(self):
+        return (100.0, 160.0)
+
+    def getNumber(self):
+        return 3
+
+    def getSlavename(self):
+        return 'slave1'
+
+    def getResults(self):
+        return FAILURE
+
+
+class TestBuildRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.recorder = BuildRecorder('stats.log')
+        self.recorder.path = os.path.join(self.basedir, 'stats.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def test_record(self):
+        self.recorder.buildFinished('my.project slave1', FakeBuild(), FAILURE)
+        records = list(read_records(self.recorder.path))
+        self.assertEqual([{'builder': 'my.project slave1',
+                           'project': 'my.project',
+                           'number': 3,
+                           'slave': 'slave1',
+                           'result': 'failure',
+                           'submitted': 90.0,
+                           'started': 100.0,
+                           'finished': 160.0,
+                           'steps': [['svn', 100.0, 110.0, 'success'],
+                                     ['test', 110.0, 160.0, 'failure']]}],
+                         records)
+
+    def test_broken_lines(self):
+        self.recorder.buildFinished('my.project slave1', FakeBuild(), FAILURE)
+        open(self.recorder.path, 'a').write('{"builder": "cut')
+        self.assertEqual(1, len(list(read_records(self.recorder.path))))
+        self.assertEqual(0, len(list(read_records(self.recorder.path,
+                                                  since=200))))
+
+    def test_missing_file(self):
+        self.assertEqual([], list(read_records(self.recorder.path)))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestBuildRecorder))
+    return suite
@@ -0,0 +1,36 @@
+import unittest
+from collective.buildbot.benchmark import measure_config, synthetic_changes
+from collective.buildbot.benchmark import measure_dispatch
+
+
+class TestConfigBenchmark(unittest.TestCase):
+
+    def test_measure_config(self):
+        result = measure_config(20, changes=10)
+        self.assertEqual(20, result['projects'])
+        self.assertEqual(2, result['pollers'])
+        self.assertEqual(40, result['builders'])
+        # svn and dependencies schedulers, nightly builds and one dependent
+        self.assertEqual(20 + 4 + 2 + 1, result['schedulers'])
+        self.assertEqual(10, result['changes'])
+
+    def test_synthetic_changes(self):
+        changes = synthetic_changes(5, 20)
+        self.assertEqual(20, len(changes))
+        self.assertEqual(2, len([c for c in changes if c.branch is None]))
+        self.assertEqual([c.files for c in changes],
+                         [c.files for c in synthetic_changes(5, 20)])
+
+    def test_measure_dispatch(self):
+        result = measure_dispatch(10, commits=40, files=3, batch=15)
+        self.assertEqual(40, result['commits'])
+        # changes of tags are outside of the projects
+        self.failUnless(30 < result['changes'] < 40)
+        self.failUnless(result['latency_p50'] <= result['latency_p99'] <=
+                        result['latency_max'])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestConfigBenchmark))
+    return suite
@@ -0,0 +1,150 @@
+import unittest
+from buildbot.process.base import BuildRequest
+from buildbot.process.factory import BuildFactory, s
+from buildbot.process.properties import Properties
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status.builder import SUCCESS, FAILURE
+from buildbot.steps.shell import ShellCommand
+from buildbot.steps.source import SVN
+from collective.buildbot.cache import CachedBuild, fingerprint
+
+
+class FakeBuildStatus(object):
+
+    def __init__(self, number=None, results=None, **properties):
+        self.number = number
+        self.results = results
+        self.properties = Properties(**properties)
+
+    def getNumber(self):
+        return self.number
+
+    def getResults(self):
+        return self.results
+
+    def getProperties(self):
+        return self.properties
+
+    def getProperty(self, name):
+        return self.properties[name]
+
+    def setProperty(self, name, value, source):
+        self.properties.setProperty(name, value, source)
+
+    def getSourceStamp(self):
+        return SourceStamp()
+
+
+class FakeBuilderStatus(object):
+
+    def __init__(self, builds):
+        self.builds = builds
+
+    def getName(self):
+        return 'project_slave'
+
+    def generateFinishedBuilds(self, branches=[], max_search=200):
+        return iter(self.builds[:max_search])
+
+
+class FakeMaster(object):
+
+    properties = Properties()
+
+
+class FakeBotMaster(object):
+
+    parent = FakeMaster()
+
+
+class FakeBuilder(object):
+
+    name = 'project_slave'
+    botmaster = FakeBotMaster()
+
+    def __init__(self, builds, factory):
+        self.builder_status = FakeBuilderStatus(builds)
+        self.buildFactory = factory
+
+
+sequence = [s(SVN, svnurl='http://svn/project/trunk'),
+            s(ShellCommand, command=['bin/test'])]
+digest = fingerprint(sequence)
+
+
+class TestCachedBuild(unittest.TestCase):
+
+    def build(self, builds, scheduler='nightly', periodic=True,
+              revision='42'):
+        properties = Properties()
+        if scheduler is not None:
+            properties.setProperty('scheduler', scheduler, 'Scheduler')
+        if periodic:
+            properties.setProperty('periodic', True, 'Scheduler')
+        request = BuildRequest('periodic build', SourceStamp(),
+                               'project_slave', properties=properties)
+        factory = BuildFactory(sequence)
+        factory.fingerprint = digest
+        build = CachedBuild([request])
+        build.setBuilder(FakeBuilder(builds, factory))
+        build.build_status = FakeBuildStatus()
+        build.setupProperties()
+        build.setProperty('got_revision', revision, 'Source')
+        build.remote = True
+        build.result = SUCCESS
+        build.results = []
+        build.text = []
+        source = SVN(svnurl='http://svn/project/trunk')
+        build.steps = [ShellCommand(command=['bin/test'])]
+        build.stepDone(SUCCESS, source)
+        return build
+
+    def skipped(self, build):
+        return build.steps[0].doStepIf is False
+
+    def test_fingerprint_property(self):
+        build = self.build([])
+        self.assertEqual(build.getProperty('build_fingerprint'), digest)
+        self.failIf(self.skipped(build))
+
+    def test_unchanged(self):
+        last = FakeBuildStatus(12, SUCCESS, got_revision='42',
+                               build_fingerprint=digest)
+        build = self.build([last])
+        self.failUnless(self.skipped(build))
+        self.assertEqual(build.getProperty('cached_build'), 12)
+        self.assertEqual(build.text, ['unchanged', 'since', '#12'])
+
+    def test_last_success(self):
+        failed = FakeBuildStatus(13, FAILURE, got_revision='42',
+                                 build_fingerprint=digest)
+        last = FakeBuildStatus(12, SUCCESS, got_revision='42',
+                               build_fingerprint=digest)
+        self.failUnless(self.skipped(self.build([failed, last])))
+
+    def test_new_revision(self):
+        last = FakeBuildStatus(12, SUCCESS, got_revision='41',
+                               build_fingerprint=digest)
+        self.failIf(self.skipped(self.build([last])))
+
+    def test_new_configuration(self):
+        last = FakeBuildStatus(12, SUCCESS, got_revision='42',
+                               build_fingerprint='0' * 32)
+        self.failIf(self.skipped(self.build([last])))
+
+    def test_forced(self):
+        last = FakeBuildStatus(12, SUCCESS, got_revision='42',
+                               build_fingerprint=digest)
+        self.failIf(self.skipped(self.build([last], scheduler=None,
+                                            periodic=False)))
+
+    def test_dependent(self):
+        """Builds triggered by upstream projects always run"""
+        last = FakeBuildStatus(12, SUCCESS, got_revision='42',
+                               build_fingerprint=digest)
+        self.failIf(self.skipped(self.build([last], scheduler='dependent',
+                                            periodic=False)))
+
+
+def test_suite():
+    return unittest.TestSuite([unittest.makeSuite(TestCachedBuild)])
@@ -0,0 +1,279 @@
+import os
+import shutil
+import tempfile
+import zlib
+import unittest
+from twisted.internet import defer, task
+from buildbot.slave import commands
+from buildbot.slave.bot import SlaveBuilder
+import collective.buildbot
+from collective.buildbot import _environmentHeader
+from collective.buildbot.project import Project
+
+
+class FakeBuilder(object):
+    pass
+
+
+class FakeCommand(object):
+
+    def __init__(self, builder, environ):
+        self.builder = builder
+        self.environ = environ
+
+
+class TestEnvironmentHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.builder = FakeBuilder()
+
+    def tearDown(self):
+        collective.buildbot.environment_header = 'full'
+
+    def header(self, **environ):
+        return _environmentHeader(FakeCommand(self.builder, environ))
+
+    def test_full(self):
+        self.assertEqual(' environment:\n  A=1\n  B=2\n',
+                         self.header(A='1', B='2'))
+
+    def test_diff(self):
+        collective.buildbot.environment_header = 'diff'
+        self.assertEqual(' environment:\n  A=1\n  B=2\n',
+                         self.header(A='1', B='2'))
+        self.assertEqual(' environment: unchanged\n',
+                         self.header(A='1', B='2'))
+        self.assertEqual(' environment changes:\n  A=3\n  unset B\n',
+                         self.header(A='3'))
+        # a new build reports the whole environment again
+        self.builder._reported_environ = None
+        self.assertEqual(' environment:\n  A=3\n', self.header(A='3'))
+
+    def test_hash(self):
+        collective.buildbot.environment_header = 'hash'
+        header = self.header(A='1')
+        self.assertTrue(header.startswith(' environment: 1 variables, sha1 '))
+        self.assertEqual(header, self.header(A='1'))
+        self.assertNotEqual(header, self.header(A='2'))
+
+    def test_off(self):
+        collective.buildbot.environment_header = 'off'
+        self.assertEqual(None, self.header(A='1'))
+
+
+class FakeRemoteStep(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, name, *args):
+        self.calls.append((name,) + args)
+        return defer.succeed(0)
+
+    def dontNotifyOnDisconnect(self, callback):
+        pass
+
+
+class TestUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = collective.buildbot.reactor
+        collective.buildbot.reactor = self.clock
+        self.builder = SlaveBuilder('test', False)
+        self.builder.running = True
+        self.builder.remoteStep = self.step = FakeRemoteStep()
+
+    def tearDown(self):
+        collective.buildbot.reactor = self.reactor
+        collective.buildbot.update_interval = 0.1
+        collective.buildbot.update_size = 16 * 1024
+        collective.buildbot.compress_output = 0
+
+    def test_interval(self):
+        self.builder.sendUpdate({'header': 'a\n'})
+        self.builder.sendUpdate({'stdout': 'b'})
+        self.builder.sendUpdate({'stdout': 'c'})
+        self.builder.sendUpdate({'stderr': 'd'})
+        self.assertEqual([], self.step.calls)
+        self.clock.advance(0.1)
+        self.assertEqual([('update', [[{'header': 'a\n'}, 0],
+                                      [{'stdout': 'bc'}, 0],
+                                      [{'stderr': 'd'}, 0]])],
+                         self.step.calls)
+
+    def test_size(self):
+        collective.buildbot.update_size = 4
+        self.builder.sendUpdate({'stdout': 'ab'})
+        self.assertEqual([], self.step.calls)
+        self.builder.sendUpdate({'stdout': 'cd'})
+        self.assertEqual([('update', [[{'stdout': 'abcd'}, 0]])],
+                         self.step.calls)
+        self.clock.advance(1)
+        self.assertEqual(1, len(self.step.calls))
+
+    def test_complete(self):
+        self.builder.sendUpdate({'stdout': 'ab'})
+        self.builder.sendUpdate({'rc': 0})
+        self.builder.commandComplete(None)
+        self.assertEqual([('update', [[{'stdout': 'ab'}, 0],
+                                      [{'rc': 0}, 0]]),
+                          ('complete', None)],
+                         self.step.calls)
+
+    def test_disabled(self):
+        collective.buildbot.update_interval = 0
+        self.builder.sendUpdate({'stdout': 'ab'})
+        self.assertEqual([('update', [[{'stdout': 'ab'}, 0]])],
+                         self.step.calls)
+
+    def test_compress(self):
+        collective.buildbot.compress_output = 6
+        output = 'x' * 2048
+        self.builder.sendUpdate({'stdout': output})
+        self.builder.sendUpdate({'rc': 0})
+        self.builder.flushUpdates()
+        updates = self.step.calls[0][1]
+        key, data = updates[0][0]['compressed']
+        self.assertEqual(('stdout', output), (key, zlib.decompress(data)))
+        self.assertEqual({'rc': 0}, updates[1][0])
+
+
+class TestRetry(unittest.TestCase):
+
+    def steps(self, **options):
+        c = {'builders': [], 'slaves': []}
+        Project(name='project', slave_names='slave', **options).setBuilder(c)
+        klass, kwargs = c['builders'][0]['factory'].steps[0]
+        return klass(**kwargs)
+
+    def test_backoff(self):
+        """Backoff and jitter are sent apart from retry"""
+        for options in ({'repository': 'http://svn/project/trunk'},
+                        {'vcs': 'git', 'repository': 'git://git/project'}):
+            step = self.steps(vcs_retry='10 3 2 0.5', **options)
+            self.assertEqual((10, 3), step.args['retry'])
+            self.assertEqual(2.0, step.args['retry_backoff'])
+            self.assertEqual(0.5, step.args['retry_jitter'])
+
+    def test_stock_retry(self):
+        step = self.steps(repository='http://svn/project/trunk',
+                          vcs_retry='10 3')
+        self.assertEqual((10, 3), step.args['retry'])
+        self.failIf('retry_backoff' in step.args)
+
+    def test_no_retry(self):
+        """Retries can be turned off"""
+        for value in ('10 0', ''):
+            step = self.steps(repository='http://svn/project/trunk',
+                              vcs_retry=value)
+            self.assertEqual(None, step.args['retry'])
+
+    def test_slave(self):
+        """The slave retries with the backoff and the jitter"""
+        args = {'workdir': 'build', 'repourl': 'git://git/project',
+                'branch': 'master', 'retry': (10, 3), 'retry_backoff': 2.0,
+                'retry_jitter': 0.5}
+        command = commands.Git(FakeBuilder(), 'id', args)
+        self.assertEqual((10, 3, 2.0, 0.5), command.retry)
+
+
+class FakeShellCommand(object):
+
+    def __init__(self, test):
+        self.test = test
+
+    def __call__(self, builder, command, workdir, **kwargs):
+        self.test.commands.append(command)
+        return self
+
+    def start(self):
+        if self.test.results:
+            return self.test.results.pop(0)
+        return defer.succeed(0)
+
+
+class FakeSlaveBuilder(object):
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+    def sendUpdate(self, status):
+        pass
+
+
+class TestMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.commands = []
+        self.results = []
+        self.ShellCommand = commands.ShellCommand
+        collective.buildbot.ShellCommand = FakeShellCommand(self)
+        commands.ShellCommand = collective.buildbot.ShellCommand
+
+    def tearDown(self):
+        collective.buildbot.ShellCommand = self.ShellCommand
+        commands.ShellCommand = self.ShellCommand
+        shutil.rmtree(self.tmpdir)
+
+    def command(self, builder='builder'):
+        args = {'workdir': 'build', 'repourl': 'git://git/project',
+                'branch': 'master', 'mirror': True}
+        builder = FakeSlaveBuilder(os.path.join(self.tmpdir, builder))
+        return commands.Git(builder, 'id', args)
+
+    def test_upstream(self):
+        """The mirror is fetched from, its upstream is kept"""
+        command = self.command()
+        mirror = command._mirrorDir()
+        command._updateMirror()
+        self.assertEqual(['clone', '--mirror', 'git://git/project', mirror],
+                         self.commands[0][1:])
+        self.assertEqual('git://git/project', command.repourl)
+        self.assertEqual(mirror, command.fetchurl)
+        # a retry updates the same mirror
+        os.makedirs(mirror)
+        command._updateMirror()
+        self.assertEqual(mirror, command._mirrorDir())
+        self.assertEqual(['--git-dir', mirror, 'fetch'],
+                         self.commands[-1][1:])
+
+    def test_shared(self):
+        """The builders of a slave update their mirror in turn"""
+        first, second = self.command('first'), self.command('second')
+        mirror = first._mirrorDir()
+        self.assertEqual(mirror, second._mirrorDir())
+        os.makedirs(mirror)
+        fetched = defer.Deferred()
+        self.results = [fetched]
+        first._updateMirror()
+        second._updateMirror()
+        self.assertEqual(1, len(self.commands))
+        fetched.callback(0)
+        self.assertEqual(2, len(self.commands))
+        self.assertEqual(self.commands[0], self.commands[1])
+
+    def test_fallback(self):
+        """A clean build fetches from upstream when the mirror fails"""
+        command = self.command()
+        # set by start
+        command.srcdir = 'build'
+        command.sourcedatafile = os.path.join(self.tmpdir, 'sourcedata')
+        self.results = [defer.succeed(1)]
+        command.doVCFull()
+        mirror = command._mirrorDir()
+        mirror_commands = [c for c in self.commands if mirror in c]
+        self.assertEqual(1, len(mirror_commands))
+        self.assertEqual(['init'], self.commands[1][1:])
+        self.assertEqual(['fetch', '-t', 'git://git/project', '+master'],
+                         self.commands[2][1:])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestEnvironmentHeader))
+    suite.addTest(unittest.makeSuite(TestUpdates))
+    suite.addTest(unittest.makeSuite(TestRetry))
+    suite.addTest(unittest.makeSuite(TestMirror))
+    return suite
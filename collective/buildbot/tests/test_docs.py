@@ -11,9 +11,24 @@ import zc.buildout.testing
 from ConfigParser import ConfigParser
 
 from zope.testing import doctest, renormalizing
+import collective.buildbot.analytics
+import collective.buildbot.benchmark
+import collective.buildbot.cache
+import collective.buildbot.coalesce
+import collective.buildbot.cron
+import collective.buildbot.jsonstatus
+import collective.buildbot.locks
+import collective.buildbot.logs
+import collective.buildbot.metrics
+import collective.buildbot.overrides
+import collective.buildbot.paths
 import collective.buildbot.poller
+import collective.buildbot.profiling
 import collective.buildbot.project
 import collective.buildbot.project_recipe
+import collective.buildbot.retention
+import collective.buildbot.scheduler
+import collective.buildbot.utils
 
 optionflags =  (doctest.ELLIPSIS |
                 doctest.NORMALIZE_WHITESPACE |
@@ -94,9 +109,25 @@ def test_suite():
             for filename in test_files if os.path.isfile(join(DOCTEST_DIR, filename))])
 
     # doc test suite
+    suite.addTest(doctest.DocTestSuite(collective.buildbot))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.analytics))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.benchmark))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.cache))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.coalesce))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.cron))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.jsonstatus))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.locks))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.logs))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.metrics))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.overrides))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.paths))
     suite.addTest(doctest.DocTestSuite(collective.buildbot.poller))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.profiling))
     suite.addTest(doctest.DocTestSuite(collective.buildbot.project))
     suite.addTest(doctest.DocTestSuite(collective.buildbot.project_recipe))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.retention))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.scheduler))
+    suite.addTest(doctest.DocTestSuite(collective.buildbot.utils))
     return suite
 
 if __name__ == '__main__':
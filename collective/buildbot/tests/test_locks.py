@@ -0,0 +1,83 @@
+import unittest
+from twisted.internet import defer, reactor, task
+from collective.buildbot import locks
+from collective.buildbot.locks import WeightedSlaveLock, WeightedLock
+from collective.buildbot.locks import get_lock
+
+
+class TestWeightedLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lockid = WeightedSlaveLock('capacity', maxCount=4)
+
+    def test_weights_add_up_to_capacity(self):
+        lock = WeightedLock('capacity', 4)
+        heavy = self.lockid.access(weight=3)
+        light = self.lockid.access(weight=1)
+        self.assertTrue(lock.isAvailable(heavy))
+        lock.claim('build1', heavy)
+        self.assertTrue(lock.isAvailable(light))
+        lock.claim('build2', light)
+        self.assertFalse(lock.isAvailable(light))
+        lock.release('build1', heavy)
+        self.assertTrue(lock.isAvailable(heavy))
+
+    def test_too_heavy_build_runs_alone(self):
+        lock = WeightedLock('capacity', 4)
+        huge = self.lockid.access(weight=10)
+        light = self.lockid.access(weight=1)
+        self.assertTrue(lock.isAvailable(huge))
+        lock.claim('build1', huge)
+        self.assertFalse(lock.isAvailable(light))
+
+    def test_no_capacity_means_no_limit(self):
+        lock = WeightedLock('capacity', None)
+        access = self.lockid.access(weight=100)
+        lock.claim('build1', access)
+        self.assertTrue(lock.isAvailable(access))
+
+    def test_exclusive(self):
+        """An exclusive access holds the lock alone"""
+        lock = WeightedLock('capacity', None)
+        exclusive = self.lockid.access('exclusive')
+        light = self.lockid.access(weight=1)
+        lock.claim('build1', light)
+        self.assertFalse(lock.isAvailable(exclusive))
+        lock.release('build1', light)
+        self.assertTrue(lock.isAvailable(exclusive))
+        lock.claim('build2', exclusive)
+        self.assertFalse(lock.isAvailable(light))
+        self.assertFalse(lock.isAvailable(exclusive))
+
+    def test_exclusive_waiters(self):
+        """Waiters after an exclusive one wait for its release"""
+        lock = WeightedLock('capacity', 4)
+        exclusive = self.lockid.access('exclusive')
+        light = self.lockid.access(weight=1)
+        lock.claim('build1', light)
+        woken = []
+        for access in (exclusive, light):
+            d = defer.Deferred()
+            d.addCallback(lambda lock, access=access: woken.append(access))
+            lock.waiting.append((access, d))
+        clock = locks.reactor = task.Clock()
+        try:
+            lock.release('build1', light)
+            clock.advance(0)
+        finally:
+            locks.reactor = reactor
+        self.assertEqual([exclusive], woken)
+        self.assertEqual([light], [access for access, d in lock.waiting])
+
+    def test_get_lock_shares_equal_locks(self):
+        lock = get_lock(WeightedSlaveLock, 'shared', maxCount=2)
+        self.assertTrue(
+            lock is get_lock(WeightedSlaveLock, 'shared', maxCount=2))
+        self.assertFalse(
+            lock is get_lock(WeightedSlaveLock, 'shared', maxCount=3))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestWeightedLock))
+    return suite
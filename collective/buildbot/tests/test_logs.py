@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+from twisted.internet import reactor
+from twisted.web import server
+from buildbot.status.builder import LogFile
+from collective.buildbot import logs
+
+
+class FakeBuilder(object):
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+
+class FakeStep(object):
+
+    def __init__(self, basedir):
+        self.build = self
+        self.builder = FakeBuilder(basedir)
+
+
+class FakeRequest(object):
+
+    finished = False
+    producer = None
+
+    def __init__(self):
+        self.written = []
+
+    def setHeader(self, name, value):
+        pass
+
+    def childLink(self, name):
+        return name
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+
+    def finish(self):
+        self.finished = True
+
+
+class TestCompressedLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.logfile = LogFile(FakeStep(self.basedir), 'stdio', '1-log-stdio')
+        self.logfile.addHeader('make test\n')
+        for i in range(1000):
+            self.logfile.addStdout('line %d\n' % i)
+        self.logfile.addStderr('failed\n')
+        self.logfile.finish()
+
+    def tearDown(self):
+        logs.tail_size = 64 * 1024
+        shutil.rmtree(self.basedir)
+
+    def compress(self, method):
+        self.logfile.compressMethod = method
+        compressed = self.logfile.getFilename() + '.%s.tmp' % method
+        self.logfile._compressLog(compressed)
+        self.logfile._renameCompressedLog(None, compressed)
+        self.assertFalse(os.path.exists(self.logfile.getFilename()))
+
+    def test_tail(self):
+        logs.tail_size = 16
+        self.compress('gz')
+        self.assertTrue(os.path.exists(logs.getTailFilename(self.logfile)))
+        self.assertEqual([(0, 'line 999\n'), (1, 'failed\n')],
+                         logs.getTail(self.logfile))
+        self.assertEqual([(1, 'led\n')], logs.getTail(self.logfile, 4))
+
+    def test_tail_bigger_than_saved(self):
+        logs.tail_size = 4
+        self.compress('bz2')
+        # the log is read to give more than its saved tail
+        self.assertEqual([(0, 'line 999\n'), (1, 'failed\n')],
+                         logs.getTail(self.logfile, 16))
+
+    def test_stream(self):
+        self.compress('bz2')
+        class Consumer(object):
+            def registerProducer(self, producer, streaming):
+                pass
+            def unregisterProducer(self):
+                pass
+        producer = logs.StreamingLogFileProducer(self.logfile, Consumer())
+        text = ''.join([text for channel, text in producer.getChunks()])
+        self.assertEqual(self.logfile.getTextWithHeaders(), text)
+        self.assertTrue(text.endswith('line 999\nfailed\n'))
+
+    def test_render(self):
+        """The page of a finished log is sent whole"""
+        self.compress('bz2')
+        request = FakeRequest()
+        resource = logs.TextLog(self.logfile)
+        self.assertEqual(server.NOT_DONE_YET, resource.render_GET(request))
+        for i in range(10):
+            if request.finished:
+                break
+            reactor.iterate()
+        self.assertTrue(request.finished)
+        page = ''.join(request.written)
+        self.assertTrue(page.startswith('<html>'))
+        self.assertTrue('line 999\n' in page)
+        self.assertTrue(page.endswith('</pre>\n</body></html>\n'))
+        self.assertEqual(None, request.producer)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestCompressedLogs))
+    return suite
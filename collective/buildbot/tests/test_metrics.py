@@ -0,0 +1,94 @@
+import unittest
+from twisted.internet import defer
+from collective.buildbot.metrics import Metrics, timed
+from collective.buildbot import metrics
+from collective.buildbot import profiling
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = metrics.metrics
+        metrics.metrics = Metrics()
+        metrics.counter = metrics.metrics.counter
+        metrics.timer = metrics.metrics.timer
+
+    def tearDown(self):
+        metrics.metrics = self.metrics
+        metrics.counter = self.metrics.counter
+        metrics.timer = self.metrics.timer
+
+
+class TestMetrics(MetricsTestCase):
+
+    def test_render(self):
+        metrics.counter('changes_total', accepted='true').inc(2)
+        metrics.counter('changes_total', accepted='false').inc()
+        self.assertEqual('# TYPE changes_total counter\n'
+                         'changes_total{accepted="false"} 1\n'
+                         'changes_total{accepted="true"} 2\n',
+                         metrics.metrics.render())
+
+    def test_timed(self):
+        calls = []
+        @timed('call_seconds')
+        def call(fail=False):
+            calls.append(fail)
+            if fail:
+                raise ValueError
+            return 'result'
+        self.assertEqual('result', call())
+        self.assertRaises(ValueError, call, True)
+        self.assertEqual(2, metrics.timer('call_seconds').count)
+        self.assertEqual(1, metrics.counter('call_seconds_errors').value)
+
+    def test_timed_deferred(self):
+        d = defer.Deferred()
+        timed('poll_seconds')(lambda: d)()
+        timer = metrics.timer('poll_seconds')
+        self.assertEqual(0, timer.count)
+        d.callback(None)
+        self.assertEqual(1, timer.count)
+
+
+class FakeProject(object):
+
+    name = 'my.project'
+
+    @profiling.watched
+    def setBuilder(self, c):
+        c['builders'].append(self.name)
+
+
+class TestWatched(MetricsTestCase):
+
+    def tearDown(self):
+        profiling.slow_call_threshold = None
+        MetricsTestCase.tearDown(self)
+
+    def test_off(self):
+        c = {'builders': []}
+        FakeProject().setBuilder(c)
+        self.assertEqual(['my.project'], c['builders'])
+        self.assertEqual({}, metrics.metrics.metrics)
+
+    def test_slow_calls(self):
+        profiling.slow_call_threshold = -1
+        FakeProject().setBuilder({'builders': []})
+        self.assertEqual(1, metrics.timer('call_seconds',
+                         function='FakeProject.setBuilder').count)
+        self.assertEqual(1, metrics.counter('slow_calls_total',
+                         function='FakeProject.setBuilder').value)
+
+    def test_fast_calls(self):
+        profiling.slow_call_threshold = 60
+        FakeProject().setBuilder({'builders': []})
+        self.assertEqual(0, metrics.counter('slow_calls_total',
+                         function='FakeProject.setBuilder').value)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestMetrics))
+    suite.addTest(unittest.makeSuite(TestWatched))
+    return suite
@@ -0,0 +1,88 @@
+import os
+import time
+import shutil
+import cPickle
+import tempfile
+import unittest
+from buildbot.status.builder import SUCCESS, FAILURE
+from collective.buildbot.retention import Pruner, DAY
+
+
+class FakeBuild(object):
+
+    def __init__(self, number, results):
+        self.number = number
+        self.results = results
+
+    def getNumber(self):
+        return self.number
+
+    def getResults(self):
+        return self.results
+
+
+class FakeBuilder(object):
+
+    name = 'project'
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.nextBuildNumber = 0
+        self.currentBuilds = []
+
+    def getCurrentBuilds(self):
+        return self.currentBuilds
+
+    def addBuild(self, results, days):
+        number = self.nextBuildNumber
+        self.nextBuildNumber += 1
+        filename = os.path.join(self.basedir, str(number))
+        cPickle.dump(FakeBuild(number, results), open(filename, 'wb'))
+        open(filename + '-log-test-stdio', 'w').write('log')
+        mtime = time.time() - days * DAY
+        os.utime(filename, (mtime, mtime))
+
+
+class TestPruner(unittest.TestCase):
+
+    def setUp(self):
+        self.builder = FakeBuilder(tempfile.mkdtemp())
+        for days in (40, 20, 10, 1):
+            self.builder.addBuild(SUCCESS, days)
+            self.builder.addBuild(FAILURE, days)
+
+    def tearDown(self):
+        shutil.rmtree(self.builder.basedir)
+
+    def prune(self, **kwargs):
+        list(Pruner(**kwargs).pruneBuilder(self.builder))
+        return sorted(os.listdir(self.builder.basedir))
+
+    def test_no_limit(self):
+        self.assertEqual(16, len(self.prune()))
+
+    def test_keep_builds(self):
+        self.assertEqual(['6', '6-log-test-stdio', '7', '7-log-test-stdio'],
+                         self.prune(keep_builds=2))
+
+    def test_keep_days(self):
+        self.assertEqual(['4', '4-log-test-stdio', '5', '5-log-test-stdio',
+                          '6', '6-log-test-stdio', '7', '7-log-test-stdio'],
+                         self.prune(keep_days=15))
+
+    def test_keep_failed_logs(self):
+        self.assertEqual(['0', '1', '2', '3', '3-log-test-stdio', '4',
+                          '5', '5-log-test-stdio', '6', '6-log-test-stdio',
+                          '7', '7-log-test-stdio'],
+                         self.prune(keep_logs_days=5,
+                                    keep_failed_logs_days=30))
+
+    def test_running_builds_are_kept(self):
+        self.builder.currentBuilds = [FakeBuild(0, None)]
+        self.assertTrue('0' in self.prune(keep_builds=1))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestPruner))
+    return suite
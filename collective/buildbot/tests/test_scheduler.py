@@ -1,7 +1,65 @@
+import os
+import time
 import unittest
 from buildbot.changes.changes import Change
-from collective.buildbot.scheduler import SVNScheduler
-from collective.buildbot.project import convert_cron_to_setting
+from buildbot.process.properties import Properties
+from buildbot.status.builder import SUCCESS, EXCEPTION
+from collective.buildbot.scheduler import SVNScheduler, AdaptiveScheduler
+from collective.buildbot.scheduler import ChangedPeriodic, ChangedNightly
+from collective.buildbot.scheduler import CronScheduler
+from collective.buildbot.cron import CronTab, parse_field
+from collective.buildbot.paths import PathIndex, PathChecker
+
+
+class FakeBuild(object):
+
+    def __init__(self, results, revision):
+        self.results = results
+        self.properties = Properties(got_revision=revision)
+
+    def getResults(self):
+        return self.results
+
+    def getProperties(self):
+        return self.properties
+
+
+class FakeBuilderStatus(object):
+
+    def __init__(self, *builds):
+        self.builds = list(builds)
+
+    def generateFinishedBuilds(self, branches=[], max_search=200):
+        return iter(self.builds)
+
+
+class FakeStatus(object):
+
+    def __init__(self, builders):
+        self.builders = builders
+
+    def getBuilder(self, name):
+        return self.builders[name]
+
+
+class FakePoller(object):
+
+    svnurl = 'https://svn/repo'
+    last_change = 100
+
+
+class FakeMaster(object):
+
+    def __init__(self, **builders):
+        self.status = FakeStatus(builders)
+        self.change_svc = [FakePoller()]
+        self.buildsets = []
+
+    def getStatus(self):
+        return self.status
+
+    def submitBuildSet(self, bs):
+        self.buildsets.append(bs)
 
 
 class TestScheduler(unittest.TestCase):
@@ -18,49 +76,186 @@ class TestScheduler(unittest.TestCase):
         sched.addChange(c)
         self.assertTrue(c.branch)
 
+    def test_adaptive_timer(self):
+        """A single change waits for the short timer, a burst for the
+        long one.
+        """
+        sched = AdaptiveScheduler('test', None, 10, ['ignores'],
+                                  burstTimer=300)
+        sched.setTimer = lambda when: None
+        sched.addChange(Change('nobody', ['a'], 'first', when=1000))
+        self.assertEqual(1010, sched.nextBuildTime)
+        sched.addChange(Change('nobody', ['b'], 'second', when=1005))
+        self.assertEqual(1305, sched.nextBuildTime)
+
+    def test_paths(self):
+        """Changes outside of the paths of a project are not important"""
+        index = PathIndex()
+        index.add('app', ['src/app'])
+        index.add('lib', ['src/lib/*.py'])
+        scheds = [SVNScheduler(name, ['ignores'], 'https://svn/repo/trunk',
+                               fileIsImportant=PathChecker(name, index))
+                  for name in ('app', 'lib')]
+        for sched in scheds:
+            sched.setTimer = lambda when: None
+        c = Change('nobody', ['src/lib/utils.py'], 'lib', branch='repo/trunk')
+        for sched in scheds:
+            sched.addChange(c)
+        self.assertEqual([0, 1],
+                         [len(sched.importantChanges) for sched in scheds])
+        self.assertEqual([1, 1], [len(sched.allChanges) for sched in scheds])
+
+    def periodic(self, builder, klass=ChangedPeriodic):
+        if klass is ChangedPeriodic:
+            sched = klass('test', ['a_slave'], 3600, onlyIfChanged=True,
+                          repository='https://svn/repo/a/trunk')
+        else:
+            sched = klass('test', ['a_slave'], onlyIfChanged=True,
+                          repository='https://svn/repo/a/trunk')
+            sched.setTimer = lambda: None
+        sched.parent = FakeMaster(a_slave=builder)
+        return sched
+
+    def test_only_if_changed(self):
+        """Periodic builds happen when the latest revision of the branch
+        was not built yet"""
+        for klass in (ChangedPeriodic, ChangedNightly):
+            builder = FakeBuilderStatus(FakeBuild(SUCCESS, '100'))
+            sched = self.periodic(builder, klass)
+            # nothing committed since the poller started
+            sched.doPeriodicBuild()
+            self.assertEqual(0, len(sched.parent.buildsets))
+            # changes of other projects
+            for branch in ('b/trunk', 'po/a/trunk', 'repo/a'):
+                sched.addChange(Change('nobody', ['setup.py'], 'other',
+                                       branch=branch, revision=101))
+            sched.doPeriodicBuild()
+            self.assertEqual(0, len(sched.parent.buildsets))
+            sched.addChange(Change('nobody', ['setup.py'], 'mine',
+                                   branch='a/trunk', revision=102))
+            sched.doPeriodicBuild()
+            self.assertEqual(1, len(sched.parent.buildsets))
+            # built, possibly with newer revisions
+            builder.builds.insert(0, FakeBuild(SUCCESS, '103'))
+            sched.doPeriodicBuild()
+            self.assertEqual(1, len(sched.parent.buildsets))
+
+    def test_periodic_property(self):
+        """The builds of periodic schedulers can be skipped"""
+        for klass in (ChangedPeriodic, ChangedNightly):
+            sched = self.periodic(FakeBuilderStatus(), klass)
+            self.assertEqual(True, sched.properties.getProperty('periodic'))
+
+    def test_only_if_changed_unknown(self):
+        """Builds happen when the revisions are not known"""
+        builder = FakeBuilderStatus(FakeBuild(SUCCESS, '90'))
+        sched = self.periodic(builder)
+        sched.doPeriodicBuild()
+        self.assertEqual(1, len(sched.parent.buildsets))
+        sched = self.periodic(FakeBuilderStatus(FakeBuild(EXCEPTION, '100')))
+        sched.doPeriodicBuild()
+        self.assertEqual(1, len(sched.parent.buildsets))
+        sched = self.periodic(FakeBuilderStatus())
+        sched.parent.change_svc = []
+        sched.doPeriodicBuild()
+        self.assertEqual(1, len(sched.parent.buildsets))
+
     def test_cron_settings(self):
-        """Test parsing of the cron scheduler.
+        """Test parsing of the cron expressions.
         """
+        def fields(expression):
+            cron = CronTab(expression)
+            return [cron.minutes, cron.hours, cron.days, cron.months,
+                    cron.weekdays]
         # All integers
         self.assertEqual(
-            [1, 2, 3, 4, 5],
-            convert_cron_to_setting('1 2 3 4 5'))
+            [[1], [2], [3], [4], [5]],
+            fields('1 2 3 4 5'))
         # Every minute
         self.assertEqual(
-            ['*', '*', '*', '*', '*'],
-            convert_cron_to_setting('* * * * *'))
+            [range(60), range(24), range(1, 32), range(1, 13), range(7)],
+            fields('* * * * *'))
         # Minute range
         self.assertEqual(
-            [[0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55], 0, 0, '*', '*'],
-            convert_cron_to_setting('*/5 0 0 * *'))
+            [0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55],
+            parse_field('*/5', 0, 59))
         # Hour range
-        self.assertEqual(
-            [0, [0, 4, 8, 12, 16, 20], '*', '*', '*'],
-            convert_cron_to_setting('0 */4 * * *'))
+        self.assertEqual([0, 4, 8, 12, 16, 20], parse_field('*/4', 0, 23))
         # Day range
-        self.assertEqual(
-            [0, 0, [1, 8, 15, 22, 29], '*', '*'],
-            convert_cron_to_setting('0 0 */7 * *'))
+        self.assertEqual([1, 8, 15, 22, 29], parse_field('*/7', 1, 31))
         # Month range
-        self.assertEqual(
-            [0, 0, 0, [1, 3, 5, 7, 9, 11], '*'],
-            convert_cron_to_setting('0 0 0 */2 *'))
-        # Day of week range
-        self.assertEqual(
-            [0, 0, '*', '*', [0, 2, 4, 6]],
-            convert_cron_to_setting('0 0 * * */2'))
+        self.assertEqual([1, 3, 5, 7, 9, 11], parse_field('*/2', 1, 12))
+        # Day of week range, Sunday being 0 or 7
+        self.assertEqual([0, 2, 4, 6], fields('0 0 * * */2')[4])
+        self.assertEqual([0, 1], fields('0 0 * * 1,7')[4])
         # Hour list
+        self.assertEqual([6, 8, 12, 16], parse_field('6,8,12,16', 0, 23))
+        # Ranges, steps on ranges and names
         self.assertEqual(
-            [0, [6, 8, 12, 16], '*', '*', '*'],
-            convert_cron_to_setting('0 6,8,12,16 * * *'))
+            [[0, 10, 20, 30], [1, 2, 3, 4, 5], range(1, 32), [1, 2, 3],
+             [1, 5]],
+            fields('0-30/10 1-5 * jan-mar mon,fri'))
+
+    def test_cron_days(self):
+        """Restricted days of month and of week match either, like cron"""
+        friday_13 = (2010, 8, 13, 3, 0)
+        friday_6 = (2010, 8, 6, 3, 0)
+        monday_13 = (2010, 9, 13, 3, 0)
+        cron = CronTab('0 3 13 * fri')
+        self.failUnless(cron.matches(friday_13))
+        self.failUnless(cron.matches(friday_6))
+        self.failUnless(cron.matches(monday_13))
+        # days starting with * do not restrict: both must match
+        cron = CronTab('0 3 */2 * fri')
+        self.failUnless(cron.matches(friday_13))
+        self.failIf(cron.matches(friday_6))
+        self.failIf(cron.matches(monday_13))
+        cron = CronTab('0 3 13 * */2')
+        self.failIf(cron.matches(friday_13))
+        self.failIf(cron.matches(friday_6))
+        self.failIf(cron.matches(monday_13))
+        self.failUnless(cron.matches((2010, 6, 13, 3, 0)))
+
+    def test_cron_scheduler(self):
+        """The cron scheduler computes its next build time"""
+        sched = CronScheduler('test', ['ignores'], '30 4 * * sun')
+        now = time.mktime((2010, 1, 1, 12, 0, 0, 0, 0, -1))
+        self.assertEqual(time.mktime((2010, 1, 3, 4, 30, 0, 0, 0, -1)),
+                         sched.calculateNextRunTimeFrom(now))
+        # a timer firing early does not build the same time again
+        sched.nextRunTime = time.time() + 60
+        self.failUnless(sched.calculateNextRunTime() > sched.nextRunTime)
+
+    def test_cron_daylight_saving(self):
+        """The next build time is in the future in the repeated hour"""
+        tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        try:
+            sched = CronScheduler('test', ['ignores'], '*/5 * * * *')
+            # 2010-11-07 01:25, the second time, in standard time
+            now = 1289111100
+            self.assertEqual(now + 300, sched.calculateNextRunTimeFrom(now))
+        finally:
+            if tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = tz
+            time.tzset()
 
     def test_invalid_cron_settings(self):
         """Cron scheduler parser can fail.
         """
         self.assertRaises(
-            ValueError, convert_cron_to_setting, 'Whenever I whish')
+            ValueError, CronTab, 'Whenever I whish')
+        self.assertRaises(
+            ValueError, CronTab, 'a b c d e')
+        self.assertRaises(
+            ValueError, CronTab, '1-70 * * * *')
+        self.assertRaises(
+            ValueError, parse_field, '*/0', 0, 59)
         self.assertRaises(
-            ValueError, convert_cron_to_setting, 'a b c d e')
+            ValueError, CronScheduler, 'test', ['ignores'], '0 0 0 * *')
 
 
 def test_suite():
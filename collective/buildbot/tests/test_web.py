@@ -0,0 +1,265 @@
+import json
+import time
+import unittest
+from twisted.internet import defer
+from twisted.web import http
+from twisted.web.resource import Resource
+from buildbot.status.builder import FAILURE
+from buildbot.status.web import baseweb
+from collective.buildbot.overrides import CachedResource, PageCache
+from collective.buildbot.overrides import WebStatus
+from collective.buildbot.jsonstatus import StatusTracker, JsonStatusResource
+from collective.buildbot.jsonstatus import EventStream, EventStreamResource
+
+
+class FakeRequest(object):
+
+    method = 'GET'
+
+    def __init__(self, uri, etag=None, **args):
+        self.uri = uri
+        self.etag = etag
+        self.headers = {}
+        self.args = args
+        self.written = []
+        self.finished = defer.Deferred()
+
+    def write(self, data):
+        self.written.append(data)
+
+    def notifyFinish(self):
+        return self.finished
+
+    def setHeader(self, name, value):
+        self.headers[name.lower()] = value
+
+    def setETag(self, etag):
+        self.headers['etag'] = etag
+        if etag == self.etag:
+            return http.CACHED
+
+    def setLastModified(self, when):
+        pass
+
+
+class Page(Resource):
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.renders = 0
+
+    def render(self, request):
+        self.renders += 1
+        request.setHeader('content-type', 'text/html')
+        return '<html>%d</html>' % self.renders
+
+
+class TestCachedResource(unittest.TestCase):
+
+    def setUp(self):
+        self.page = Page()
+        self.cache = PageCache(ttl=60)
+        self.resource = CachedResource(self.page, self.cache)
+
+    def render(self, uri='/waterfall', etag=None):
+        request = FakeRequest(uri, etag)
+        return request, self.resource.render(request)
+
+    def test_cached(self):
+        request, data = self.render()
+        self.assertEqual('<html>1</html>', data)
+        request, data = self.render()
+        self.assertEqual('<html>1</html>', data)
+        self.assertEqual('text/html', request.headers['content-type'])
+        request, data = self.render('/waterfall?page=1')
+        self.assertEqual('<html>2</html>', data)
+
+    def test_invalidated_by_builds(self):
+        self.render()
+        self.assertTrue(self.cache.buildStarted('project', None) is
+                        self.cache)
+        request, data = self.render()
+        self.assertEqual('<html>2</html>', data)
+
+    def test_etag(self):
+        request, data = self.render()
+        request, data = self.render(etag=request.headers['etag'])
+        self.assertEqual('', data)
+        self.assertEqual(1, self.page.renders)
+
+    def test_disabled(self):
+        self.cache.ttl = 0
+        self.render()
+        request, data = self.render()
+        self.assertEqual('<html>2</html>', data)
+
+    def test_reconfigured(self):
+        """Changing the options makes a new web status"""
+        self.assertEqual(WebStatus(http_port=8010, cache_ttl=60),
+                         WebStatus(http_port=8010, cache_ttl=60))
+        self.assertNotEqual(WebStatus(http_port=8010, cache_ttl=60),
+                            WebStatus(http_port=8010, cache_ttl=0))
+        self.assertNotEqual(WebStatus(http_port=8010),
+                            WebStatus(http_port=8010, builders_per_page=20))
+
+    def test_missing_pages(self):
+        """Buildbot 0.7.9 has no console and tgrid pages"""
+        def setupUsualPages(self, *args, **kwargs):
+            _setupUsualPages(self, *args, **kwargs)
+            del self.childrenToBeAdded['console']
+            del self.childrenToBeAdded['tgrid']
+        _setupUsualPages = baseweb.WebStatus.setupUsualPages
+        baseweb.WebStatus.setupUsualPages = setupUsualPages
+        try:
+            web = WebStatus(http_port=8010)
+        finally:
+            baseweb.WebStatus.setupUsualPages = _setupUsualPages
+        self.failIf('console' in web.childrenToBeAdded)
+        self.assertTrue(isinstance(web.childrenToBeAdded['waterfall'],
+                                   CachedResource))
+
+
+class FakeBuild(object):
+
+    def __init__(self, number, builder=None):
+        self.number = number
+        self.builder = builder
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getTimes(self):
+        return (10, 20)
+
+
+class FakeBuilder(object):
+
+    def __init__(self, name, state='idle', pending=0):
+        self.name = name
+        self.state = state
+        self.pending = pending
+
+    def getName(self):
+        return self.name
+
+    def getState(self):
+        return (self.state, [])
+
+    def getCurrentBuilds(self):
+        return []
+
+    def getPendingBuilds(self):
+        return [None] * self.pending
+
+    def getLastFinishedBuild(self):
+        return None
+
+
+class FakeStatus(object):
+
+    def __init__(self, *builders):
+        self.builders = dict([(b.name, b) for b in builders])
+
+    def getBuilderNames(self):
+        return sorted(self.builders)
+
+    def getBuilder(self, name):
+        return self.builders[name]
+
+
+class TestJsonStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = StatusTracker()
+        self.status = FakeStatus(FakeBuilder('a slave1', 'building', 2),
+                                 FakeBuilder('a slave2'),
+                                 FakeBuilder('b slave1'))
+        self.resource = JsonStatusResource(self.tracker)
+        self.resource.getStatus = lambda request: self.status
+
+    def get(self, **args):
+        args = dict([(k, [v]) for k, v in args.items()])
+        request = FakeRequest('/json', **args)
+        data = json.loads(self.resource.render_GET(request))
+        self.assertEqual('application/json', request.headers['content-type'])
+        return data
+
+    def test_projects(self):
+        self.tracker.buildFinished('a slave2', FakeBuild(3), FAILURE)
+        projects = self.get()['projects']
+        self.assertEqual(['a', 'b'], sorted(projects))
+        self.assertEqual(('building', 2, 'failure'),
+                         (projects['a']['state'], projects['a']['queue'],
+                          projects['a']['last_result']))
+        builder = projects['a']['builders']['a slave2']
+        self.assertEqual((3, 'failure', 20),
+                         (builder['last_build'], builder['last_result'],
+                          builder['last_finished']))
+        self.assertEqual(['b'], self.get(project='b')['projects'].keys())
+
+    def test_since(self):
+        for name in self.status.getBuilderNames():
+            self.tracker.builderAdded(name, None)
+        since = self.get()['time']
+        self.assertEqual({}, self.get(since=repr(since))['projects'])
+        time.sleep(0.01)
+        self.tracker.builderChangedState('b slave1', 'idle')
+        self.assertEqual(['b'],
+                         self.get(since=repr(since))['projects'].keys())
+
+
+class FakeStep(object):
+
+    def getName(self):
+        return 'test'
+
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = EventStream()
+        self.resource = EventStreamResource(self.stream)
+
+    def connect(self, **args):
+        args = dict([(k, [v]) for k, v in args.items()])
+        request = FakeRequest('/events', **args)
+        self.resource.render_GET(request)
+        return request
+
+    def test_server_sent_events(self):
+        request = self.connect()
+        self.assertEqual('text/event-stream', request.headers['content-type'])
+        build = FakeBuild(3, FakeBuilder('a slave1'))
+        self.assertTrue(self.stream.buildStarted('a slave1', build)
+                        is self.stream)
+        self.stream.stepFinished(build, FakeStep(), (FAILURE, []))
+        event = request.written[-1].split('\n')
+        self.assertEqual(['id: 2', 'event: stepFinished'], event[:2])
+        data = json.loads(event[2][len('data: '):])
+        self.assertEqual(('a', 3, 'test', 'failure'),
+                         (data['project'], data['number'], data['step'],
+                          data['result']))
+        request.finished.callback(None)
+        self.assertEqual([], self.stream.clients)
+        self.assertEqual(None, self.stream.loop)
+
+    def test_lines_of_a_project(self):
+        request = self.connect(format='lines', project='b')
+        self.stream.buildFinished('a slave1', FakeBuild(1), FAILURE)
+        self.stream.buildFinished('b slave1', FakeBuild(2), FAILURE)
+        self.assertEqual(1, len(request.written))
+        data = json.loads(request.written[0])
+        self.assertEqual(('buildFinished', 'b slave1', 2),
+                         (data['type'], data['builder'], data['number']))
+        request.finished.callback(None)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestCachedResource))
+    suite.addTest(unittest.makeSuite(TestJsonStatus))
+    suite.addTest(unittest.makeSuite(TestEventStream))
+    return suite
@@ -1,19 +1,164 @@
 # -*- coding: utf-8 -*-
+import heapq
+
+
+class DependencyCycle(ValueError):
+    """Raised when items of a Registry depend on each other"""
+
+    def __init__(self, cycle):
+        self.cycle = cycle
+        ValueError.__init__(self, 'loops have been detected: %s' %
+                            ' -> '.join(cycle))
 
 
 class Registry(object):
-    """Registry to run callable.
+    """Registry to run callable, after the ones they depend on::
+
+        >>> calls = []
+        >>> registry = Registry()
+        >>> for name, depends in (('app', ['lib', 'core']), ('lib', ['core']),
+        ...                       ('core', []), ('docs', [])):
+        ...     registry.add(name, lambda name=name: calls.append(name),
+        ...                  depends)
+        >>> registry.order()
+        ['core', 'lib', 'app', 'docs']
+        >>> registry.everyone()
+        >>> calls
+        ['core', 'lib', 'app', 'docs']
+
+    The graph of the dependencies can be drawn with graphviz::
+
+        >>> sorted(registry.graph().items())
+        [('app', ['core', 'lib']), ('core', []), ('docs', []), ('lib', ['core'])]
+        >>> print registry.dot('projects')
+        digraph "projects" {
+          "core";
+          "lib";
+          "app";
+          "docs";
+          "core" -> "lib";
+          "lib" -> "app";
+          "core" -> "app";
+        }
+
+    Loops are reported with the items in the loop::
+
+        >>> registry.add('core', None, ['app'])
+        >>> registry.order()
+        Traceback (most recent call last):
+        ...
+        DependencyCycle: loops have been detected: app -> lib -> core -> app
     """
-    
+
     def __init__(self):
         self.klass = dict()
-        self.called = list()
+        self.depends = dict()
+        self.called = set()
         self.running = list()
-        self.order = []
+        self.positions = dict()
+        self._order = None
 
-    def add(self, name, item):
-        self.order.append(name)
+    def add(self, name, item, depends=()):
+        """Add item as name, depending on the items named in depends"""
+        if name not in self.positions:
+            self.positions[name] = len(self.positions)
         self.klass[name] = item
+        self.depends[name] = list(depends)
+        self._order = None
+
+    def graph(self):
+        """Return the names of the items each item depends on"""
+        return dict([(name, sorted(depends))
+                     for name, depends in self.depends.items()])
+
+    def dot(self, title='registry'):
+        """Return the graph of the dependencies in the graphviz format, an
+        arrow going from an item to the ones depending on it"""
+        lines = ['digraph "%s" {' % title]
+        order = self.order()
+        for name in order:
+            lines.append('  "%s";' % name)
+        for name in order:
+            for depend in self.depends[name]:
+                if depend in self.klass:
+                    lines.append('  "%s" -> "%s";' % (depend, name))
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def immediate(self, name):
+        """Return the dependencies of name which are not already
+        dependencies of its other dependencies. Unrelated dependencies
+        are all returned, even when they share a dependency::
+
+            >>> registry = Registry()
+            >>> registry.add('core', None)
+            >>> registry.add('lib', None, ['core'])
+            >>> registry.add('app', None, ['core', 'lib', 'unknown'])
+            >>> registry.immediate('app')
+            ['lib', 'unknown']
+            >>> registry.add('web', None, ['core'])
+            >>> registry.add('site', None, ['lib', 'web'])
+            >>> registry.immediate('site')
+            ['lib', 'web']
+        """
+        depends = self.depends.get(name, [])
+        if len(depends) < 2:
+            return list(depends)
+        reachable = set()
+        for depend in depends:
+            stack = list(self.depends.get(depend, []))
+            while stack:
+                ancestor = stack.pop()
+                if ancestor not in reachable:
+                    reachable.add(ancestor)
+                    stack.extend(self.depends.get(ancestor, []))
+        return [d for d in depends if d not in reachable]
+
+    def order(self):
+        """Return the names of the items, each one after the ones it depends
+        on and else in ``add`` order. Computed once for all the items"""
+        if self._order is not None:
+            return self._order
+        dependents = dict([(name, []) for name in self.klass])
+        waiting = {}
+        for name, depends in self.depends.items():
+            depends = set([d for d in depends if d in self.klass])
+            waiting[name] = len(depends)
+            for depend in depends:
+                dependents[depend].append(name)
+        ready = [(self.positions[item], item)
+                 for item, count in waiting.items() if not count]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            position, name = heapq.heappop(ready)
+            order.append(name)
+            for dependent in dependents[name]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    heapq.heappush(ready, (self.positions[dependent],
+                                           dependent))
+        if len(order) < len(self.klass):
+            raise DependencyCycle(self.findCycle(
+                [item for item, count in waiting.items() if count]))
+        self._order = order
+        return order
+
+    def findCycle(self, names):
+        """Return a loop of dependencies between names, the items left out
+        of the topological order"""
+        left = set(names)
+        # every item left depends on another one left, so following the
+        # dependencies from any of them ends in a loop
+        name = min(names, key=self.positions.get)
+        path = []
+        seen = {}
+        while name not in seen:
+            seen[name] = len(path)
+            path.append(name)
+            name = min([d for d in self.depends[name] if d in left],
+                       key=self.positions.get)
+        return path[seen[name]:] + [name]
 
     def run(self, name, *args, **kwargs):
         """Call a value called name.
@@ -21,11 +166,14 @@ class Registry(object):
         if name in self.called:
             return
         if name in self.running:
-            raise ValueError, "loops have been detected"
+            cycle = self.running[self.running.index(name):] + [name]
+            raise DependencyCycle(cycle)
         self.running.append(name)
-        self.klass[name](*args, **kwargs)
-        self.running.remove(name)
-        self.called.append(name)
+        try:
+            self.klass[name](*args, **kwargs)
+        finally:
+            self.running.pop()
+        self.called.add(name)
 
     def runned(self, name, *args, **kwargs):
         """Return a called value.
@@ -35,10 +183,9 @@ class Registry(object):
         return self.klass[name]
 
     def everyone(self, *args, **kwargs):
-        """Call everyone, in ``add`` order.
+        """Call everyone, the ones they depend on first.
         """
-        order = [m for i, m in enumerate(self.order) if m not in self.order[:i]]
-        for name in order:
+        for name in self.order():
             self.run(name, *args, **kwargs)
 
 